@@ -0,0 +1,252 @@
+"""
+Pipeline benchmark: times (and optionally memory-profiles) every stage on synthetic
+ICU data of growing size and saves the results as JSON for comparison between runs.
+
+    python -m benchmarks.run --sizes 1e3,1e4,1e5,1e6 --repeat 3 --memory
+    python -m benchmarks.run --sizes 1e5 --baseline benchmarks/results/<earlier run>.json
+
+Sizes are source rows (the generator picks the number of patients). The pipeline
+stages work in memory, so very large sizes (1e7, 1e8) need a correspondingly large
+machine; `--source-csv` additionally writes the generated source to disk by streaming.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.datadict import DataDictionary
+from src.export import write_redcap_csv
+from src.redcap_project import parse_project_xml
+from src.template import Template, is_mapped
+from src.transform import (
+    TransformContext,
+    aggregate_field,
+    aggregate_group,
+    calculate_field,
+    collect_queries,
+    pivot_wide,
+    _level_tasks,
+)
+
+from .synthetic import patients_for_rows, generate_source, write_project_xml, write_source_csv
+
+ROOT = Path(__file__).resolve().parent.parent
+STAGES = ["datadict", "template", "xml", "query", "calc", "aggregate", "pivot", "export"]
+
+
+class StageTimer:
+    """Accumulated wall time and peak traced memory (above the stage's start) per stage"""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.seconds: Dict[str, float] = {}
+        self.peak_bytes: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - started
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), peak)
+
+
+def run_stages(
+    source: pd.DataFrame,
+    template_path: Path,
+    datadict_path: Path,
+    xml_path: Path,
+    workdir: Path,
+    timer: StageTimer,
+) -> None:
+    """One serial pass over all STAGES; the transform is unrolled to time each stage separately"""
+    with timer.stage("datadict"):
+        DataDictionary.from_csv(str(datadict_path))
+    with timer.stage("template"):
+        template = Template.from_yaml(str(template_path))
+    with timer.stage("xml"):
+        parse_project_xml(str(xml_path))
+
+    with timer.stage("query"):
+        ctx = TransformContext(source, template)
+        for query_string in collect_queries(template):
+            ctx.planner.positions(query_string)
+        for field in template.fields:
+            mappings = ([field.source] if field.source else []) + list((field.calc_vars or {}).values())
+            for mapping in mappings:
+                if mapping.constant is None and mapping.query_string:
+                    ctx.measurements(mapping, default_timestamp=field.source.timestamp if field.source else None)
+
+    mapped = {f.field_name for f in template.fields if is_mapped(f)}
+    for level in template.evaluation_levels():
+        fields = [ctx.fields[name] for name in level if name in mapped]
+        for task in _level_tasks(fields):
+            if task[0].calculation_expr:
+                with timer.stage("calc"):
+                    frame = calculate_field(task[0], ctx)
+                with timer.stage("aggregate"):
+                    ctx.results[task[0].field_name] = aggregate_field(task[0], frame, ctx)
+            else:
+                frame = ctx.measurements(task[0].source)
+                with timer.stage("aggregate"):
+                    for field, result in zip(task, aggregate_group(task, frame, ctx)):
+                        ctx.results[field.field_name] = result
+    results = [ctx.results[f.field_name] for f in template.fields if f.field_name in ctx.results]
+
+    with timer.stage("pivot"):
+        pivot_wide(results, template)
+    with timer.stage("export"):
+        write_redcap_csv(results, template, str(workdir / "export.csv"))
+
+
+def benchmark_size(
+    size: int,
+    template_path: Path,
+    datadict_path: Path,
+    days: int,
+    sampling: str,
+    repeat: int,
+    memory: bool,
+    seed: int,
+    source_csv: bool,
+) -> List[dict]:
+    template = Template.from_yaml(str(template_path))
+    patients = patients_for_rows(template, size, days)
+    started = time.perf_counter()
+    source = generate_source(template, patients, days=days, sampling=sampling, seed=seed)
+    generate_seconds = time.perf_counter() - started
+    print(f"{size:>12,} rows requested: {len(source):,} rows, {patients:,} patients (generated in {generate_seconds:.2f}s)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        xml_path = workdir / "project.xml"
+        write_project_xml(str(xml_path), template, patients)
+        if source_csv:
+            write_source_csv(str(workdir / "source.csv"), template, patients, days=days, sampling=sampling, seed=seed)
+
+        best: Dict[str, float] = {}
+        for _ in range(repeat):
+            timer = StageTimer()
+            run_stages(source, template_path, datadict_path, xml_path, workdir, timer)
+            for stage, seconds in timer.seconds.items():
+                best[stage] = min(best.get(stage, seconds), seconds)
+        peaks: Dict[str, int] = {}
+        if memory:
+            tracemalloc.start()
+            timer = StageTimer(trace_memory=True)
+            try:
+                run_stages(source, template_path, datadict_path, xml_path, workdir, timer)
+            finally:
+                tracemalloc.stop()
+            peaks = timer.peak_bytes
+
+    results = []
+    for stage in STAGES:
+        seconds = best.get(stage, 0.0)
+        results.append({
+            "size": size,
+            "rows": len(source),
+            "patients": patients,
+            "stage": stage,
+            "seconds": seconds,
+            "rows_per_second": len(source) / seconds if seconds > 0 else None,
+            "peak_mib": peaks[stage] / 2**20 if stage in peaks else None,
+        })
+        memory_text = f"  peak {results[-1]['peak_mib']:9.1f} MiB" if stage in peaks else ""
+        print(f"    {stage:<10} {seconds:9.4f}s{memory_text}")
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[dict], baseline: dict, threshold: float, min_seconds: float) -> List[str]:
+    """Stages that got slower than the baseline by more than `threshold` (relative)"""
+    previous = {(r["size"], r["stage"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get((result["size"], result["stage"]))
+        if old is None or old["seconds"] < min_seconds:
+            continue
+        ratio = result["seconds"] / old["seconds"]
+        line = f"{result['size']:>12,} {result['stage']:<10} {old['seconds']:9.4f}s -> {result['seconds']:9.4f}s ({ratio:5.2f}x)"
+        if ratio > 1 + threshold:
+            regressions.append(line)
+            print(f"Regression: {line}")
+        else:
+            print(f"            {line}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1e3,1e4,1e5,1e6", help="comma-separated source row counts (e.g. 1e3,1e6)")
+    parser.add_argument("--template", default=str(ROOT / "templates" / "example_template.yaml"))
+    parser.add_argument("--datadict", default=str(ROOT / "data" / "datadict.csv"))
+    parser.add_argument("--days", type=int, default=3, help="ICU days per patient")
+    parser.add_argument("--sampling", choices=["hourly", "irregular"], default="hourly")
+    parser.add_argument("--repeat", type=int, default=1, help="timing runs per size (the fastest counts)")
+    parser.add_argument("--memory", action="store_true", help="extra run with tracemalloc for peak memory per stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--source-csv", action="store_true", help="also stream the source to a CSV file")
+    parser.add_argument("--output", help="result JSON (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative slowdown flagged as regression")
+    parser.add_argument("--min-seconds", type=float, default=0.01, help="ignore baseline stages faster than this")
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(s)) for s in args.sizes.split(",") if s.strip()]
+    results = []
+    for size in sizes:
+        results.extend(benchmark_size(
+            size, Path(args.template), Path(args.datadict), args.days, args.sampling,
+            max(1, args.repeat), args.memory, args.seed, args.source_csv,
+        ))
+
+    run = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "results": results,
+    }
+    output = Path(args.output) if args.output else ROOT / "benchmarks" / "results" / f"{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(run, indent=2), encoding="utf-8")
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if compare(results, baseline, args.threshold, args.min_seconds):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+import ast
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Iterator, List, Optional
+from xml.sax.saxutils import escape
+
+from src.calculation import parse_expression
+from src.template import Template, TemplateField
+from src.transform import field_queries, parse_query
+
+SOURCE_COLUMNS = ["Patienten-ID", "parameter", "category", "timestamp", "value", "rate"]
+
+# Timestamp formats mixed in the source, as in real PDMS exports
+TIMESTAMP_FORMATS = ["%d.%m.%Y %H:%M", "%Y-%m-%d %H:%M:%S"]
+_TIMESTAMP_WRITERS = [
+    lambda iso: f"{iso[8:10]}.{iso[5:7]}.{iso[0:4]} {iso[11:16]}",
+    lambda iso: f"{iso[0:10]} {iso[11:16]}:00",
+]
+
+# Value ranges by (lowercase) parameter substring: low, high, decimals
+_VALUE_RANGES = [
+    ("hf ", (50, 150, 0)),
+    ("af ", (8, 35, 0)),
+    ("spo2", (85, 100, 0)),
+    ("rr sys", (90, 160, 0)),
+    ("rr dia", (45, 90, 0)),
+    ("temp", (35.5, 39.5, 1)),
+    ("hb ", (6, 14, 1)),
+    ("leukozyten", (2, 25, 1)),
+    ("gewicht", (50, 120, 1)),
+    ("größe", (150, 200, 0)),
+    ("körperoberfläche", (1.5, 2.3, 2)),
+    ("hzv", (3, 8, 1)),
+    ("ci ", (1.5, 4.5, 2)),
+    ("epinephrin", (1, 10, 1)),
+    ("empressin", (1, 4, 1)),
+    ("propofol", (5, 30, 1)),
+    ("cillin", (1, 4, 0)),
+    ("vancomycin", (1, 2, 0)),
+    ("meropenem", (1, 2, 0)),
+    ("huminsulin", (1, 6, 1)),
+    ("augen", (1, 4, 0)),
+    ("einfuhr", (50, 250, 0)),
+    ("ausfuhr", (20, 200, 0)),
+]
+
+# Category by (lowercase) parameter substring; everything else is a vital sign
+_CATEGORIES = [
+    ("hb ", "Labor"), ("leukozyten", "Labor"), ("sars", "Labor"),
+    ("gewicht", "Stamm"), ("größe", "Stamm"), ("geburtsdatum", "Stamm"), ("körperoberfläche", "Stamm"),
+    ("augen", "Neuro"),
+    ("epinephrin", "Medikation"), ("empressin", "Medikation"), ("propofol", "Medikation"), ("huminsulin", "Medikation"),
+    ("cillin", "Antiinfektiva"), ("vancomycin", "Antiinfektiva"), ("meropenem", "Antiinfektiva"),
+]
+
+
+class ParameterSpec(BaseModel):
+    """One generated source parameter and what its values look like"""
+    parameter: str
+    category: str
+    value_column: str = "value"  # "value" or "rate"
+    low: float = 0.0
+    high: float = 100.0
+    decimals: int = 1
+    static: bool = True  # one value per patient (at admission) instead of a time series
+    texts: List[str] = []  # text values (e.g. lab results) instead of numbers
+    is_date: bool = False
+
+
+def _lookup(table, name: str, default):
+    lower = name.lower() + " "
+    for key, value in table:
+        if key in lower:
+            return value
+    return default
+
+
+def _query_names(query_string: str) -> Optional[tuple]:
+    """(column, literal names) a query matches; regex alternatives are split"""
+    predicate = parse_query(query_string)
+    if predicate is None:
+        return None
+    if predicate.kind == "contains":
+        names = predicate.pattern.split("|") if predicate.regex else [predicate.pattern]
+    else:
+        names = predicate.values
+    return predicate.column, [n for n in names if n]
+
+
+def _text_values(field: TemplateField) -> List[str]:
+    """String keys of dict lookups in the field's calculation (e.g. {'negativ': 4, ...}.get(...))"""
+    if not field.calculation_expr:
+        return []
+    keys = []
+    for node in ast.walk(parse_expression(field.calculation_expr)):
+        if isinstance(node, ast.Dict):
+            keys.extend(k.value for k in node.keys if isinstance(k, ast.Constant) and isinstance(k.value, str))
+    return keys
+
+
+def template_parameters(template: Template) -> List[ParameterSpec]:
+    """
+    Source parameters the template's queries select: `parameter` queries give parameter
+    names, `category` queries a parameter of that category. Parameters read by
+    interval or repeating fields are time series, the others one value per patient.
+    """
+    specs = {}
+    for field in template.fields:
+        mappings = ([field.source] if field.source else []) + list((field.calc_vars or {}).values())
+        value_columns = {m.query_string: m.query_value or "value" for m in mappings if m.query_string}
+        texts = _text_values(field)
+        for query_string in field_queries(field):
+            matched = _query_names(query_string)
+            if matched is None:
+                print(f"Warning: Query '{query_string}' of field '{field.field_name}' is not generated")
+                continue
+            column, names = matched
+            for name in names:
+                parameter = name if column == "parameter" else f"{name} (Bilanz)"
+                category = name if column == "category" else _lookup(_CATEGORIES, name, "Vital")
+                low, high, decimals = _lookup(_VALUE_RANGES, parameter, (0, 100, 1))
+                spec = specs.setdefault(parameter, ParameterSpec(
+                    parameter=parameter, category=category, low=low, high=high, decimals=decimals,
+                    value_column=value_columns.get(query_string, "value"),
+                    is_date="datum" in parameter.lower(),
+                ))
+                spec.static = spec.static and not (field.time_interval or field.repeat_instrument)
+                if texts and not spec.texts:
+                    spec.texts = texts
+    return list(specs.values())
+
+
+def rows_per_patient(specs: List[ParameterSpec], days: int) -> float:
+    """Expected source rows per patient (irregular sampling averages one value per hour, too)"""
+    return sum(1 if s.static else days * 24 for s in specs)
+
+
+def _format_numbers(values: np.ndarray, decimals: int) -> np.ndarray:
+    """Numbers as text with German decimal commas, formatting each distinct value once"""
+    uniques, codes = np.unique(np.round(values, decimals), return_inverse=True)
+    text = np.array([f"{v:.{decimals}f}".replace(".", ",") for v in uniques], dtype=object)
+    return text[codes]
+
+
+def _format_timestamps(times: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Timestamps as text, each row in one of TIMESTAMP_FORMATS (distinct minutes formatted once)"""
+    uniques, codes = np.unique(times.astype("datetime64[m]"), return_inverse=True)
+    iso = np.datetime_as_string(uniques, unit="m").tolist()  # fast C formatting, rearranged below
+    formatted = np.array([[write(t) for t in iso] for write in _TIMESTAMP_WRITERS], dtype=object)
+    return formatted[rng.integers(0, len(TIMESTAMP_FORMATS), len(times)), codes]
+
+
+def _patient_block(
+    specs: List[ParameterSpec],
+    first: int,
+    count: int,
+    days: int,
+    sampling: str,
+    rng: np.random.Generator,
+) -> pd.DataFrame:
+    admissions = (
+        np.datetime64("2025-01-01T00:00", "m")
+        + rng.integers(0, 365 * 24 * 60, count).astype("timedelta64[m]")
+    )
+    stay_minutes = days * 24 * 60
+    columns = {c: [] for c in ("patient", "spec", "time")}
+    for index, spec in enumerate(specs):
+        if spec.static:
+            patients = np.arange(count)
+            offsets = np.zeros(count, dtype=np.int64)
+        elif sampling == "hourly":
+            hours = days * 24
+            patients = np.repeat(np.arange(count), hours)
+            offsets = np.tile(np.arange(hours) * 60, count) + rng.integers(0, 50, count * hours)
+        else:
+            # irregular: a random number of measurements per patient at random times
+            samples = rng.poisson(days * 24, count)
+            patients = np.repeat(np.arange(count), samples)
+            offsets = rng.integers(0, stay_minutes, samples.sum())
+        columns["patient"].append(patients)
+        columns["spec"].append(np.full(len(patients), index))
+        columns["time"].append(admissions[patients] + offsets.astype("timedelta64[m]"))
+    patients = np.concatenate(columns["patient"])
+    spec_index = np.concatenate(columns["spec"])
+    times = np.concatenate(columns["time"])
+    order = np.lexsort((times, patients))
+    patients, spec_index, times = patients[order], spec_index[order], times[order]
+
+    values = np.full(len(patients), None, dtype=object)
+    for index, spec in enumerate(specs):
+        rows = np.flatnonzero(spec_index == index)
+        if spec.is_date:
+            births = np.datetime64("1930-01-01") + rng.integers(0, 75 * 365, len(rows)).astype("timedelta64[D]")
+            values[rows] = pd.DatetimeIndex(births).strftime("%d.%m.%Y").to_numpy(dtype=object)
+        elif spec.texts:
+            values[rows] = np.array(spec.texts, dtype=object)[rng.integers(0, len(spec.texts), len(rows))]
+        else:
+            values[rows] = _format_numbers(rng.uniform(spec.low, spec.high, len(rows)), spec.decimals)
+    is_rate = np.array([s.value_column == "rate" for s in specs])[spec_index]
+    return pd.DataFrame({
+        "Patienten-ID": np.char.add("P", (patients + first).astype(str)).astype(object),
+        "parameter": np.array([s.parameter for s in specs], dtype=object)[spec_index],
+        "category": np.array([s.category for s in specs], dtype=object)[spec_index],
+        "timestamp": _format_timestamps(times, rng),
+        "value": np.where(is_rate, None, values),
+        "rate": np.where(is_rate, values, None),
+    }, columns=SOURCE_COLUMNS)
+
+
+def iter_source(
+    template: Template,
+    n_patients: int,
+    days: int = 3,
+    sampling: str = "hourly",
+    seed: int = 0,
+    block_patients: int = 1000,
+) -> Iterator[pd.DataFrame]:
+    """
+    Synthetic long-format ICU source data for a template, in blocks of `block_patients`
+    complete patients (so sizes beyond memory can be streamed to disk). Each patient
+    has `days` of data sampled hourly (`sampling="hourly"`, minutes jittered) or at
+    random times (`"irregular"`); values use German decimal commas and timestamps
+    mix the formats of TIMESTAMP_FORMATS. Output is deterministic for a seed.
+    """
+    if sampling not in ("hourly", "irregular"):
+        raise ValueError(f"Unknown sampling '{sampling}' (use 'hourly' or 'irregular')")
+    specs = template_parameters(template)
+    rng = np.random.default_rng(seed)
+    for first in range(0, n_patients, block_patients):
+        yield _patient_block(specs, first, min(block_patients, n_patients - first), days, sampling, rng)
+
+
+def generate_source(template: Template, n_patients: int, **options) -> pd.DataFrame:
+    """All of `iter_source` as one DataFrame"""
+    blocks = list(iter_source(template, n_patients, **options))
+    return pd.concat(blocks, ignore_index=True) if blocks else pd.DataFrame(columns=SOURCE_COLUMNS)
+
+
+def write_source_csv(path: str, template: Template, n_patients: int, sep: str = ";", **options) -> int:
+    """Stream `iter_source` blocks into a CSV file; returns the number of rows written"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for i, block in enumerate(iter_source(template, n_patients, **options)):
+            block.to_csv(f, sep=sep, index=False, header=i == 0)
+            rows += len(block)
+    return rows
+
+
+def patients_for_rows(template: Template, rows: int, days: int = 3) -> int:
+    """Number of patients that gives about `rows` source rows"""
+    return max(1, round(rows / rows_per_patient(template_parameters(template), days)))
+
+
+def write_project_xml(path: str, template: Template, n_patients: int = 0) -> None:
+    """
+    A REDCap project XML with the template's events and repeating instruments; with
+    `n_patients`, a <ClinicalData> section like a full export with data is appended.
+    """
+    events = list(dict.fromkeys(f.event_name for f in template.fields if f.event_name))
+    arms = sorted({e.rsplit("_arm_", 1)[1] for e in events if "_arm_" in e}) or ["1"]
+    repeating = list(dict.fromkeys((f.repeat_instrument, f.event_name or "") for f in template.fields if f.repeat_instrument))
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<ODM>\n<Study>\n<arms>\n')
+        for arm in arms:
+            f.write(f"<arm><arm_id>{escape(arm)}</arm_id><arm_name>Arm {escape(arm)}</arm_name></arm>\n")
+        f.write("</arms>\n<events>\n")
+        for i, event in enumerate(events, start=1):
+            arm = event.rsplit("_arm_", 1)[1] if "_arm_" in event else "1"
+            f.write(
+                f"<event><event_id>{i}</event_id><event_name>{escape(event)}</event_name>"
+                f"<unique_event_name>{escape(event)}</unique_event_name><arm_id>{escape(arm)}</arm_id></event>\n"
+            )
+        f.write("</events>\n<repeatingInstruments>\n")
+        for instrument, event in repeating:
+            f.write(f"<item><instrument>{escape(instrument)}</instrument><eventUniqueName>{escape(event)}</eventUniqueName></item>\n")
+        f.write("</repeatingInstruments>\n</Study>\n<ClinicalData>\n")
+        for patient in range(n_patients):
+            f.write(
+                f'<SubjectData SubjectKey="P{patient}"><StudyEventData StudyEventOID="{escape(events[0]) if events else ""}">'
+                f'<FormData FormOID="demography"><ItemGroupData><ItemData ItemOID="record_id" Value="P{patient}"/>'
+                f"</ItemGroupData></FormData></StudyEventData></SubjectData>\n"
+            )
+        f.write("</ClinicalData>\n</ODM>\n")
@@ -0,0 +1,491 @@
+import operator
+import re
+import time
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from .datadict import DataDictionary, DataDictionaryField
+from .template import Template, TemplateField
+from .utils import to_numeric
+from .validation import VIOLATION_COLUMNS
+
+RULE_HIDDEN = "hidden"  # value on a row where the field's branching logic hides it
+
+_KEYS = ["record_id", "redcap_event_name", "redcap_repeat_instance"]
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<ref>\[[^\[\]]*\])
+  | '(?P<single>[^']*)' | "(?P<double>[^"]*)"
+  | (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<op><=|>=|<>|!=|==|=|<|>)
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<paren>[()])
+)""", re.VERBOSE)
+
+# [field], [field(code)] for a checkbox option
+_REFERENCE = re.compile(r"^\s*(\w+)(?:\((\w+)\))?\s*$")
+
+_ORDER = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+_EQUAL = {"=": False, "==": False, "<>": True, "!=": True}  # operator -> negated
+
+# Operand values: (stripped text, number or NaN), per row or as scalars for literals
+Values = Tuple[object, object]
+Mask = Callable[["_Rows"], np.ndarray]
+
+
+class Reference(NamedTuple):
+    field_name: str
+    column: str  # output column, `field___code` for a checkbox option
+    event: Optional[str] = None  # [event][field]: value of the record on that event
+
+
+def _literal(text: str) -> Values:
+    try:
+        number = float(text.strip())
+    except ValueError:
+        number = np.nan
+    return text.strip(), number
+
+
+class _Parser:
+    """
+    Recursive descent over REDCap logic: comparisons joined by and/or (and binds tighter),
+    parentheses, [field], [field(code)] and [event][field] references, quoted or bare
+    number literals. Anything else (functions, smart variables) raises ValueError.
+    """
+
+    def __init__(self, logic: str):
+        self.logic = logic
+        self.tokens: List[Tuple[str, str]] = []
+        position = 0
+        logic = logic.rstrip()
+        while position < len(logic):
+            match = _TOKEN.match(logic, position)
+            if match is None or match.end() == position:
+                raise ValueError(f"Unexpected '{logic[position:].strip()[:20]}'")
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind in ("single", "double"):
+                kind = "text"
+            elif kind == "word":
+                kind = value.lower()
+                if kind not in ("and", "or"):
+                    raise ValueError(f"Unsupported '{value}'")
+            self.tokens.append((kind, value))
+            position = match.end()
+        self.index = 0
+        self.references: List[Reference] = []
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.index][0] if self.index < len(self.tokens) else None
+
+    def _next(self) -> Tuple[str, str]:
+        if self.index >= len(self.tokens):
+            raise ValueError("Unexpected end of logic")
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def parse(self) -> Mask:
+        if not self.tokens:
+            raise ValueError("Empty logic")
+        mask = self._or()
+        if self._peek() is not None:
+            raise ValueError(f"Unexpected '{self.tokens[self.index][1]}'")
+        return mask
+
+    def _or(self) -> Mask:
+        parts = [self._and()]
+        while self._peek() == "or":
+            self._next()
+            parts.append(self._and())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda rows: np.logical_or.reduce([part(rows) for part in parts])
+
+    def _and(self) -> Mask:
+        parts = [self._factor()]
+        while self._peek() == "and":
+            self._next()
+            parts.append(self._factor())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda rows: np.logical_and.reduce([part(rows) for part in parts])
+
+    def _factor(self) -> Mask:
+        if self._peek() == "paren" and self.tokens[self.index][1] == "(":
+            self._next()
+            mask = self._or()
+            if self._next() != ("paren", ")"):
+                raise ValueError("Missing ')'")
+            return mask
+        left = self._operand()
+        kind, op = self._next()
+        if kind != "op":
+            raise ValueError(f"Expected an operator, got '{op}'")
+        right = self._operand()
+        return _comparison(left, op, right)
+
+    def _operand(self) -> Callable[["_Rows"], Values]:
+        kind, value = self._next()
+        if kind in ("text", "number"):
+            literal = _literal(value)
+            return lambda rows: literal
+        if kind != "ref":
+            raise ValueError(f"Expected a field or value, got '{value}'")
+        event = None
+        if self._peek() == "ref":
+            event = value[1:-1].strip()
+            kind, value = self._next()
+        match = _REFERENCE.match(value[1:-1])
+        if match is None:
+            raise ValueError(f"Unsupported reference '{value}'")
+        field_name, code = match.groups()
+        reference = Reference(field_name, f"{field_name}___{code}" if code is not None else field_name, event)
+        self.references.append(reference)
+        return lambda rows: rows.values(reference)
+
+
+def _at(values, positions: np.ndarray):
+    return values[positions] if isinstance(values, np.ndarray) and values.ndim else values
+
+
+def _comparison(left: Callable[["_Rows"], Values], op: str, right: Callable[["_Rows"], Values]) -> Mask:
+    """
+    Numbers compare numerically when both sides are numbers ("1" = 1.0), otherwise
+    `=`/`<>` compare text; empty cells read as "". Ordering against an empty or
+    non-numeric side is false (REDCap would compare "" as 0).
+    """
+    def mask(rows: "_Rows") -> np.ndarray:
+        left_text, left_number = left(rows)
+        right_text, right_number = right(rows)
+        numeric = ~np.isnan(left_number) & ~np.isnan(right_number)
+        with np.errstate(invalid="ignore"):
+            if op in _EQUAL:
+                equal = np.broadcast_to(left_number == right_number, numeric.shape).copy()
+                text = ~numeric
+                if text.any():
+                    equal[text] = _at(left_text, text) == _at(right_text, text)
+                result = ~equal if _EQUAL[op] else equal
+            else:
+                result = numeric & _ORDER[op](left_number, right_number)
+        return np.broadcast_to(result, (len(rows),))
+    return mask
+
+
+def compile_logic(logic: str) -> Tuple[Mask, List[Reference]]:
+    """Compile REDCap branching logic into a row mask function and the references it reads."""
+    parser = _Parser(logic)
+    mask = parser.parse()
+    return mask, parser.references
+
+
+def _numeric(values: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+
+
+def _series(values) -> pd.Series:
+    values = pd.Series(values).reset_index(drop=True)
+    return values.infer_objects() if values.dtype == object else values
+
+
+def _text_numbers(values) -> Values:
+    """
+    Comparison operands per cell: stripped text ("" when missing) and number (or NaN).
+    Number cells keep their float as "text": they only ever equal other numbers, which
+    compare numerically, so formatting them is not needed.
+    """
+    values = _series(values)
+    if _numeric(values):
+        numbers = values.to_numpy(dtype=float, na_value=np.nan)
+        text = numbers.astype(object)
+        text[np.isnan(numbers)] = ""
+        return text, numbers
+    codes, uniques = pd.factorize(values.astype(object), use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object)
+    text = np.append(uniques.map(lambda v: str(v).strip()).to_numpy(dtype=object), "")
+    numbers = np.append(to_numeric(uniques).to_numpy(dtype=float), np.nan)
+    return text[codes], numbers[codes]  # code -1 (missing) hits the trailing ""/NaN
+
+
+def _filled(values: pd.Series, checkbox: bool = False) -> np.ndarray:
+    """Non-empty cells; for a checkbox option column the checked (1) cells"""
+    if _numeric(values):
+        numbers = values.to_numpy(dtype=float, na_value=np.nan)
+        return numbers == 1 if checkbox else ~np.isnan(numbers)
+    text, numbers = _text_numbers(values)
+    return numbers == 1 if checkbox else text != ""
+
+
+def _display(values) -> np.ndarray:
+    """Cell text for the report: integral numbers without ".0", "" when missing"""
+    values = _series(values)
+    if not _numeric(values):
+        return _text_numbers(values)[0]
+    numbers = values.to_numpy(dtype=float, na_value=np.nan)
+    text = numbers.astype(str).astype(object)
+    integral = np.isfinite(numbers) & (numbers == np.round(numbers)) & (np.abs(numbers) < 1e15)
+    text[integral] = numbers[integral].astype(np.int64).astype(str)
+    text[np.isnan(numbers)] = ""
+    return text
+
+
+def _row_keys(frame: pd.DataFrame) -> Optional[np.ndarray]:
+    """record_id + event per row (branching logic reads values of the same record and event)"""
+    if "record_id" not in frame.columns:
+        return None
+    keys = frame["record_id"].astype(str)
+    if "redcap_event_name" in frame.columns:
+        keys = keys + "\x1f" + frame["redcap_event_name"].fillna("").astype(str)
+    return keys.to_numpy(dtype=object)
+
+
+class _Rows:
+    """Operand values of one wide frame, computed once per referenced column"""
+
+    def __init__(self, wide: pd.DataFrame, context: Optional[pd.DataFrame] = None):
+        self.wide = wide
+        self.frames = [wide] + ([context.reset_index(drop=True)] if context is not None else [])
+        keys = [_row_keys(frame) for frame in self.frames]
+        self.codes: Optional[np.ndarray] = None
+        if all(k is not None for k in keys):
+            # (record, event) codes over the rows of wide and context
+            self.codes, uniques = pd.factorize(np.concatenate(keys))
+            self.keys = pd.Index(uniques)
+        self._targets: Dict[str, np.ndarray] = {}
+        self._cache: Dict[Reference, Values] = {}
+
+    def __len__(self) -> int:
+        return len(self.wide)
+
+    def forget(self, column: str) -> None:
+        """Drop cached values of a column after it was blanked"""
+        for reference in [r for r in self._cache if r.column == column]:
+            del self._cache[reference]
+
+    def values(self, reference: Reference) -> Values:
+        if reference not in self._cache:
+            self._cache[reference] = _text_numbers(self._raw(reference))
+        return self._cache[reference]
+
+    def _target_codes(self, event: Optional[str]) -> np.ndarray:
+        """(record, event) code each row of `wide` reads from; -1 where the key has no rows"""
+        if event is None:
+            return self.codes[:len(self.wide)]
+        if event not in self._targets:
+            records = self.wide["record_id"].astype(str).to_numpy(dtype=object)
+            self._targets[event] = self.keys.get_indexer(records + "\x1f" + event)
+        return self._targets[event]
+
+    def _raw(self, reference: Reference) -> np.ndarray:
+        """
+        Cell values of the referenced column on each row: the row's own value, else the
+        record's first value on the same event (a repeating instrument reads fields of
+        the non-repeating part), from `wide` and then `context`. [event][field] reads
+        the record's value on that event.
+        """
+        column = reference.column
+        columns = [frame[column] for frame in self.frames if column in frame.columns]
+        dtype = float if columns and all(_numeric(c) for c in columns) else object
+        if column in self.wide.columns and reference.event is None:
+            own = self.wide[column].to_numpy(dtype=dtype, na_value=np.nan).copy()
+        else:
+            own = np.full(len(self.wide), np.nan, dtype=dtype)
+        empty = pd.isna(own)
+        if self.codes is None or not empty.any():
+            return own
+        values = np.concatenate([
+            frame[column].to_numpy(dtype=dtype, na_value=np.nan) if column in frame.columns
+            else np.full(len(frame), np.nan, dtype=dtype)
+            for frame in self.frames
+        ])
+        present = np.flatnonzero(~pd.isna(values))
+        first = np.full(len(self.keys) + 1, -1)  # trailing -1 for target code -1
+        codes, positions = np.unique(self.codes[present], return_index=True)
+        first[codes] = present[positions]
+        found = first[self._target_codes(reference.event)[empty]]
+        own[empty] = np.where(found >= 0, values[np.maximum(found, 0)], np.nan)
+        return own
+
+
+class BranchingReport(BaseModel):
+    rows: int = 0
+    fields: int = 0  # fields with compiled branching logic
+    hidden: Dict[str, int] = {}  # field -> filled cells on rows where its logic is false
+    blanked: int = 0
+    skipped: Dict[str, str] = {}  # field -> why its logic is not applied (not compiled, circular)
+    seconds: float = 0.0
+
+    @property
+    def hidden_cells(self) -> int:
+        return sum(self.hidden.values())
+
+
+class BranchingEvaluator:
+    """
+    Branching logic stage for wide output (see transform.pivot_wide, after encoding.Encoder:
+    logic compares choice codes and reads checkbox options as `field___code` columns).
+
+    The REDCap logic of every template field (`branching_expression` from `datadict`,
+    otherwise from the template field) is compiled once into a mask function; masks are
+    evaluated column-wise in dependency order, so fields hidden by a hidden field are
+    hidden too. Filled cells on rows where a field's logic is false are reported and,
+    with `blank`, emptied. Logic that cannot be compiled (functions, smart variables)
+    is skipped with a warning and the field is always shown, as is circular logic.
+    """
+
+    def __init__(self, template: Template, datadict: Optional[DataDictionary] = None, blank: bool = True):
+        metadata = {f.field_name: f for f in datadict.fields} if datadict is not None else {}
+        self.blank = blank
+        self.masks: Dict[str, Mask] = {}
+        self.references: Dict[str, List[Reference]] = {}
+        self._report = BranchingReport()
+        for field in template.fields:
+            meta: DataDictionaryField | TemplateField = metadata.get(field.field_name, field)
+            logic = meta.branching_expression
+            if not logic:
+                continue
+            try:
+                self.masks[field.field_name], self.references[field.field_name] = compile_logic(logic)
+            except ValueError as e:
+                print(f"Warning: Field '{field.field_name}': branching logic not supported ({e}): {logic}")
+                self._report.skipped[field.field_name] = str(e)
+        self.order = self._order()
+        self._report.fields = len(self.masks)
+        self._parts: List[Tuple[str, pd.DataFrame]] = []  # (field, keys and hidden cells), formatted by hidden()
+
+    def _order(self) -> List[str]:
+        """Fields with logic, every field after the fields its logic reads"""
+        graph = {
+            name: {r.field_name for r in refs if r.field_name in self.masks and r.field_name != name}
+            for name, refs in self.references.items()
+        }
+        order: List[str] = []
+        done: Set[str] = set()
+        pending = list(graph)
+        while pending:
+            level = [n for n in pending if graph[n] <= done]
+            if not level:
+                self._skip_cycles(graph, pending)
+                pending = [n for n in pending if n in graph]
+                continue
+            order.extend(level)
+            done.update(level)
+            pending = [n for n in pending if n not in done]
+        return order
+
+    def _skip_cycles(self, graph: Dict[str, Set[str]], pending: List[str]) -> None:
+        """Skip (like uncompilable logic) the pending fields whose logic depends on itself"""
+        def reachable(start: str) -> Set[str]:
+            seen: Set[str] = set()
+            stack = list(graph[start])
+            while stack:
+                name = stack.pop()
+                if name not in seen and name in graph:
+                    seen.add(name)
+                    stack.extend(graph[name])
+            return seen
+        cyclic = [n for n in pending if n in reachable(n)]
+        print(f"Warning: Circular branching logic between fields {', '.join(cyclic)}, these fields are always shown")
+        for name in cyclic:
+            del graph[name], self.masks[name], self.references[name]
+            self._report.skipped[name] = "circular branching logic"
+        for references in graph.values():
+            references.difference_update(cyclic)
+
+    def fields(self) -> List[str]:
+        """Fields with logic and the fields their logic reads"""
+        names = dict.fromkeys(self.order)
+        for refs in self.references.values():
+            names.update(dict.fromkeys(r.field_name for r in refs))
+        return list(names)
+
+    def evaluate(self, wide: pd.DataFrame, context: Optional[pd.DataFrame] = None) -> Tuple[pd.DataFrame, Dict[str, np.ndarray]]:
+        """
+        Evaluate all logic over `wide` (rows from `context`, e.g. other events of the same
+        records, are only read). Returns the frame (a blanked copy with `blank`) and, per
+        field, the positions of its hidden-but-filled rows.
+        """
+        started = time.perf_counter()
+        wide = wide.reset_index(drop=True)
+        options: Dict[str, List[str]] = {}
+        for column in wide.columns:
+            if "___" in str(column):
+                options.setdefault(str(column).rsplit("___", 1)[0], []).append(column)
+        rows = _Rows(wide, context)
+        hidden: Dict[str, np.ndarray] = {}
+        for name in self.order:
+            checkbox = name not in wide.columns
+            columns = options.get(name, []) if checkbox else [name]
+            if not columns:
+                continue
+            shown = self.masks[name](rows)
+            filled = np.zeros(len(wide), dtype=bool)
+            for column in columns:
+                filled |= _filled(wide[column], checkbox)
+            positions = np.flatnonzero(filled & ~shown)
+            if not len(positions):
+                continue
+            hidden[name] = positions
+            self._parts.append((name, wide[_KEYS + columns].iloc[positions]))
+            self._report.hidden[name] = self._report.hidden.get(name, 0) + len(positions)
+            if self.blank:
+                mask = pd.Series(~shown, index=wide.index)
+                for column in columns:
+                    wide[column] = wide[column].mask(mask)
+                    rows.forget(column)
+                self._report.blanked += len(positions)
+        self._report.rows += len(wide)
+        self._report.seconds += time.perf_counter() - started
+        return wide, hidden
+
+    def apply(self, wide: pd.DataFrame, context: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """Evaluate `wide` (see evaluate); returns the frame with hidden cells blanked if `blank`"""
+        return self.evaluate(wide, context)[0]
+
+    @staticmethod
+    def _table(name: str, cells: pd.DataFrame) -> pd.DataFrame:
+        columns = [c for c in cells.columns if c not in _KEYS]
+        if columns == [name]:
+            values = _display(cells[name])
+        else:
+            checked = np.column_stack([_filled(cells[c], checkbox=True) for c in columns])
+            codes = [c.rsplit("___", 1)[1] for c in columns]
+            values = ["|".join(code for code, on in zip(codes, row) if on) for row in checked]
+        instances = cells["redcap_repeat_instance"].astype("Int64")
+        return pd.DataFrame({
+            "record_id": cells["record_id"].astype(str).to_numpy(),
+            "redcap_event_name": cells["redcap_event_name"].astype(str).to_numpy(),
+            "redcap_repeat_instance": instances.where(instances != 0, pd.NA).array,
+            "field_name": name,
+            "rule": RULE_HIDDEN,
+            "value": values,
+        }, columns=VIOLATION_COLUMNS)
+
+    def hidden(self) -> pd.DataFrame:
+        """Hidden-but-filled cells found so far (VIOLATION_COLUMNS, rule 'hidden')"""
+        if not self._parts:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS)
+        return pd.concat([self._table(name, cells) for name, cells in self._parts], ignore_index=True)
+
+    def report(self) -> BranchingReport:
+        return self._report.model_copy(deep=True)
+
+
+def apply_branching(
+    wide: pd.DataFrame,
+    template: Template,
+    datadict: Optional[DataDictionary] = None,
+    blank: bool = True,
+) -> Tuple[pd.DataFrame, BranchingReport]:
+    """Apply branching logic to an (encoded) wide output table; returns the table and its report (see BranchingEvaluator)."""
+    evaluator = BranchingEvaluator(template, datadict, blank)
+    result = evaluator.apply(wide)
+    report = evaluator.report()
+    if report.hidden:
+        shown = ", ".join(f"{field} ({count})" for field, count in sorted(report.hidden.items(), key=lambda i: -i[1])[:5])
+        action = "blanked" if blank else "kept"
+        print(f"Warning: {report.hidden_cells} values of hidden fields {action}: {shown}")
+    return result, report
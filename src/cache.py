@@ -0,0 +1,350 @@
+import hashlib
+import json
+import pickle
+import shutil
+import time
+import yaml
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .datadict import DataDictionary
+from .redcap_project import RedcapProject, parse_project_xml
+from .template import Template, TemplateField, YamlLoader
+from .transform import NUMERIC_SUFFIX, template_columns, to_datetime, to_numeric
+from .utils import sniff_delimiter
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "csv-redcap"
+
+# Bump when the on-disk layout changes; part of every cache key
+_FORMAT_VERSION = 5
+
+# Share of sampled values that must parse as dates for a column to be stored as timestamps
+_DATETIME_RATIO = 0.9
+_SAMPLE_SIZE = 1000
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CacheColumn(BaseModel):
+    name: str
+    kind: str  # "datetime" (int64 ns) | "text" (categorical codes + categories)
+    numeric: bool = False  # float64 companion stored (decimal commas converted)
+
+
+class CacheEntry(BaseModel):
+    key: str
+    source: str
+    rows: int
+    size_bytes: int
+    created: float
+    last_used: float
+    settings: Dict[str, Optional[str]]
+    columns: List[CacheColumn]
+
+
+def _looks_like_datetime(values: pd.Series) -> bool:
+    sample = values.dropna().drop_duplicates().head(_SAMPLE_SIZE)
+    if sample.empty:
+        return False
+    return to_datetime(sample).notna().mean() >= _DATETIME_RATIO
+
+
+def _parse_datetime(values: pd.Series, name: str) -> Optional[np.ndarray]:
+    """
+    Timestamps of a column that looks like dates, or None if any value does not parse:
+    the int64 layout has no room for the raw text, so such columns are stored as text.
+    """
+    if not _looks_like_datetime(values):
+        return None
+    parsed = to_datetime(values, name)
+    unparsed = int((parsed.isna() & values.notna()).sum())
+    if unparsed:
+        print(f"Warning: Column '{name}' has {unparsed} values that are not dates, caching it as text")
+        return None
+    return parsed.to_numpy(dtype="datetime64[ns]")
+
+
+class SourceCache:
+    """
+    On-disk cache of normalized long-format source tables, keyed by file content hash
+    plus parser settings. Each column is stored as its own .npy file so later runs can
+    memory-map just the columns a template reads:
+    - timestamp columns as parsed int64 nanoseconds (if every value parses),
+    - text columns (parameter, category, record ID, ...) as categorical codes plus a
+      category list, keeping the raw strings exactly,
+    - columns with numeric content additionally as float64 with decimal commas
+      converted, loaded as `<column>__num` and picked up by the transform.
+    Entries beyond `max_bytes` are evicted least recently used first.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = 5 * 1024 ** 3):
+        self.directory = Path(directory) if directory else DEFAULT_CACHE_DIR / "source"
+        self.max_bytes = max_bytes
+
+    def _content_hash(self, source_path: str) -> str:
+        """
+        file_hash of `source_path`, reused from the last call while the file's path, size
+        and mtime_ns are unchanged (kept in hashes.json next to the entries).
+        """
+        path = Path(source_path).resolve()
+        stat = path.stat()
+        signature = [stat.st_size, stat.st_mtime_ns]
+        known_path = self.directory / "hashes.json"
+        try:
+            known = json.loads(known_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            known = {}
+        cached = known.get(str(path))
+        if cached and cached[:2] == signature:
+            return cached[2]
+        content_hash = file_hash(source_path)
+        known[str(path)] = signature + [content_hash]
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = known_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(known), encoding="utf-8")
+        tmp.replace(known_path)
+        return content_hash
+
+    def key(self, source_path: str, sep: Optional[str] = None, encoding: str = "utf-8") -> str:
+        settings = json.dumps({"sep": sep, "encoding": encoding, "version": _FORMAT_VERSION}, sort_keys=True)
+        return hashlib.sha256((self._content_hash(source_path) + settings).encode()).hexdigest()[:32]
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.directory / key
+
+    def _read_entry(self, key: str) -> Optional[CacheEntry]:
+        manifest = self._entry_dir(key) / "manifest.json"
+        if not manifest.exists():
+            return None
+        try:
+            return CacheEntry.model_validate_json(manifest.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable cache entry '{key}': {e}")
+            return None
+
+    def _write_entry(self, entry: CacheEntry, directory: Optional[Path] = None) -> None:
+        manifest = (directory or self._entry_dir(entry.key)) / "manifest.json"
+        manifest.write_text(entry.model_dump_json(indent=2), encoding="utf-8")
+
+    def entries(self) -> List[CacheEntry]:
+        """All cache entries, most recently used first."""
+        if not self.directory.exists():
+            return []
+        entries = [self._read_entry(d.name) for d in self.directory.iterdir() if d.is_dir() and d.suffix != ".tmp"]
+        return sorted((e for e in entries if e), key=lambda e: e.last_used, reverse=True)
+
+    def purge(self, key: Optional[str] = None) -> int:
+        """Delete one entry (or all entries if `key` is None); returns the number removed."""
+        targets = [key] if key else [e.key for e in self.entries()]
+        removed = 0
+        for target in targets:
+            if self._entry_dir(target).exists():
+                shutil.rmtree(self._entry_dir(target), ignore_errors=True)
+                removed += 1
+        return removed
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits into `max_bytes`."""
+        entries = self.entries()
+        total = sum(e.size_bytes for e in entries)
+        for entry in reversed(entries):
+            if total <= self.max_bytes:
+                break
+            self.purge(entry.key)
+            total -= entry.size_bytes
+
+    def store(self, source_path: str, sep: Optional[str] = None, encoding: str = "utf-8") -> CacheEntry:
+        """Parse `source_path` once and write the normalized columns to the cache."""
+        key = self.key(source_path, sep, encoding)
+        if sep is None:
+            with open(source_path, "r", encoding=encoding) as f:
+                sep = sniff_delimiter(f.readline())
+        frame = pd.read_csv(source_path, sep=sep, encoding=encoding, dtype=str)
+        target = self._entry_dir(key)
+        tmp = target.with_name(target.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        columns = []
+        for index, name in enumerate(frame.columns):
+            values = frame[name]
+            stem = f"col_{index:04d}"
+            parsed = _parse_datetime(values, name)
+            if parsed is not None:
+                np.save(tmp / f"{stem}.ts.npy", parsed.view(np.int64))
+                columns.append(CacheColumn(name=name, kind="datetime"))
+                continue
+            codes, categories = pd.factorize(values, use_na_sentinel=True)
+            np.save(tmp / f"{stem}.codes.npy", codes.astype(np.int32))
+            (tmp / f"{stem}.categories.json").write_text(json.dumps(list(categories), ensure_ascii=False), encoding="utf-8")
+            numeric = to_numeric(values).to_numpy(dtype=float)
+            has_numeric = bool(np.any(~np.isnan(numeric)))
+            if has_numeric:
+                np.save(tmp / f"{stem}.num.npy", numeric)
+            columns.append(CacheColumn(name=name, kind="text", numeric=has_numeric))
+
+        now = time.time()
+        entry = CacheEntry(
+            key=key,
+            source=str(Path(source_path).resolve()),
+            rows=len(frame),
+            size_bytes=sum(f.stat().st_size for f in tmp.iterdir()),
+            created=now,
+            last_used=now,
+            settings={"sep": sep, "encoding": encoding},
+            columns=columns,
+        )
+        self._write_entry(entry, tmp)  # before the rename: every entry directory has a manifest
+        shutil.rmtree(target, ignore_errors=True)
+        tmp.rename(target)
+        self.evict()
+        return entry
+
+    def _load_entry(self, entry: CacheEntry, columns: Optional[List[str]]) -> pd.DataFrame:
+        directory = self._entry_dir(entry.key)
+        wanted = set(columns) if columns is not None else None
+        data = {}
+        for index, column in enumerate(entry.columns):
+            if wanted is not None and column.name not in wanted:
+                continue
+            stem = directory / f"col_{index:04d}"
+            if column.kind == "datetime":
+                ticks = np.load(f"{stem}.ts.npy", mmap_mode="r")
+                data[column.name] = pd.Series(np.asarray(ticks).view("datetime64[ns]"))
+                continue
+            codes = np.load(f"{stem}.codes.npy", mmap_mode="r")
+            categories = json.loads(Path(f"{stem}.categories.json").read_text(encoding="utf-8"))
+            data[column.name] = pd.Series(pd.Categorical.from_codes(codes, categories=categories))
+            if column.numeric:
+                data[column.name + NUMERIC_SUFFIX] = pd.Series(np.load(f"{stem}.num.npy", mmap_mode="r"))
+        return pd.DataFrame(data)
+
+    def load(
+        self,
+        source_path: str,
+        columns: Optional[List[str]] = None,
+        sep: Optional[str] = None,
+        encoding: str = "utf-8",
+    ) -> pd.DataFrame:
+        """
+        Normalized source table for `source_path`, restricted to `columns` if given.
+        Parses and stores the file on the first call; later calls memory-map the cache.
+        """
+        key = self.key(source_path, sep, encoding)
+        entry = self._read_entry(key) or self.store(source_path, sep, encoding)
+        entry.last_used = time.time()
+        self._write_entry(entry)
+        return self._load_entry(entry, columns)
+
+    def load_for_template(
+        self, source_path: str, template: Template, sep: Optional[str] = None, encoding: str = "utf-8"
+    ) -> pd.DataFrame:
+        """Like `load`, but only with the columns `template` reads."""
+        return self.load(source_path, template_columns(template), sep, encoding)
+
+
+def _fingerprint(data: Any) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """
+    Cache of validated DataDictionary, Template and RedcapProject objects, pickled
+    per source file and reused while the file's content hash is unchanged.
+    For a changed template file only the fields whose YAML changed are validated again;
+    unchanged fields are taken over from the cached template.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = Path(directory) if directory else DEFAULT_CACHE_DIR / "artifacts"
+
+    def _path(self, kind: str, source_path: str) -> Path:
+        name = hashlib.sha256(str(Path(source_path).resolve()).encode("utf-8")).hexdigest()[:16]
+        return self.directory / f"{kind}-{name}.pkl"
+
+    def _read(self, kind: str, source_path: str) -> Optional[Dict[str, Any]]:
+        path = self._path(kind, source_path)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable cache file '{path}': {e}")
+            return None
+        return entry if entry.get("version") == _FORMAT_VERSION else None
+
+    def _write(self, kind: str, source_path: str, entry: Dict[str, Any]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(kind, source_path)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump({**entry, "version": _FORMAT_VERSION}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(path)
+
+    def _load(self, kind: str, source_path: str, loader: Callable[[str], Any]) -> Any:
+        content_hash = file_hash(source_path)
+        entry = self._read(kind, source_path)
+        if entry and entry["file_hash"] == content_hash:
+            return entry["object"]
+        obj = loader(source_path)
+        self._write(kind, source_path, {"file_hash": content_hash, "object": obj})
+        return obj
+
+    def load_datadict(self, file_path: str) -> DataDictionary:
+        """DataDictionary.from_csv, cached by file content."""
+        return self._load("datadict", file_path, DataDictionary.from_csv)
+
+    def load_project(self, xml_path: str) -> RedcapProject:
+        """parse_project_xml, cached by file content."""
+        return self._load("project", xml_path, parse_project_xml)
+
+    def load_template(self, file_path: str, datadict: Optional[DataDictionary] = None) -> Template:
+        """
+        Template.from_yaml, cached by file content. If `datadict` is given, the template
+        is checked against it (see Template.sync_with_datadict).
+        """
+        content_hash = file_hash(file_path)
+        entry = self._read("template", file_path)
+        if not entry or entry["file_hash"] != content_hash:
+            template, fingerprints = self._validate_template(file_path, entry)
+            entry = {"file_hash": content_hash, "object": template, "fields": fingerprints}
+            self._write("template", file_path, entry)
+        template = entry["object"]
+        if datadict is not None:
+            synced_hash = template.datadict_hash
+            template.sync_with_datadict(datadict)
+            if template.datadict_hash != synced_hash:
+                self._write("template", file_path, entry)
+        return template
+
+    def _validate_template(self, file_path: str, previous: Optional[Dict[str, Any]]) -> Tuple[Template, List[str]]:
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = yaml.load(f, Loader=YamlLoader)
+        raw_fields = data.get("fields") or []
+        fingerprints = [_fingerprint(raw) for raw in raw_fields]
+        reusable: Dict[str, TemplateField] = {}
+        if previous:
+            reusable = dict(zip(previous["fields"], previous["object"].fields))
+        # Already validated TemplateField instances are not validated again by pydantic
+        data["fields"] = [reusable.get(fp) or raw for fp, raw in zip(fingerprints, raw_fields)]
+        return Template(**data), fingerprints
+
+    def purge(self) -> int:
+        """Delete all cached artifacts; returns the number of files removed."""
+        if not self.directory.exists():
+            return 0
+        files = list(self.directory.glob("*.pkl"))
+        for path in files:
+            path.unlink()
+        return len(files)
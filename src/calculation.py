@@ -0,0 +1,419 @@
+import ast
+import math
+import operator
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# {var} placeholders in calculation_expr; dict literals like {'a': 1} are left alone
+VARIABLE_PATTERN = re.compile(r"\{(\w+)\}")
+_PLACEHOLDER_PREFIX = "__var_"
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+
+def expression_variables(expr: str) -> List[str]:
+    """Variable names used as {var} in an expression, in order of first use."""
+    return list(dict.fromkeys(VARIABLE_PATTERN.findall(expr)))
+
+
+def parse_expression(expr: str) -> ast.Expression:
+    """
+    Parse a calculation_expr into a restricted AST. {var} placeholders become names;
+    anything outside arithmetic, comparisons, boolean logic, conditional expressions
+    and `{...}.get(...)` lookups on dict literals is rejected with a ValueError.
+    """
+    source = VARIABLE_PATTERN.sub(lambda m: _PLACEHOLDER_PREFIX + m.group(1), expr)
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid calculation expression '{expr}': {e.msg}") from e
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            func = node.func
+            if not (
+                isinstance(func, ast.Attribute) and func.attr == "get"
+                and isinstance(func.value, ast.Dict) and not node.keywords and 1 <= len(node.args) <= 2
+            ):
+                raise ValueError(f"Invalid calculation expression '{expr}': only dict .get() calls are allowed")
+        elif isinstance(node, ast.Name):
+            if not node.id.startswith(_PLACEHOLDER_PREFIX) and node.id not in ("None", "True", "False"):
+                raise ValueError(f"Invalid calculation expression '{expr}': unknown name '{node.id}' (use {{{node.id}}})")
+        elif not isinstance(node, (
+            ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+            ast.Constant, ast.Dict, ast.Attribute, ast.Load,
+            ast.operator, ast.unaryop, ast.boolop, ast.cmpop,
+        )) or isinstance(node, ast.MatMult):
+            raise ValueError(f"Invalid calculation expression '{expr}': '{type(node).__name__}' is not allowed")
+    return tree
+
+
+def _is_null(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _eval(node: ast.AST, variables: Dict[str, Any]) -> Any:
+    if isinstance(node, ast.Expression):
+        return _eval(node.body, variables)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id.startswith(_PLACEHOLDER_PREFIX):
+            value = variables.get(node.id[len(_PLACEHOLDER_PREFIX):])
+            return None if _is_null(value) else value
+        return {"None": None, "True": True, "False": False}[node.id]
+    if isinstance(node, ast.BinOp):
+        left, right = _eval(node.left, variables), _eval(node.right, variables)
+        if _is_null(left) or _is_null(right):
+            return None
+        try:
+            result = _BINARY_OPERATORS[type(node.op)](left, right)
+        except (ZeroDivisionError, TypeError, OverflowError):
+            return None
+        # negative base with fractional exponent: no real result (NaN in the vector path)
+        return None if isinstance(result, complex) else result
+    if isinstance(node, ast.UnaryOp):
+        operand = _eval(node.operand, variables)
+        if isinstance(node.op, ast.Not):
+            return None if operand is None else not operand
+        if operand is None:
+            return None
+        try:
+            return -operand if isinstance(node.op, ast.USub) else +operand
+        except TypeError:
+            return None
+    if isinstance(node, ast.BoolOp):
+        result = None
+        for value_node in node.values:
+            result = _eval(value_node, variables)
+            if result is None:
+                return None
+            if isinstance(node.op, ast.And) and not result:
+                return result
+            if isinstance(node.op, ast.Or) and result:
+                return result
+        return result
+    if isinstance(node, ast.Compare):
+        left = _eval(node.left, variables)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _eval(comparator, variables)
+            if left is None or right is None:
+                return None
+            try:
+                if not _COMPARE_OPERATORS[type(op)](left, right):
+                    return False
+            except TypeError:
+                return None
+            left = right
+        return True
+    if isinstance(node, ast.IfExp):
+        test = _eval(node.test, variables)
+        if test is None:
+            return None
+        return _eval(node.body if test else node.orelse, variables)
+    if isinstance(node, ast.Dict):
+        return {_eval(k, variables): _eval(v, variables) for k, v in zip(node.keys, node.values)}
+    if isinstance(node, ast.Call):
+        lookup = _eval(node.func.value, variables)
+        args = [_eval(arg, variables) for arg in node.args]
+        return lookup.get(*args)
+    raise ValueError(f"Unsupported expression node '{type(node).__name__}'")
+
+
+def evaluate(expr: str, variables: Dict[str, Any], tree: Optional[ast.Expression] = None) -> Any:
+    """
+    Evaluate a calculation_expr for one set of variable values.
+    Missing values (None/NaN) propagate: arithmetic or comparisons on them yield None,
+    as do division by zero and type errors.
+    This scalar evaluator is the reference implementation for `compile_expression`.
+    """
+    return _eval(tree if tree is not None else parse_expression(expr), variables)
+
+
+# ============================================================================
+# Vectorized evaluation
+# ============================================================================
+
+class VectorColumn:
+    """
+    One evaluated (sub)expression over all rows. Kinds "num", "int", "bool" and "null"
+    are float64 arrays with NaN as missing value (kept apart so results convert back to
+    the same Python types as the scalar evaluator); "obj" is an object array with None.
+    """
+
+    def __init__(self, values: np.ndarray, kind: str):
+        self.values = values
+        self.kind = kind
+
+    @classmethod
+    def constant(cls, value: Any, length: int) -> "VectorColumn":
+        if value is None:
+            return cls(np.full(length, np.nan), "null")
+        if isinstance(value, bool):
+            return cls(np.full(length, float(value)), "bool")
+        if isinstance(value, int):
+            return cls(np.full(length, float(value)), "int")
+        if isinstance(value, float):
+            return cls(np.full(length, value), "num")
+        column = np.empty(length, dtype=object)
+        column[:] = [value] * length
+        return cls(column, "obj")
+
+    @classmethod
+    def from_values(cls, values: Any, length: int) -> "VectorColumn":
+        """Wrap variable values: numeric arrays stay float, anything else is an object column."""
+        values = np.asarray(values)
+        if values.ndim == 0:
+            return cls.constant(values.item(), length)
+        if values.dtype.kind == "b":
+            return cls(values.astype(float), "bool")
+        if values.dtype.kind in "iuf":
+            return cls(values.astype(float), "int" if values.dtype.kind in "iu" else "num")
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        if inferred in ("floating", "integer", "empty"):
+            missing = pd.isna(values)
+            numeric = np.where(missing, np.nan, values).astype(float)
+            return cls(numeric, "int" if inferred == "integer" else "num")
+        return cls(np.where(pd.isna(values), None, values).astype(object), "obj")
+
+    @property
+    def missing(self) -> np.ndarray:
+        if self.kind == "obj":
+            return pd.isna(self.values)
+        return np.isnan(self.values)
+
+    def truthy(self) -> np.ndarray:
+        """Python truthiness per row (missing rows read False; check `missing` first)."""
+        if self.kind == "obj":
+            return np.fromiter((bool(v) for v in self.values), dtype=bool, count=len(self.values))
+        return ~np.isnan(self.values) & (self.values != 0)
+
+    def to_objects(self, bool_as_int: bool = False) -> np.ndarray:
+        """Python values per row, None where missing (as the scalar evaluator returns them)."""
+        if self.kind == "obj":
+            return self.values
+        missing = np.isnan(self.values)
+        if self.kind == "bool" and not bool_as_int:
+            converted = self.values.astype(bool).astype(object)
+        elif self.kind in ("bool", "int"):
+            converted = np.where(missing, 0, self.values).astype(np.int64).astype(object)
+        else:
+            converted = self.values.astype(object)
+        converted[missing] = None
+        return converted
+
+    def to_float(self) -> Optional[np.ndarray]:
+        """Numeric values (NaN where missing), or None for object columns."""
+        return None if self.kind == "obj" else self.values
+
+
+def _promote(kinds: List[str]) -> Optional[str]:
+    """Common numeric kind of operands whose rows may be mixed, or None if types differ."""
+    kinds = [k for k in kinds if k != "null"]
+    if not kinds:
+        return "null"
+    return kinds[0] if all(k == kinds[0] for k in kinds) else None
+
+
+class _Rows:
+    """Evaluation environment: variable columns plus lazily built per-row dicts for fallbacks."""
+
+    def __init__(self, variables: Dict[str, Any], length: int):
+        self.length = length
+        self.columns = {name: VectorColumn.from_values(values, length) for name, values in variables.items()}
+        self._rows: Optional[List[Dict[str, Any]]] = None
+
+    def rows(self) -> List[Dict[str, Any]]:
+        if self._rows is None:
+            names = list(self.columns)
+            objects = [self.columns[n].to_objects() for n in names]
+            self._rows = [dict(zip(names, row)) for row in zip(*objects)] if names else [{}] * self.length
+        return self._rows
+
+
+def _rowwise(node: ast.AST, env: _Rows) -> VectorColumn:
+    """Fallback for object (text) operands: the scalar evaluator, row by row."""
+    column = np.empty(env.length, dtype=object)
+    column[:] = [_eval(node, row) for row in env.rows()]
+    return VectorColumn(column, "obj")
+
+
+def _binary(node: ast.BinOp, env: _Rows) -> VectorColumn:
+    left, right = _vector(node.left, env), _vector(node.right, env)
+    if "obj" in (left.kind, right.kind):
+        return _rowwise(node, env)
+    a, b = left.values, right.values
+    op = type(node.op)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        result = _BINARY_OPERATORS[op](a, b)
+    if op in (ast.Div, ast.FloorDiv, ast.Mod):
+        result = np.where(b == 0, np.nan, result)  # ZeroDivisionError -> None
+    elif op == ast.Pow:
+        result = np.where((a == 0) & (b < 0), np.nan, result)
+        result = np.where(np.isinf(result) & np.isfinite(a) & np.isfinite(b), np.nan, result)  # OverflowError -> None
+    # a missing operand gives a missing result, as in evaluate() (NumPy: NaN**0 == 1**NaN == 1)
+    result = np.where(np.isnan(a) | np.isnan(b), np.nan, result)
+    integral = left.kind in ("bool", "int") and right.kind in ("bool", "int")
+    if op == ast.Pow:
+        integral = integral and bool(np.all(np.isnan(b) | (b >= 0)))
+    kind = "int" if integral and op != ast.Div else "num"
+    if "null" in (left.kind, right.kind):
+        kind = "null"
+    return VectorColumn(np.asarray(result, dtype=float), kind)
+
+
+def _unary(node: ast.UnaryOp, env: _Rows) -> VectorColumn:
+    operand = _vector(node.operand, env)
+    if operand.kind == "obj":
+        return _rowwise(node, env)
+    missing = np.isnan(operand.values)
+    if isinstance(node.op, ast.Not):
+        return VectorColumn(np.where(missing, np.nan, (~operand.truthy()).astype(float)), "bool")
+    values = -operand.values if isinstance(node.op, ast.USub) else operand.values.copy()
+    return VectorColumn(values, "int" if operand.kind == "bool" else operand.kind)
+
+
+def _boolean(node: ast.BoolOp, env: _Rows) -> VectorColumn:
+    operands = [_vector(v, env) for v in node.values]
+    kind = _promote([o.kind for o in operands])
+    if kind is None or kind == "obj":
+        return _rowwise(node, env)
+    is_and = isinstance(node.op, ast.And)
+    result = operands[0].values.copy()
+    done = np.isnan(result) | (operands[0].truthy() != is_and)
+    for operand in operands[1:]:
+        take = ~done
+        result = np.where(take, operand.values, result)
+        done |= take & (np.isnan(operand.values) | (operand.truthy() != is_and))
+    return VectorColumn(result, kind)
+
+
+def _compare(node: ast.Compare, env: _Rows) -> VectorColumn:
+    operands = [_vector(node.left, env)] + [_vector(c, env) for c in node.comparators]
+    if any(o.kind == "obj" for o in operands):
+        return _rowwise(node, env)
+    result = np.ones(env.length)
+    done = np.zeros(env.length, dtype=bool)
+    for op, left, right in zip(node.ops, operands, operands[1:]):
+        missing = ~done & (np.isnan(left.values) | np.isnan(right.values))
+        result[missing] = np.nan
+        done |= missing
+        with np.errstate(invalid="ignore"):
+            failed = ~done & ~_COMPARE_OPERATORS[type(op)](left.values, right.values)
+        result[failed] = 0.0
+        done |= failed
+    return VectorColumn(result, "bool")
+
+
+def _conditional(node: ast.IfExp, env: _Rows) -> VectorColumn:
+    test = _vector(node.test, env)
+    body, orelse = _vector(node.body, env), _vector(node.orelse, env)
+    missing = test.missing
+    chosen = test.truthy()
+    kind = _promote([body.kind, orelse.kind])
+    if kind is not None and kind != "obj":
+        return VectorColumn(np.where(missing, np.nan, np.where(chosen, body.values, orelse.values)), kind)
+    values = np.where(chosen, body.to_objects(), orelse.to_objects())
+    values[missing] = None
+    return VectorColumn(values.astype(object), "obj")
+
+
+def _lookup(node: ast.Call, env: _Rows) -> VectorColumn:
+    """`{'a': 1, ...}.get(x, default)` as a vectorized map over the distinct keys."""
+    mapping = node.func.value
+    if not all(isinstance(n, ast.Constant) for n in mapping.keys + mapping.values + node.args[1:]):
+        return _rowwise(node, env)
+    table = {k.value: v.value for k, v in zip(mapping.keys, mapping.values)}
+    default = node.args[1].value if len(node.args) > 1 else None
+    key = _vector(node.args[0], env)
+    keys = key.to_objects()
+    result = np.empty(env.length, dtype=object)
+    result[:] = [table.get(None, default)] * env.length  # missing keys look up None
+    present = ~key.missing
+    for k, v in table.items():
+        if k is None:
+            continue
+        matched = present & (keys == k)
+        result[matched] = [v] * int(matched.sum())
+    produced = list(table.values()) + [default]
+    for kind, type_ in (("int", int), ("num", float)):
+        if all(v is None or (type(v) is type_) for v in produced):
+            return VectorColumn(np.where(pd.isna(result), np.nan, result).astype(float), kind)
+    return VectorColumn(result, "obj")
+
+
+def _vector(node: ast.AST, env: _Rows) -> VectorColumn:
+    if isinstance(node, ast.Expression):
+        return _vector(node.body, env)
+    if isinstance(node, ast.Constant):
+        return VectorColumn.constant(node.value, env.length)
+    if isinstance(node, ast.Name):
+        if node.id.startswith(_PLACEHOLDER_PREFIX):
+            name = node.id[len(_PLACEHOLDER_PREFIX):]
+            if name not in env.columns:
+                return VectorColumn.constant(None, env.length)
+            return env.columns[name]
+        return VectorColumn.constant({"None": None, "True": True, "False": False}[node.id], env.length)
+    if isinstance(node, ast.BinOp):
+        return _binary(node, env)
+    if isinstance(node, ast.UnaryOp):
+        return _unary(node, env)
+    if isinstance(node, ast.BoolOp):
+        return _boolean(node, env)
+    if isinstance(node, ast.Compare):
+        return _compare(node, env)
+    if isinstance(node, ast.IfExp):
+        return _conditional(node, env)
+    if isinstance(node, ast.Call):
+        return _lookup(node, env)
+    return _rowwise(node, env)
+
+
+class CompiledExpression:
+    """
+    A calculation_expr parsed once and evaluated column-wise: arithmetic and comparisons
+    as NumPy operations, conditionals as `np.where`, dict `.get` as a vectorized map, and
+    missing values carried as NaN. Text operands fall back to the scalar evaluator for
+    the affected sub-expression only, so results match `evaluate` row by row.
+    """
+
+    def __init__(self, expr: str):
+        self.expr = expr
+        self.tree = parse_expression(expr)
+        self.variables = expression_variables(expr)
+
+    def columns(self, variables: Dict[str, Any], length: int) -> VectorColumn:
+        """Evaluate over `length` rows; variables are arrays (or scalars, broadcast)."""
+        return _vector(self.tree, _Rows(variables, length))
+
+    def __call__(self, variables: Dict[str, Any], length: Optional[int] = None) -> np.ndarray:
+        """Object array with the same value per row as `evaluate` would return."""
+        if length is None:
+            length = max((len(np.atleast_1d(v)) for v in variables.values()), default=1)
+        return self.columns(variables, length).to_objects()
+
+
+@lru_cache(maxsize=None)
+def compile_expression(expr: str) -> CompiledExpression:
+    """Compiled evaluator for `expr`, cached per expression string."""
+    return CompiledExpression(expr)
@@ -1,3 +1,4 @@
+import hashlib
 import pandas as pd
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any, Tuple
@@ -5,6 +6,8 @@ from enum import Enum
 import re
 from datetime import datetime
 
+from .utils import sniff_delimiter
+
 class FieldType(str, Enum):
     TEXT = "text"
     RADIO = "radio"
@@ -38,46 +41,95 @@ class DataDictionaryField(BaseModel):
     identifier: Optional[bool]
     branching_logic: Optional[List[Dict[str, Any]]]
     required_field: Optional[bool]
+    branching_expression: Optional[str] = None  # logic as written in REDCap (see branching.py)
+
+# Header patterns of the REDCap data dictionary columns (matched case-insensitively)
+COLUMN_PATTERNS = {
+    "field_name": r'.*field.*name|.*variable.*name',
+    "form_name": r'.*form.*name',
+    "field_label": r'.*field.*label',
+    "field_type": r'.*field.*type',
+    "choices": r'.*choices.*calculations.*slider',
+    "validation_type": r'.*validation.*type.*slider',
+    "validation_minimum": r'.*validation.*min',
+    "validation_maximum": r'.*validation.*max',
+    "identifier": r'.*identifier',
+    "branching_logic": r'.*branching.*logic',
+    "required_field": r'.*required.*field',
+}
+
+def resolve_columns(columns: List[str]) -> Dict[str, Optional[str]]:
+    """Map each key of COLUMN_PATTERNS to the first matching CSV column (or None)."""
+    resolved = {}
+    for key, pattern in COLUMN_PATTERNS.items():
+        regex = re.compile(pattern, re.IGNORECASE)
+        resolved[key] = next((col for col in columns if regex.search(col)), None)
+    return resolved
 
 class DataDictionary(BaseModel):
     fields: List[DataDictionaryField]
 
+    def content_hash(self) -> str:
+        """SHA-256 of the parsed fields; stored as `datadict_hash` in templates"""
+        return hashlib.sha256(self.model_dump_json().encode("utf-8")).hexdigest()
+
     @classmethod
     # Parses a REDCap data dictionary CSV file into a DataDictionary instance
     def from_csv(cls, file_path: str) -> "DataDictionary":
-        df = pd.read_csv(file_path, sep=None, engine='python', encoding='utf-8')
-        df = df.where(pd.notna(df), None)
-        
-        # Find columns once
-        def find_col(pattern: str) -> Optional[str]:
-            for col in df.columns:
-                if re.search(pattern, col, re.IGNORECASE):
-                    return col
-            return None
-        
-        field_name_col = find_col(r'.*field.*name|.*variable.*name')
-        
+        with open(file_path, "r", encoding="utf-8-sig") as f:
+            sep = sniff_delimiter(f.readline())
+        df = pd.read_csv(file_path, sep=sep, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+        columns = resolve_columns(list(df.columns))
+
+        def column(key: str) -> List[Optional[str]]:
+            # Column values with empty cells as None (all None if the column is missing)
+            if columns[key] is None:
+                return [None] * len(df)
+            return [v if v != "" else None for v in df[columns[key]].tolist()]
+
+        def parsed(key: str, parser) -> List[Any]:
+            # Parse each distinct cell once; dictionaries repeat the same choices a lot
+            values = column(key)
+            lookup = {v: parser(v) for v in set(values)}
+            return [lookup[v] for v in values]
+
+        names = column("field_name")
+        form_names = column("form_name")
+        labels = column("field_label")
+        types = parsed("field_type", lambda v: FieldType(v) if v is not None else None)
+        choices = parsed("choices", cls._parse_choices)
+        calculations = parsed("choices", cls._parse_calculation)
+        validation_types = parsed("validation_type", cls._parse_validataion_type)
+        minimums = parsed("validation_minimum", cls._parse_validation_limit)
+        maximums = parsed("validation_maximum", cls._parse_validation_limit)
+        identifiers = column("identifier")
+        branching = parsed("branching_logic", cls._parse_branching_logic)
+        expressions = column("branching_logic")
+        required = column("required_field")
+
         fields = []
-        for _, row in df.iterrows():
-            if not row.get(field_name_col):
+        for i, name in enumerate(names):
+            if not name:
                 continue
-                
-            field = DataDictionaryField(
-                field_name=row.get(field_name_col),
-                form_name=row.get(find_col(r'.*form.*name')),
-                field_label=row.get(find_col(r'.*field.*label')),
-                field_type=row.get(find_col(r'.*field.*type')),
-                choices=cls._parse_choices(row.get(find_col(r'.*choices.*calculations.*slider'))),
-                calculation=cls._parse_calculation(row.get(find_col(r'.*choices.*calculations.*slider'))),
-                validation_type=cls._parse_validataion_type(row.get(find_col(r'.*validation.*type.*slider'))),
-                validation_minimum=cls._parse_validation_limit(row.get(find_col(r'.*validation.*min'))),
-                validation_maximum=cls._parse_validation_limit(row.get(find_col(r'.*validation.*max'))),
-                identifier=row.get(find_col(r'.*identifier')) == "y", # "y" indicates true
-                branching_logic=cls._parse_branching_logic(row.get(find_col(r'.*branching.*logic'))),
-                required_field=row.get(find_col(r'.*required.*field')) == "y", # "y" indicates true
-            )
-            fields.append(field)
-        return cls(fields=fields)
+            if form_names[i] is None or types[i] is None:
+                raise ValueError(f"Field '{name}' is missing its form name or field type")
+            # Values are validated above, so skip pydantic validation per field
+            fields.append(DataDictionaryField.model_construct(
+                field_name=name,
+                form_name=form_names[i],
+                field_label=labels[i],
+                field_type=types[i],
+                choices=dict(choices[i]) if choices[i] else None,
+                calculation=calculations[i],
+                validation_type=validation_types[i],
+                validation_minimum=minimums[i],
+                validation_maximum=maximums[i],
+                identifier=identifiers[i] == "y", # "y" indicates true
+                branching_logic=[dict(c) for c in branching[i]] if branching[i] else None,
+                required_field=required[i] == "y", # "y" indicates true
+                branching_expression=(expressions[i] or "").strip() or None,
+            ))
+        return cls.model_construct(fields=fields)
 
     @staticmethod
     # Parses choices if present in the format "1, Yes | 0, No"
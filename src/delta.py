@@ -0,0 +1,275 @@
+import csv
+import hashlib
+import json
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, List, Optional, Tuple
+
+from .template import Template
+from .transform import KEY_COLUMNS
+from .utils import sniff_delimiter
+
+# Bump when the index file layout or the hashing changes
+_INDEX_VERSION = 1
+
+_PRIME = np.uint64(1099511628211)  # FNV-1a prime, mixes column hashes in order
+
+
+class DeltaReport(BaseModel):
+    rows: int = 0  # rows of the new output
+    new: int = 0  # keys not in the previous export
+    changed: int = 0
+    unchanged: int = 0  # skipped
+    removed: int = 0  # keys of the previous export missing now (REDCap imports cannot delete them)
+    blanked_cells: int = 0  # cells of unchanged forms left empty (changed_columns)
+    seconds: float = 0.0
+
+    @property
+    def written(self) -> int:
+        return self.new + self.changed
+
+
+def form_columns(header: List[str], template: Optional[Template] = None) -> Dict[str, List[str]]:
+    """
+    Value columns of an export header grouped by form (the field's form_name, else its
+    repeat instrument). Checkbox columns `field___code` belong to their field; columns
+    unknown to the template (or all, without template) form the group "".
+    """
+    forms = {}
+    if template is not None:
+        forms = {f.field_name: f.form_name or f.repeat_instrument or "" for f in template.fields}
+    groups: Dict[str, List[str]] = {}
+    for column in header:
+        if column in KEY_COLUMNS:
+            continue
+        field = column if column in forms or "___" not in column else column.rsplit("___", 1)[0]
+        groups.setdefault(forms.get(field, ""), []).append(column)
+    return groups
+
+
+def _seed(columns: List[str]) -> np.uint64:
+    """Per-form start value: a changed column layout changes every hash of the form"""
+    digest = hashlib.sha256("\x1f".join(columns).encode("utf-8")).digest()
+    return np.uint64(int.from_bytes(digest[:8], "little"))
+
+
+def _combine(hashes: List[np.ndarray], seed: np.uint64, rows: int) -> np.ndarray:
+    out = np.full(rows, seed, dtype=np.uint64)
+    for values in hashes:
+        out *= _PRIME  # wraps around
+        out ^= values
+    return out
+
+
+def hash_rows(rows: np.ndarray, header: List[str], forms: Dict[str, List[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Hashes of export rows (text matrix with `header` columns): per row the key hash
+    (KEY_COLUMNS), the hash of all values and one 32-bit hash per form (in `forms` order).
+    Every column is hashed once over its distinct values (pandas hash_array).
+    """
+    positions = {name: i for i, name in enumerate(header)}
+    column_hashes = {
+        name: pd.util.hash_array(np.asarray(rows[:, i], dtype=object), categorize=True)
+        for name, i in positions.items()
+    }
+    keys = _combine([column_hashes[c] for c in KEY_COLUMNS], np.uint64(0), len(rows))
+    per_form = [_combine([column_hashes[c] for c in columns], _seed(columns), len(rows)) for columns in forms.values()]
+    values = _combine(per_form, np.uint64(0), len(rows))
+    form_hashes = np.column_stack(per_form).astype(np.uint32) if per_form else np.empty((len(rows), 0), dtype=np.uint32)
+    return keys, values, form_hashes
+
+
+class DeltaIndex:
+    """
+    Compact hash index of one export: sorted 64-bit key hashes with, per key, a 64-bit
+    hash of the row's values and a 32-bit hash per form. Stored as one uncompressed
+    .npz file, so loading is a few array reads even for millions of rows.
+    """
+
+    def __init__(self, forms: Dict[str, List[str]], keys: np.ndarray, values: np.ndarray, form_hashes: np.ndarray):
+        order = np.argsort(keys, kind="stable")
+        self.forms = forms
+        self.keys = keys[order]
+        self.values = values[order]
+        self.form_hashes = form_hashes[order]
+        duplicated = self.keys[1:] == self.keys[:-1]
+        if duplicated.any():
+            print(f"Warning: {int(duplicated.sum())} duplicate export keys in the delta index, the last row counts")
+            last = np.append(~duplicated, True)
+            self.keys, self.values, self.form_hashes = self.keys[last], self.values[last], self.form_hashes[last]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_rows(cls, rows: np.ndarray, header: List[str], template: Optional[Template] = None) -> "DeltaIndex":
+        forms = form_columns(header, template)
+        return cls(forms, *hash_rows(rows, header, forms))
+
+    @classmethod
+    def from_csv(cls, export_path: str, template: Optional[Template] = None, delimiter: Optional[str] = None) -> "DeltaIndex":
+        """Index of an existing export CSV (e.g. the last import) read as text"""
+        rows, header, _ = _read_export(export_path, delimiter)
+        return cls.from_rows(rows, header, template)
+
+    def save(self, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:  # keeps the name as given (np.savez would append .npz)
+            np.savez(
+                f,
+                version=np.array(_INDEX_VERSION),
+                forms=np.array(json.dumps(self.forms)),
+                keys=self.keys,
+                values=self.values,
+                form_hashes=self.form_hashes,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "DeltaIndex":
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != _INDEX_VERSION:
+                raise ValueError(f"Delta index '{path}' has version {int(data['version'])}, expected {_INDEX_VERSION}")
+            index = cls.__new__(cls)
+            index.forms = json.loads(str(data["forms"]))
+            index.keys = data["keys"]
+            index.values = data["values"]
+            index.form_hashes = data["form_hashes"]
+        return index
+
+
+class DeltaFilter:
+    """
+    Delta stage of the export: compares each block of output rows with the index of the
+    previous export (none: every row is new) and keeps only new or changed rows. With
+    `changed_columns`, changed rows keep only the columns of forms whose hash changed;
+    the other cells stay empty, which REDCap imports with the default overwrite
+    behaviour leave untouched. The hashes of all rows seen build the index for the next
+    run (`index()` / `save()`).
+    """
+
+    def __init__(self, template: Optional[Template] = None, previous: Optional[DeltaIndex] = None, changed_columns: bool = False):
+        self.template = template
+        self.previous = previous
+        self.changed_columns = changed_columns
+        self._forms: Optional[Dict[str, List[str]]] = None
+        self._header: Optional[List[str]] = None
+        self._form_positions: List[np.ndarray] = []
+        self._previous_forms = np.empty(0, dtype=np.int64)
+        self._parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._report = DeltaReport()
+
+    @classmethod
+    def open(cls, index_path: str, template: Optional[Template] = None, changed_columns: bool = False) -> "DeltaFilter":
+        """Filter against the index saved at `index_path` (if it exists yet)"""
+        previous = DeltaIndex.load(index_path) if Path(index_path).exists() else None
+        return cls(template, previous, changed_columns)
+
+    def _prepare(self, header: List[str]) -> None:
+        if self._header is not None:
+            if header != self._header:
+                raise ValueError("DeltaFilter got rows with a different header")
+            return
+        self._header = list(header)
+        self._forms = form_columns(header, self.template)
+        self._form_positions = [np.array([header.index(c) for c in columns], dtype=np.int64) for columns in self._forms.values()]
+        # position of each form in the previous index, -1 if it is new or its columns changed
+        previous = self.previous.forms if self.previous is not None else {}
+        names = list(previous)
+        self._previous_forms = np.array(
+            [names.index(name) if previous.get(name) == columns else -1 for name, columns in self._forms.items()],
+            dtype=np.int64,
+        )
+
+    def filter(self, rows: np.ndarray, header: List[str]) -> np.ndarray:
+        """New and changed rows of a block of export rows (text matrix with `header` columns)"""
+        started = time.perf_counter()
+        self._prepare(header)
+        keys, values, form_hashes = hash_rows(rows, self._header, self._forms)
+        self._parts.append((keys, values, form_hashes))
+        self._report.rows += len(rows)
+        if self.previous is None or not len(self.previous):
+            self._report.new += len(rows)
+            self._report.seconds += time.perf_counter() - started
+            return rows
+        found_at = np.minimum(np.searchsorted(self.previous.keys, keys), len(self.previous) - 1)
+        found = self.previous.keys[found_at] == keys
+        changed = found & (self.previous.values[found_at] != values)
+        new = ~found
+        self._report.new += int(new.sum())
+        self._report.changed += int(changed.sum())
+        self._report.unchanged += int((found & ~changed).sum())
+        out = rows[new | changed]
+        if self.changed_columns and changed.any():
+            out = out.copy()
+            changed_rows = np.flatnonzero(changed[new | changed])
+            old = self.previous.form_hashes[found_at[changed]]
+            known = self._previous_forms >= 0
+            differs = np.ones((len(changed_rows), len(self._forms)), dtype=bool)
+            differs[:, known] = old[:, self._previous_forms[known]] != form_hashes[changed][:, known]
+            differs[~differs.any(axis=1)] = True  # 32-bit form hashes collided: keep the whole row
+            for form, positions in enumerate(self._form_positions):
+                same = changed_rows[~differs[:, form]]
+                if len(same) and len(positions):
+                    cells = out[np.ix_(same, positions)]
+                    self._report.blanked_cells += int((cells != "").sum())
+                    out[np.ix_(same, positions)] = ""
+        self._report.seconds += time.perf_counter() - started
+        return out
+
+    def index(self) -> DeltaIndex:
+        """Index of all rows passed to `filter` (the complete new output)"""
+        if not self._parts:
+            return DeltaIndex(self._forms or {}, np.empty(0, np.uint64), np.empty(0, np.uint64), np.empty((0, 0), np.uint32))
+        keys, values, form_hashes = (np.concatenate(part) for part in zip(*self._parts))
+        return DeltaIndex(self._forms, keys, values, form_hashes)
+
+    def save(self, index_path: str) -> None:
+        self.index().save(index_path)
+
+    def report(self) -> DeltaReport:
+        report = self._report.model_copy(deep=True)
+        if self.previous is not None and len(self.previous) and self._parts:
+            seen = np.concatenate([keys for keys, _, _ in self._parts])
+            report.removed = int((~np.isin(self.previous.keys, seen)).sum())
+        elif self.previous is not None:
+            report.removed = len(self.previous)
+        return report
+
+
+def _read_export(export_path: str, delimiter: Optional[str] = None) -> Tuple[np.ndarray, List[str], str]:
+    if delimiter is None:
+        with open(export_path, "r", encoding="utf-8") as f:
+            delimiter = sniff_delimiter(f.readline())
+    frame = pd.read_csv(export_path, sep=delimiter, dtype=str, keep_default_na=False, encoding="utf-8")
+    missing = [c for c in KEY_COLUMNS if c not in frame.columns]
+    if missing:
+        raise ValueError(f"Export '{export_path}' is missing key columns: {', '.join(missing)}")
+    return frame.to_numpy(dtype=object), list(frame.columns), delimiter
+
+
+def write_delta_csv(
+    export_path: str,
+    output_path: str,
+    index_path: str,
+    template: Optional[Template] = None,
+    changed_columns: bool = False,
+    delimiter: Optional[str] = None,
+) -> DeltaReport:
+    """
+    Write the new and changed rows of a complete export CSV to `output_path`, compared
+    with the index at `index_path` (see DeltaFilter), then replace that index with the
+    index of `export_path`. Without an index yet, every row is written.
+    """
+    rows, header, delimiter = _read_export(export_path, delimiter)
+    delta = DeltaFilter.open(index_path, template, changed_columns)
+    out = delta.filter(rows, header)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(header)
+        writer.writerows(out.tolist())
+    delta.save(index_path)
+    return delta.report()
@@ -0,0 +1,215 @@
+import time
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from typing import Dict, List, Optional, Tuple
+
+from .datadict import DataDictionary, DataDictionaryField, FieldType
+from .template import Template, TemplateField
+
+ENCODED_TYPES = {FieldType.RADIO, FieldType.DROPDOWN, FieldType.YESNO, FieldType.CHECKBOX}
+
+# Labels accepted for yesno fields (normalized, see normalize_labels)
+YESNO_LABELS = {
+    "ja": 1, "yes": 1, "y": 1, "j": 1, "true": 1, "wahr": 1, "positiv": 1,
+    "nein": 0, "no": 0, "n": 0, "false": 0, "falsch": 0, "negativ": 0,
+}
+
+# Separators between the labels of one checkbox cell ("Penicillin | Latex")
+CHECKBOX_SEPARATORS = r"\s*[|;]\s*"
+
+_FOLDED = {"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"}
+
+
+def _label_text(values) -> pd.Series:
+    """Cells as text; integral numbers as their integer text (1.0 -> "1"), so codes match as labels"""
+    values = pd.Series(values, dtype=object)
+    numbers = values.map(lambda v: isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool))
+    if numbers.any():
+        values[numbers] = values[numbers].map(lambda v: str(int(v)) if float(v).is_integer() else str(v))
+    return values.astype(str)
+
+
+def normalize_labels(values) -> pd.Series:
+    """
+    Case-, whitespace- and umlaut-insensitive form of choice labels: casefolded, inner
+    whitespace collapsed, umlauts spelled out ("Größe" == "groesse"), other accents
+    dropped. Integral numbers become their integer text, so codes match as labels.
+    """
+    text = _label_text(values).str.casefold().str.strip().str.replace(r"\s+", " ", regex=True)
+    for umlaut, spelled in _FOLDED.items():
+        text = text.str.replace(umlaut, spelled, regex=False)
+    return text.str.normalize("NFKD").str.replace(r"[\u0300-\u036f]", "", regex=True)
+
+
+class EncodingReport(BaseModel):
+    cells: int = 0  # non-empty cells encoded
+    unmapped: Dict[str, Dict[str, int]] = {}  # field -> unmapped label -> cells
+    seconds: float = 0.0
+
+    @property
+    def unmapped_cells(self) -> int:
+        return sum(sum(labels.values()) for labels in self.unmapped.values())
+
+
+class ChoiceLookup:
+    """Normalized label -> code arrays of one field, built once from its choices"""
+
+    def __init__(self, field_name: str, field_type: FieldType, choices: Dict[str, int]):
+        self.field_name = field_name
+        self.field_type = field_type
+        self.codes = np.array(sorted(set(choices.values())), dtype=np.int64)
+        named: Dict[str, int] = {}
+        for label, code in zip(normalize_labels(list(choices)), choices.values()):
+            if named.get(label, code) != code:
+                print(f"Warning: Field '{field_name}': label '{label}' is ambiguous, using code {named[label]}")
+                continue
+            named[label] = code
+        # codes are accepted as labels too, unless a label reads like another code
+        labels = {**{str(code): int(code) for code in self.codes}, **named}
+        self.labels = pd.Index(list(labels))
+        self._label_codes = np.array(list(labels.values()), dtype=np.int64)
+
+    @property
+    def columns(self) -> List[str]:
+        """Output columns: the field itself, or one `field___code` per checkbox option"""
+        if self.field_type == FieldType.CHECKBOX:
+            return [f"{self.field_name}___{code}" for code in self.codes]
+        return [self.field_name]
+
+    def _lookup(self, labels: pd.Series) -> np.ndarray:
+        positions = self.labels.get_indexer(normalize_labels(labels))
+        return np.where(positions >= 0, self._label_codes[np.maximum(positions, 0)], -1)
+
+    def encode(self, values: pd.Series) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Codes per cell and the unmapped labels with their cell counts. Unmapped values are
+        kept unchanged (like values not fitting a validation type in the export).
+        """
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        present = codes >= 0
+        if len(uniques):
+            unique_codes = self._lookup(pd.Series(uniques, dtype=object))
+            present &= pd.Series(uniques, dtype=object).astype(str).str.strip().ne("").to_numpy()[np.maximum(codes, 0)]
+        else:
+            unique_codes = np.empty(0, dtype=np.int64)
+        table = np.append(np.where(unique_codes >= 0, unique_codes, np.nan), np.nan)
+        out = table[codes]  # code -1 (missing) hits the trailing NaN
+        out[~present] = np.nan
+        unmapped = present & np.isnan(out)
+        if unmapped.any():
+            out = out.astype(object)
+            out[unmapped] = values.to_numpy(dtype=object)[unmapped]
+        return out, self._unmapped(uniques, unique_codes < 0, codes, present)
+
+    def expand(self, values: pd.Series) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        One-hot checkbox matrix (rows x options, 1/0). A cell may hold several labels
+        separated by "|" or ";". Rows stay NaN where the cell is empty or none of its
+        labels is mapped, so unknown data is not written as unchecked.
+        """
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        uniques = pd.Series(uniques, dtype=object)
+        parts = _label_text(uniques).str.split(CHECKBOX_SEPARATORS, regex=True).explode()
+        parts = parts[parts.str.strip() != ""]
+        part_codes = self._lookup(parts) if len(parts) else np.empty(0, dtype=np.int64)
+        matrix = np.zeros((len(uniques) + 1, len(self.codes)))
+        mapped = part_codes >= 0
+        matrix[parts.index.to_numpy()[mapped], np.searchsorted(self.codes, part_codes[mapped])] = 1
+        empty = np.ones(len(uniques) + 1, dtype=bool)
+        empty[parts.index.to_numpy()[mapped]] = False
+        matrix[empty] = np.nan  # missing (code -1 hits the last row), blank and unmapped cells
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        unmapped: Dict[str, int] = {}
+        for index, label in zip(parts.index[~mapped], parts[~mapped]):
+            unmapped[label] = unmapped.get(label, 0) + int(counts[index])
+        return matrix[codes], unmapped
+
+    @staticmethod
+    def _unmapped(uniques, missing: np.ndarray, codes: np.ndarray, present: np.ndarray) -> Dict[str, int]:
+        if not missing.any():
+            return {}
+        counts = np.bincount(codes[present], minlength=len(uniques))
+        return {str(uniques[i]): int(counts[i]) for i in np.flatnonzero(missing) if counts[i]}
+
+
+class Encoder:
+    """
+    Encoding stage: turns choice labels in wide output (see transform.pivot_wide) into
+    REDCap codes. radio/dropdown/yesno columns get the code of their label, checkbox
+    columns are replaced by one-hot `field___code` columns. Lookups are built once per
+    field from the choices of `datadict` (or the template field); each column is encoded
+    over its distinct values only. Unmapped labels are counted in `report()`.
+    """
+
+    def __init__(self, template: Template, datadict: Optional[DataDictionary] = None):
+        metadata = {f.field_name: f for f in datadict.fields} if datadict is not None else {}
+        self.lookups: Dict[str, ChoiceLookup] = {}
+        for field in template.fields:
+            meta: DataDictionaryField | TemplateField = metadata.get(field.field_name, field)
+            if meta.field_type not in ENCODED_TYPES:
+                continue
+            choices = YESNO_LABELS if meta.field_type == FieldType.YESNO else meta.choices
+            if not choices:
+                print(f"Warning: Field '{field.field_name}' ({meta.field_type.value}) has no choices, not encoded")
+                continue
+            self.lookups[field.field_name] = ChoiceLookup(field.field_name, meta.field_type, choices)
+        self._report = EncodingReport()
+
+    def columns(self, field_name: str) -> List[str]:
+        """Output columns of a field after encoding"""
+        lookup = self.lookups.get(field_name)
+        return lookup.columns if lookup is not None else [field_name]
+
+    def encode(self, wide: pd.DataFrame, fields: Optional[List[str]] = None, record: bool = True) -> pd.DataFrame:
+        """
+        Encode the given (default: all) field columns of `wide`; returns a new frame.
+        With `record=False` the cells are not counted in `report()` (look-ahead passes).
+        """
+        started = time.perf_counter()
+        names = [n for n in (fields or list(wide.columns)) if n in self.lookups and n in wide.columns]
+        columns: Dict[str, object] = {}
+        for name in names:
+            lookup = self.lookups[name]
+            values = wide[name]
+            if lookup.field_type == FieldType.CHECKBOX:
+                matrix, unmapped = lookup.expand(values)
+                for i, column in enumerate(lookup.columns):
+                    columns[column] = matrix[:, i]
+            else:
+                columns[name], unmapped = lookup.encode(values)
+            if not record:
+                continue
+            self._report.cells += int(values.notna().sum())
+            for label, count in unmapped.items():
+                labels = self._report.unmapped.setdefault(name, {})
+                labels[label] = labels.get(label, 0) + count
+        result = {}
+        for column in wide.columns:
+            lookup = self.lookups.get(column)
+            if column in names and lookup.field_type == FieldType.CHECKBOX:
+                for expanded in lookup.columns:
+                    result[expanded] = columns[expanded]
+            else:
+                result[column] = columns.get(column, wide[column])
+        if record:
+            self._report.seconds += time.perf_counter() - started
+        return pd.DataFrame(result, index=wide.index)
+
+    def report(self) -> EncodingReport:
+        return self._report.model_copy(deep=True)
+
+
+def encode_wide(
+    wide: pd.DataFrame,
+    template: Template,
+    datadict: Optional[DataDictionary] = None,
+) -> Tuple[pd.DataFrame, EncodingReport]:
+    """Encode a wide output table; returns the encoded table and its report (see Encoder)."""
+    encoder = Encoder(template, datadict)
+    encoded = encoder.encode(wide)
+    report = encoder.report()
+    for field, labels in report.unmapped.items():
+        shown = ", ".join(f"'{label}' ({count})" for label, count in sorted(labels.items(), key=lambda i: -i[1])[:5])
+        print(f"Warning: Field '{field}': {sum(labels.values())} values without choice code: {shown}")
+    return encoded, report
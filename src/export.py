@@ -0,0 +1,342 @@
+import csv
+import gzip
+import re
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import IO, Dict, List, Optional
+
+from .branching import BranchingEvaluator
+from .datadict import FieldType, ValidationType
+from .delta import DeltaFilter
+from .encoding import Encoder
+from .template import Template, TemplateField, AggregationMethod
+from .source_table import SourceTable
+from .transform import KEY_COLUMNS, RESULT_COLUMNS, evaluate_fields, evaluate_templates, output_fields, to_datetime, to_numeric
+from .validation import Validator
+
+
+class ExportFormat:
+    """How values are written: decimal separator and date/time patterns (REDCap *_dmy types)."""
+
+    def __init__(
+        self,
+        decimal: str = ",",
+        date_format: str = "%d/%m/%Y",
+        datetime_format: str = "%d/%m/%Y %H:%M",
+        time_format: str = "%H:%M",
+    ):
+        self.decimal = decimal
+        self.date_format = date_format
+        self.datetime_format = datetime_format
+        self.time_format = time_format
+
+
+_FIXED_DECIMALS = {
+    ValidationType.NUMBER_1DP: 1,
+    ValidationType.NUMBER_2DP: 2,
+}
+
+_DATE_FORMATS = {
+    ValidationType.DATE_DMY: "date_format",
+    ValidationType.DATETIME_DMY: "datetime_format",
+    ValidationType.TIME: "time_format",
+}
+
+
+def _format_numbers(num: np.ndarray, fmt: ExportFormat, decimals: Optional[int] = None) -> pd.Series:
+    """Numbers as text with `fmt.decimal`; integral values without decimals unless `decimals` is fixed."""
+    if decimals is not None:
+        text = pd.Series(np.char.mod(f"%.{decimals}f", num), dtype=object)
+    else:
+        text = pd.Series(num.astype(str), dtype=object).str.replace(r"\.0$", "", regex=True)
+    if fmt.decimal != ".":
+        text = text.str.replace(".", fmt.decimal, regex=False)
+    return text
+
+
+def format_column(values: pd.Series, field: TemplateField, fmt: ExportFormat) -> pd.Series:
+    """
+    Format one output column for the CSV, driven by the field's validation_type:
+    integer/number(_1dp/_2dp) as numbers with the export decimal separator,
+    date/datetime/time with the export patterns, everything else as text
+    (numeric values like choice codes without trailing ".0"). Missing values become "".
+    Values that do not fit the validation type are written unchanged.
+    """
+    values = values.reset_index(drop=True)
+    present = values.notna().to_numpy()
+    out = pd.Series("", index=values.index, dtype=object)
+    if not present.any():
+        return out
+    raw = values.astype(object)
+    kind = pd.api.types.infer_dtype(raw, skipna=True)
+    if kind == "boolean" or kind.startswith("mixed"):
+        is_bool = raw.map(lambda v: isinstance(v, (bool, np.bool_))).to_numpy()
+        raw[is_bool] = raw[is_bool].astype(int)
+    text = raw.astype(str)
+    out[present] = text[present]
+
+    validation = field.validation_type
+    if validation in _DATE_FORMATS:
+        pattern = getattr(fmt, _DATE_FORMATS[validation])
+        times = to_datetime(text)
+        parsed = present & times.notna().to_numpy()
+        if parsed.any():
+            out[parsed] = times[parsed].dt.strftime(pattern).to_numpy()
+        return out
+
+    num = to_numeric(raw).to_numpy(dtype=float)
+    numeric = present & ~np.isnan(num)
+    if not numeric.any():
+        return out
+    if validation == ValidationType.INTEGER:
+        out[numeric] = _format_numbers(np.round(num[numeric]), fmt).to_numpy()
+    elif validation in _FIXED_DECIMALS:
+        out[numeric] = _format_numbers(num[numeric], fmt, _FIXED_DECIMALS[validation]).to_numpy()
+    elif validation == ValidationType.NUMBER or field.field_type == FieldType.CALC or not validation:
+        # strings that merely look numeric (e.g. IDs with leading zeros) stay as they are
+        if not validation and field.field_type != FieldType.CALC and kind in ("string", "mixed"):
+            numeric &= ~raw.map(lambda v: isinstance(v, str)).to_numpy()
+        out[numeric] = _format_numbers(num[numeric], fmt).to_numpy()
+    return out
+
+
+def _group_rows(
+    long: pd.DataFrame,
+    fields: List[TemplateField],
+    fmt: ExportFormat,
+    validator: Optional[Validator] = None,
+    encoder: Optional[Encoder] = None,
+) -> pd.DataFrame:
+    """Wide, formatted rows of one (event, instrument) group: key columns plus its own fields."""
+    long = long.copy()
+    long["redcap_repeat_instance"] = long["redcap_repeat_instance"].fillna(0)
+    wide = long.set_index(KEY_COLUMNS + ["field_name"])["value"].unstack("field_name")
+    wide = wide.reindex(columns=[f.field_name for f in fields]).reset_index()
+    for field in fields:
+        if field.aggregation in (AggregationMethod.COUNT, AggregationMethod.ANY):
+            wide[field.field_name] = wide[field.field_name].fillna(0)  # own rows without data count as 0
+    if encoder is not None:
+        wide = encoder.encode(wide, [f.field_name for f in fields])
+    if validator is not None:
+        validator.check(wide, [f.field_name for f in fields])
+    for field in fields:
+        for column in _columns(field, encoder):
+            wide[column] = format_column(wide[column], field, fmt).to_numpy()
+    return wide
+
+
+def _drop_hidden(block: pd.DataFrame, brancher: BranchingEvaluator, encoder: Optional[Encoder]) -> pd.DataFrame:
+    """
+    Long rows of a block without the values hidden by branching logic. The logic is
+    evaluated over all events of the block's records at once (fields read other events
+    and forms), on codes if an encoder is given.
+    """
+    involved = block[block["field_name"].isin(brancher.fields())].copy()
+    if involved.empty:
+        return block
+    involved["redcap_repeat_instance"] = involved["redcap_repeat_instance"].fillna(0)
+    wide = involved.set_index(KEY_COLUMNS + ["field_name"])["value"].unstack("field_name").reset_index()
+    wide.columns.name = None
+    if encoder is not None:
+        wide = encoder.encode(wide, record=False)
+    _, hidden = brancher.evaluate(wide)
+    if not brancher.blank or not hidden:
+        return block
+    drop = pd.MultiIndex.from_frame(pd.concat(
+        [wide[KEY_COLUMNS].iloc[positions].assign(field_name=name) for name, positions in hidden.items()],
+        ignore_index=True,
+    ))
+    keys = block[KEY_COLUMNS + ["field_name"]].copy()
+    keys["redcap_repeat_instance"] = keys["redcap_repeat_instance"].fillna(0)
+    return block[~pd.MultiIndex.from_frame(keys).isin(drop)]
+
+
+def _columns(field: TemplateField, encoder: Optional[Encoder]) -> List[str]:
+    return encoder.columns(field.field_name) if encoder is not None else [field.field_name]
+
+
+class _SplitWriter:
+    """CSV writer that starts a new file (with header) every `split_rows` rows; gzip-compressed if asked."""
+
+    def __init__(self, output_path: str, header: List[str], compress: bool, split_rows: Optional[int], buffer_size: int, delimiter: str):
+        self.output_path = Path(output_path)
+        self.header = header
+        self.compress = compress
+        self.split_rows = split_rows
+        self.buffer_size = buffer_size
+        self.delimiter = delimiter
+        self.paths: List[str] = []
+        self._file: Optional[IO[str]] = None
+        self._writer = None
+        self._rows = 0
+
+    def _path(self) -> Path:
+        if not self.split_rows:
+            return self.output_path
+        suffixes = "".join(self.output_path.suffixes)
+        stem = self.output_path.name[: len(self.output_path.name) - len(suffixes)] if suffixes else self.output_path.name
+        return self.output_path.with_name(f"{stem}_part{len(self.paths) + 1:03d}{suffixes}")
+
+    def _open(self) -> None:
+        path = self._path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.compress:
+            self._file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            self._file = open(path, "w", encoding="utf-8", newline="", buffering=self.buffer_size)
+        self._writer = csv.writer(self._file, delimiter=self.delimiter)
+        self._writer.writerow(self.header)
+        self.paths.append(str(path))
+        self._rows = 0
+
+    def write(self, rows: np.ndarray) -> None:
+        start = 0
+        while start < len(rows) or self._file is None:
+            if self._file is None or (self.split_rows and self._rows >= self.split_rows):
+                self.close()
+                self._open()
+            take = len(rows) - start if not self.split_rows else min(len(rows) - start, self.split_rows - self._rows)
+            self._writer.writerows(rows[start:start + take].tolist())
+            self._rows += take
+            start += take
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def write_redcap_csv(
+    results: List[pd.DataFrame],
+    template: Template,
+    output_path: str,
+    fmt: Optional[ExportFormat] = None,
+    block_records: int = 1000,
+    compress: Optional[bool] = None,
+    split_rows: Optional[int] = None,
+    buffer_size: int = 1024 * 1024,
+    delimiter: str = ",",
+    validator: Optional[Validator] = None,
+    encoder: Optional[Encoder] = None,
+    brancher: Optional[BranchingEvaluator] = None,
+    delta: Optional[DeltaFilter] = None,
+) -> List[str]:
+    """
+    Write long field results (see transform.evaluate_fields) as a wide REDCap import CSV.
+
+    Instead of pivoting the whole cohort, records are written in blocks of
+    `block_records`; within a block each (event, instrument) group is pivoted over its
+    own fields only (other columns are empty for REDCap anyway), formatted column-wise
+    with `format_column`, and the block is written in one buffered call. Rows come out
+    in the same (record, event, instrument, instance) order as `pivot_wide`.
+    `compress` (default: output path ends in .gz) writes gzip; `split_rows` starts a
+    new file `<name>_partNNN<suffix>` every N rows. With a `validator`, every group is
+    checked against the Data Dictionary before formatting (see validation.Validator;
+    violations are collected there, nothing is dropped). An `encoder` turns choice
+    labels into codes first and expands checkbox fields into `field___code` columns
+    (see encoding.Encoder). A `brancher` drops (or with `blank=False` only reports) the
+    values of fields hidden by their branching logic (see branching.BranchingEvaluator).
+    A `delta` filter writes only rows that are new or changed since the previous export
+    and collects the index for the next one (see delta.DeltaFilter). Returns the written paths.
+    """
+    fmt = fmt or ExportFormat()
+    fields = output_fields(template)
+    names = [f.field_name for f in fields]
+    header = KEY_COLUMNS + [column for f in fields for column in _columns(f, encoder)]
+    if compress is None:
+        compress = str(output_path).endswith(".gz")
+    groups: dict = {}
+    for field in fields:
+        groups.setdefault((field.event_name or "", field.repeat_instrument or ""), []).append(field)
+
+    frames = [r for r in results if not r.empty]
+    long = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=RESULT_COLUMNS)
+    long = long[long["field_name"].isin(names)]
+    records = np.sort(long["record_id"].unique())
+    long = long.sort_values("record_id", kind="stable")
+    bounds = np.searchsorted(long["record_id"].to_numpy(), records[::max(1, block_records)], side="left")
+    bounds = list(bounds) + [len(long)]
+    column_positions = {name: i for i, name in enumerate(header)}
+
+    writer = _SplitWriter(output_path, header, compress, split_rows, buffer_size, delimiter)
+    try:
+        if long.empty:
+            writer.write(np.empty((0, len(header)), dtype=object))
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            block = long.iloc[start:stop]
+            if brancher is not None:
+                block = _drop_hidden(block, brancher, encoder)
+            parts = []
+            for (event, instrument), group in block.groupby(["redcap_event_name", "redcap_repeat_instrument"], sort=False):
+                group_fields = groups.get((event, instrument))
+                if group_fields:
+                    parts.append((group_fields, _group_rows(group, group_fields, fmt, validator, encoder)))
+            if not parts:
+                continue
+            keys = pd.concat([rows[KEY_COLUMNS] for _, rows in parts], ignore_index=True)
+            matrix = np.full((len(keys), len(header)), "", dtype=object)
+            offset = 0
+            for group_fields, rows in parts:
+                columns = [column for f in group_fields for column in _columns(f, encoder)]
+                matrix[offset:offset + len(rows), [column_positions[c] for c in columns]] = rows[columns].to_numpy()
+                offset += len(rows)
+            order = keys.sort_values(KEY_COLUMNS, kind="stable").index.to_numpy()
+            instances = keys["redcap_repeat_instance"].astype("Int64")
+            matrix[:, 0] = keys["record_id"].astype(str).to_numpy()
+            matrix[:, 1] = keys["redcap_event_name"].to_numpy()
+            matrix[:, 2] = keys["redcap_repeat_instrument"].to_numpy()
+            matrix[:, 3] = instances.astype(str).where(instances != 0, "").to_numpy()
+            rows = matrix[order]
+            writer.write(delta.filter(rows, header) if delta is not None else rows)
+    finally:
+        writer.close()
+    return writer.paths
+
+
+def export_redcap_csv(
+    source: pd.DataFrame,
+    template: Template,
+    output_path: str,
+    max_workers: Optional[int] = None,
+    **options,
+) -> List[str]:
+    """Transform `source` and write the REDCap import CSV (options: see `write_redcap_csv`)."""
+    return write_redcap_csv(evaluate_fields(source, template, max_workers), template, output_path, **options)
+
+
+def export_templates(
+    source: pd.DataFrame | SourceTable,
+    templates: List[Template],
+    output_dir: Optional[str] = None,
+    combined_path: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    **options,
+) -> Dict[str, List[str]]:
+    """
+    Transform `source` for several templates in one pass (see transform.evaluate_templates)
+    and write one import CSV per template to `output_dir` (`<template name>.csv`) and/or
+    all fields into the single file `combined_path`. Returns the written paths per
+    template name ("combined" for the combined file); options: see `write_redcap_csv`.
+    """
+    if output_dir is None and combined_path is None:
+        raise ValueError("Either output_dir or combined_path is required")
+    results = evaluate_templates(source, templates, max_workers)
+    written: Dict[str, List[str]] = {}
+    if output_dir is not None:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        suffix = ".csv.gz" if options.get("compress") else ".csv"
+        for template in templates:
+            path = Path(output_dir) / (re.sub(r"[^\w.-]+", "_", template.name) + suffix)
+            written[template.name] = write_redcap_csv(results[template.name], template, str(path), **options)
+    if combined_path is not None:
+        combined = [r for template in templates for r in results[template.name]]
+        seen = set()
+        unique = []
+        for result in combined:  # fields shared by templates were evaluated once
+            name = result["field_name"].iloc[0]
+            if name not in seen:
+                seen.add(name)
+                unique.append(result)
+        written["combined"] = write_redcap_csv(unique, Template.merge(templates), combined_path, **options)
+    return written
@@ -0,0 +1,425 @@
+import hashlib
+import pickle
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from .template import Template, TemplateField, AggregationMethod, ReferenceMode, is_mapped
+from .transform import (
+    RESULT_COLUMNS,
+    TransformContext,
+    aggregate_group,
+    assign_buckets,
+    bucket_numbers,
+    evaluate_task,
+    field_result,
+    pivot_wide,
+    _level_tasks,
+)
+
+# Bump when the checkpoint layout changes
+_CHECKPOINT_VERSION = 2
+
+# Aggregations whose per-bucket state can be merged with the state of new rows
+MERGEABLE_AGGREGATIONS = {
+    AggregationMethod.FIRST,
+    AggregationMethod.LAST,
+    AggregationMethod.MEAN,
+    AggregationMethod.MIN,
+    AggregationMethod.MAX,
+    AggregationMethod.SUM,
+    AggregationMethod.COUNT,
+    AggregationMethod.ANY,
+}
+
+# Per-(record, bucket) state of mergeable aggregations; `untimed` counts rows without
+# timestamp, which sort last and therefore break merging of first/last
+_STATE_SPEC = {
+    "bucket_start": ("bucket_start", "first"),
+    "values": ("value", "count"),
+    "num_count": ("num", "count"),
+    "sum": ("num", "sum"),
+    "min": ("num", "min"),
+    "max": ("num", "max"),
+    "first": ("value", "first"),
+    "last": ("value", "last"),
+    "any": ("truthy", "max"),
+    "untimed": ("untimed", "sum"),
+}
+
+
+def empty_states() -> pd.DataFrame:
+    index = pd.MultiIndex.from_arrays([[], []], names=["record", "bucket"])
+    return pd.DataFrame(columns=list(_STATE_SPEC), index=index)
+
+
+def template_fingerprint(template: Template) -> str:
+    return hashlib.sha256(template.model_dump_json().encode("utf-8")).hexdigest()
+
+
+def bucket_states(frame: pd.DataFrame, ctx: TransformContext) -> pd.DataFrame:
+    """Mergeable aggregation state per (record label, bucket) of bucketed measurements."""
+    frame = frame.sort_values(["record", "bucket", "ts"], kind="stable").assign(
+        truthy=(frame["num"].notna() & (frame["num"] != 0)).astype(np.int8),
+        untimed=np.isnat(frame["ts"].to_numpy()).astype(np.int64),
+    )
+    states = frame.groupby(["record", "bucket"], sort=True).agg(**_STATE_SPEC)
+    records = ctx.record_labels.take(states.index.get_level_values("record").to_numpy())
+    states.index = pd.MultiIndex.from_arrays([records, states.index.get_level_values("bucket")], names=["record", "bucket"])
+    return states
+
+
+def merge_states(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """State of old rows followed by new rows (new rows are later in time)."""
+    keys = new.index
+    old = old.reindex(keys)
+    merged = pd.DataFrame(index=keys)
+    merged["bucket_start"] = old["bucket_start"].fillna(new["bucket_start"])
+    for column in ("values", "num_count", "sum", "untimed"):
+        merged[column] = old[column].fillna(0).to_numpy() + new[column].to_numpy()
+    merged["values"] = merged["values"].astype(np.int64)
+    merged["num_count"] = merged["num_count"].astype(np.int64)
+    merged["min"] = np.fmin(old["min"].to_numpy(dtype=float), new["min"].to_numpy(dtype=float))
+    merged["max"] = np.fmax(old["max"].to_numpy(dtype=float), new["max"].to_numpy(dtype=float))
+    merged["first"] = old["first"].where(old["first"].notna(), new["first"])
+    merged["last"] = new["last"].where(new["last"].notna(), old["last"])
+    merged["any"] = np.fmax(old["any"].to_numpy(dtype=float), new["any"].to_numpy(dtype=float)).astype(np.int8)
+    return merged
+
+
+def state_values(states: pd.DataFrame, method: AggregationMethod) -> pd.Series:
+    """Aggregated value of one mergeable method from bucket states."""
+    if method == AggregationMethod.MEAN:
+        return (states["sum"] / states["num_count"]).where(states["num_count"] > 0)
+    if method == AggregationMethod.SUM:
+        return states["sum"].where(states["num_count"] > 0)
+    if method == AggregationMethod.COUNT:
+        return states["values"]
+    return states[method.value]
+
+
+def _result_buckets(result: pd.DataFrame) -> pd.MultiIndex:
+    buckets = result["redcap_repeat_instance"].fillna(1).astype(np.int64).to_numpy() - 1
+    return pd.MultiIndex.from_arrays([result["record_id"].to_numpy(), buckets], names=["record", "bucket"])
+
+
+def replace_results(result: pd.DataFrame, update: pd.DataFrame, keys: pd.MultiIndex, records: Set[Any]) -> pd.DataFrame:
+    """Drop rows of `result` in `keys` (record label, bucket) or in `records`, then append `update`."""
+    stale = _result_buckets(result).isin(keys) | result["record_id"].isin(records).to_numpy()
+    parts = [frame for frame in (result[~stale], update) if not frame.empty]
+    if not parts:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[RESULT_COLUMNS]
+
+
+class IncrementalTransform:
+    """
+    Checkpointed transform for sources that grow by deltas (e.g. daily PDMS exports).
+
+    The checkpoint keeps the source rows, every field's long result, a per-record
+    watermark (latest timestamp seen) and, for query fields with mergeable aggregations
+    (first, last, mean, min, max, sum, count, any), their state per (record, bucket).
+    `update` only touches records present in the delta:
+    - rows at or after the record's watermark update the buckets they fall into; mergeable
+      states are merged in place, median/mode/nearest (and first/last next to rows
+      without timestamp) recompute just those buckets from the record's rows;
+    - new records, late rows (before the watermark or without timestamp), a moved
+      reference timepoint and outlier-filtered fields recompute the whole record;
+    - calculated fields and fields bucketed from a changed reference field are
+      re-evaluated for the delta's records, in dependency order.
+    The values equal a full `transform` of all rows (up to float rounding of merged sums).
+    """
+
+    def __init__(self, template: Template):
+        self.template = template
+        self.fields: Dict[str, TemplateField] = {f.field_name: f for f in template.fields}
+        self.rows: Optional[pd.DataFrame] = None
+        self.results: Dict[str, pd.DataFrame] = {}
+        self.states: Dict[str, pd.DataFrame] = {}
+        self.watermarks = pd.Series(dtype="datetime64[ns]")
+        self.references: Dict[str, pd.Series] = {}
+
+    @property
+    def timestamp_columns(self) -> List[str]:
+        """Timestamp columns the template reads (they define the watermark)."""
+        columns = []
+        for field in self.template.fields:
+            default = (field.source.timestamp if field.source else None) or "timestamp"
+            columns.append(default)
+            columns.extend(m.timestamp or default for m in (field.calc_vars or {}).values() if m.query_string)
+        return list(dict.fromkeys(columns))
+
+    def _groups(self) -> List[List[List[TemplateField]]]:
+        """Per evaluation level: fused groups of query fields, then single calculated fields."""
+        levels = []
+        for level in self.template.evaluation_levels():
+            levels.append(_level_tasks([self.fields[n] for n in level if is_mapped(self.fields[n])]))
+        return levels
+
+    @staticmethod
+    def _mergeable(fields: List[TemplateField]) -> bool:
+        lead = fields[0]
+        return (
+            not lead.calculation_expr
+            and not lead.outlier_filter
+            and all((f.aggregation or AggregationMethod.FIRST) in MERGEABLE_AGGREGATIONS for f in fields)
+        )
+
+    def _record_times(self, ctx: TransformContext) -> pd.Series:
+        """Latest timestamp per record label over all timestamp columns (the watermark)."""
+        latest = pd.DataFrame(index=range(len(ctx.record_labels)))
+        for column in self.timestamp_columns:
+            if column in ctx.source.columns:
+                latest[column] = pd.Series(ctx.timestamps(column)).groupby(ctx.record_codes).max()
+        times = latest.max(axis=1) if len(latest.columns) else pd.Series(pd.NaT, index=latest.index)
+        return pd.Series(times.to_numpy(dtype="datetime64[ns]"), index=ctx.record_labels)
+
+    def _reference_times(self, ctx: TransformContext) -> Dict[str, pd.Series]:
+        """Reference timepoints per record for from_timepoint fields referring to a source column."""
+        references = {}
+        for field in self.template.fields:
+            column = field.reference_column
+            if field.reference != ReferenceMode.FROM_TIMEPOINT or column not in ctx.source.columns or column in references:
+                continue
+            references[column] = pd.Series(ctx.reference_times(field), index=ctx.record_labels)
+        return references
+
+    # ------------------------------------------------------------------
+    # Full run
+    # ------------------------------------------------------------------
+
+    def initialize(self, source: pd.DataFrame) -> pd.DataFrame:
+        """Transform the complete source and build the checkpoint state. Returns the wide output."""
+        self.rows = source.reset_index(drop=True)
+        ctx = TransformContext(self.rows, self.template)
+        for level in self._groups():
+            for fields in level:
+                evaluate_task(fields, ctx)
+                if self._mergeable(fields):
+                    states = self._full_states(fields, ctx)
+                    for field in fields:
+                        self.states[field.field_name] = states
+        self.results = dict(ctx.results)
+        self.watermarks = self._record_times(ctx)
+        self.references = self._reference_times(ctx)
+        return self.wide()
+
+    def _bucketed(self, fields: List[TemplateField], ctx: TransformContext, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        lead = fields[0]
+        timestamp_column = lead.source.timestamp or "timestamp"
+        return assign_buckets(ctx.measurements(lead.source, rows=rows), lead, ctx, timestamp_column)
+
+    def _full_states(self, fields: List[TemplateField], ctx: TransformContext) -> pd.DataFrame:
+        frame = self._bucketed(fields, ctx)
+        if frame.empty:
+            return empty_states()
+        return bucket_states(frame, ctx)
+
+    def wide(self) -> pd.DataFrame:
+        """Current wide output of all records."""
+        results = [self.results[f.field_name] for f in self.template.fields if f.field_name in self.results]
+        return pivot_wide(results, self.template)
+
+    # ------------------------------------------------------------------
+    # Delta run
+    # ------------------------------------------------------------------
+
+    def update(self, delta: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add new source rows and recompute what they affect.
+        Returns the updated wide rows (all rows of the records present in `delta`).
+        """
+        if self.rows is None:
+            raise ValueError("IncrementalTransform.update called before initialize or load")
+        record_column = self.template.record_id_column
+        if record_column not in delta.columns:
+            raise ValueError(f"Record ID column '{record_column}' not found in delta data")
+        delta = delta[delta[record_column].notna()]
+        if delta.empty:
+            return pivot_wide([], self.template)
+        affected = set(delta[record_column].unique())
+        previous = self.rows[self.rows[record_column].isin(affected)]
+        rows = pd.concat([previous, delta], ignore_index=True)
+        is_new = np.zeros(len(rows), dtype=bool)
+        is_new[len(previous):] = True
+        ctx = TransformContext(rows, self.template)
+        full = self._full_records(ctx, is_new, affected)
+        for name, result in self.results.items():
+            ctx.results[name] = result[result["record_id"].isin(affected)]
+
+        changed: Dict[str, Set[Any]] = {}
+        for level in self._groups():
+            for fields in level:
+                self._update_group(fields, ctx, is_new, full, changed)
+        self.rows = pd.concat([self.rows, delta], ignore_index=True)
+        times = self._record_times(ctx)
+        self.watermarks = pd.concat([self.watermarks.drop(times.index, errors="ignore"), times])
+        for column, references in self._reference_times(ctx).items():
+            stored = self.references.get(column, pd.Series(dtype="datetime64[ns]"))
+            self.references[column] = pd.concat([stored.drop(references.index, errors="ignore"), references])
+
+        results = [r[r["record_id"].isin(affected)] for name, r in self.results.items()]
+        return pivot_wide(results, self.template)
+
+    def _full_records(self, ctx: TransformContext, is_new: np.ndarray, affected: Set[Any]) -> Set[Any]:
+        """Records that must be recomputed completely: new, late or with a moved reference."""
+        full = {r for r in affected if r not in self.watermarks.index or pd.isna(self.watermarks.get(r))}
+        for column in self.timestamp_columns:
+            if column not in ctx.source.columns:
+                continue
+            times = pd.Series(ctx.timestamps(column)[is_new])
+            records = ctx.record_labels.take(ctx.record_codes[is_new])
+            marks = self.watermarks.reindex(records).to_numpy()
+            late = times.isna().to_numpy() | (times.to_numpy() < marks)
+            full.update(records[late])
+        for column, references in self._reference_times(ctx).items():
+            stored = self.references.get(column, pd.Series(dtype="datetime64[ns]")).reindex(references.index)
+            moved = ~((references == stored) | (references.isna() & stored.isna()))
+            full.update(references.index[moved.to_numpy()])
+        return full
+
+    def _update_group(
+        self,
+        fields: List[TemplateField],
+        ctx: TransformContext,
+        is_new: np.ndarray,
+        full: Set[Any],
+        changed: Dict[str, Set[Any]],
+    ) -> None:
+        lead = fields[0]
+        if lead.calculation_expr:
+            # calculations join rows across queries and fields: re-evaluate per record
+            evaluate_task(fields, ctx)
+            records = set(ctx.record_labels)
+            self._store(lead, ctx.results[lead.field_name], empty_states().index, records, ctx)
+            changed[lead.field_name] = records
+            return
+
+        full = set(full)
+        reference = lead.reference_column if lead.reference == ReferenceMode.FROM_TIMEPOINT else None
+        if reference in changed:
+            full |= changed[reference]  # windows move with the reference timepoint
+        if lead.outlier_filter:
+            full = set(ctx.record_labels)  # quantiles are taken over the whole record
+
+        timestamp_column = lead.source.timestamp or "timestamp"
+        new_rows = ctx.measurements(lead.source, rows=is_new)
+        buckets, _ = bucket_numbers(new_rows, lead, ctx, timestamp_column)
+        touched = pd.MultiIndex.from_arrays(
+            [ctx.record_labels.take(new_rows["record"].to_numpy())[buckets >= 0], buckets[buckets >= 0]],
+            names=["record", "bucket"],
+        ).unique()
+        touched = touched[~touched.get_level_values("record").isin(full)]
+        if lead.time_interval and not lead.repeat_instrument:
+            touched = touched[touched.get_level_values("bucket") == 0]
+        changed_records = set(touched.get_level_values("record")) | (full & set(ctx.record_labels))
+        if not changed_records:
+            return
+
+        if self._mergeable(fields):
+            update = self._merged_results(fields, ctx, is_new, touched, full)
+        else:
+            frame = ctx.measurements(lead.source)
+            keep = np.ones(len(frame), dtype=bool)
+            if not lead.outlier_filter:
+                row_buckets, _ = bucket_numbers(frame, lead, ctx, timestamp_column)
+                labels = ctx.record_labels.take(frame["record"].to_numpy())
+                keys = pd.MultiIndex.from_arrays([labels, row_buckets])
+                keep = keys.isin(touched) | pd.Index(labels).isin(full)
+            update = aggregate_group(fields, frame[keep], ctx)
+        for field, result in zip(fields, update):
+            self._store(field, result, touched, full, ctx)
+            changed[field.field_name] = changed_records
+
+    def _store(self, field: TemplateField, update: pd.DataFrame, keys: pd.MultiIndex, records: Set[Any], ctx: TransformContext) -> None:
+        """Replace a field's stored results for `keys`/`records` and expose them to dependents in `ctx`."""
+        stored = self.results.get(field.field_name, pd.DataFrame(columns=RESULT_COLUMNS))
+        result = replace_results(stored, update, keys, records)
+        self.results[field.field_name] = result
+        ctx.results[field.field_name] = result[result["record_id"].isin(ctx.record_labels)]
+
+    def _merged_results(
+        self,
+        fields: List[TemplateField],
+        ctx: TransformContext,
+        is_new: np.ndarray,
+        touched: pd.MultiIndex,
+        full: Set[Any],
+    ) -> List[pd.DataFrame]:
+        """Merge new-row states into the stored bucket states; recompute buckets that cannot merge."""
+        lead = fields[0]
+        ordered = any((f.aggregation or AggregationMethod.FIRST) in (AggregationMethod.FIRST, AggregationMethod.LAST) for f in fields)
+        stored = self.states.get(lead.field_name, empty_states())
+        parts = []
+        recompute = empty_states().index
+        new_rows = self._bucketed(fields, ctx, rows=is_new)
+        if not new_rows.empty and len(touched):
+            new_states = bucket_states(new_rows, ctx)
+            merged = merge_states(stored, new_states[new_states.index.isin(touched)])
+            if ordered:
+                untimed = (merged["untimed"] > 0).to_numpy()
+                recompute = merged.index[untimed]
+                merged = merged[~untimed]
+            parts.append(merged)
+        if len(recompute) or full:
+            frame = self._bucketed(fields, ctx)
+            labels = ctx.record_labels.take(frame["record"].to_numpy())
+            keys = pd.MultiIndex.from_arrays([labels, frame["bucket"].to_numpy()])
+            frame = frame[keys.isin(recompute) | labels.isin(full)]
+            if not frame.empty:
+                parts.append(bucket_states(frame, ctx))
+        states = pd.concat(parts) if parts else empty_states()
+
+        stale = stored.index.isin(states.index) | stored.index.get_level_values("record").isin(full)
+        updated = pd.concat([stored[~stale], states]) if len(stored) else states
+        for field in fields:
+            self.states[field.field_name] = updated
+
+        codes = ctx.record_labels.get_indexer(states.index.get_level_values("record"))
+        index = pd.MultiIndex.from_arrays([codes, states.index.get_level_values("bucket")], names=["record", "bucket"])
+        starts = pd.Series(states["bucket_start"].to_numpy(), index=index)
+        results = []
+        for field in fields:
+            values = state_values(states, field.aggregation or AggregationMethod.FIRST)
+            values = pd.Series(values.to_numpy(), index=index)
+            results.append(field_result(field, values, starts, ctx))
+        return results
+
+    # ------------------------------------------------------------------
+    # Checkpoint
+    # ------------------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """Write the checkpoint to `path`."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        checkpoint = {
+            "version": _CHECKPOINT_VERSION,
+            "template": template_fingerprint(self.template),
+            "rows": self.rows,
+            "results": self.results,
+            "states": self.states,
+            "watermarks": self.watermarks,
+            "references": self.references,
+        }
+        tmp = Path(path).with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: str, template: Template) -> "IncrementalTransform":
+        """Restore a checkpoint written by `save` for the same template."""
+        with open(path, "rb") as f:
+            checkpoint: Dict[str, Any] = pickle.load(f)
+        if checkpoint.get("version") != _CHECKPOINT_VERSION:
+            raise ValueError(f"Checkpoint '{path}' has an unsupported version")
+        if checkpoint["template"] != template_fingerprint(template):
+            raise ValueError(f"Checkpoint '{path}' was created with a different template")
+        incremental = cls(template)
+        incremental.rows = checkpoint["rows"]
+        incremental.results = checkpoint["results"]
+        incremental.states = checkpoint["states"]
+        incremental.watermarks = checkpoint["watermarks"]
+        incremental.references = checkpoint["references"]
+        return incremental
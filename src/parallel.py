@@ -0,0 +1,116 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from .template import Template
+from .source_table import TIMESTAMP_COLUMNS
+from .transform import KEY_COLUMNS, QueryPredicate, build_query_plan, output_fields, transform
+from .calculation import compile_expression
+from .utils import datetime_parser
+
+# Per-process state, set once by _init_worker
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_worker(
+    template: Template, plan: Dict[str, Optional[QueryPredicate]], formats: Dict[str, Optional[str]]
+) -> None:
+    _WORKER["template"] = template
+    _WORKER["plan"] = plan
+    datetime_parser.formats.update(formats)  # the parent's timestamp formats, not re-inferred per shard
+    for field in template.fields:
+        if field.calculation_expr:
+            compile_expression(field.calculation_expr)  # warm the per-process cache
+
+
+def encode_columns(frame: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Compact columnar form of a wide result for transfer between processes: object
+    columns holding only floats travel as float64 arrays, everything else as is.
+    """
+    columns = {}
+    for name in frame.columns:
+        values = frame[name]
+        if values.dtype == object:
+            if pd.api.types.infer_dtype(values, skipna=True) in ("floating", "empty"):
+                columns[name] = ("float", values.to_numpy(dtype=float, na_value=np.nan))
+                continue
+        columns[name] = ("raw", values.to_numpy())
+    return {"columns": list(frame.columns), "data": columns, "dtypes": {n: str(frame[n].dtype) for n in frame.columns}}
+
+
+def decode_columns(payload: Dict[str, Any]) -> pd.DataFrame:
+    """Inverse of `encode_columns`."""
+    data = {}
+    for name in payload["columns"]:
+        kind, values = payload["data"][name]
+        if kind == "float":
+            values = values.astype(object)
+        data[name] = pd.Series(values, dtype=payload["dtypes"][name] if kind == "raw" else object)
+    return pd.DataFrame(data, columns=payload["columns"])
+
+
+def _run_shard(shard: pd.DataFrame) -> Dict[str, Any]:
+    wide = transform(shard, _WORKER["template"], max_workers=1, plan=_WORKER["plan"])
+    return encode_columns(wide)
+
+
+def shard_records(source: pd.DataFrame, record_column: str, shard_size: int) -> List[pd.DataFrame]:
+    """Split the source into shards of `shard_size` records each (rows of a record stay together)."""
+    codes, _ = pd.factorize(source[record_column], use_na_sentinel=True)
+    valid = codes >= 0
+    shard_ids = codes[valid] // max(1, shard_size)
+    rows = source[valid]
+    return [rows.iloc[positions] for positions in pd.Series(np.arange(len(rows))).groupby(shard_ids).indices.values()]
+
+
+def sort_wide(wide: pd.DataFrame) -> pd.DataFrame:
+    """Order wide rows by (record, event, instrument, instance), as `pivot_wide` does."""
+    keys = wide[KEY_COLUMNS].copy()
+    keys["redcap_repeat_instance"] = keys["redcap_repeat_instance"].fillna(0)
+    order = keys.sort_values(KEY_COLUMNS, kind="stable").index
+    return wide.loc[order].reset_index(drop=True)
+
+
+def timestamp_formats(source: pd.DataFrame) -> Dict[str, Optional[str]]:
+    """
+    Column formats of the shared datetime parser, inferred once over the whole source
+    for text timestamp columns it has not seen yet, so every shard parses alike.
+    """
+    for column in TIMESTAMP_COLUMNS:
+        if column in source.columns and column not in datetime_parser.formats:
+            if not pd.api.types.is_datetime64_any_dtype(source[column]):
+                datetime_parser.formats[column] = datetime_parser.infer_format(source[column])
+    return dict(datetime_parser.formats)
+
+
+def parallel_transform(
+    source: pd.DataFrame,
+    template: Template,
+    workers: Optional[int] = None,
+    shard_size: int = 500,
+) -> pd.DataFrame:
+    """
+    Transform `source` on a process pool. Records are independent until the final
+    wide output, so the source is split into shards of `shard_size` records that run
+    on `workers` processes (default: CPU count). The template, its query plan and the
+    timestamp formats are sent to each worker once; workers return compact columnar
+    results, which are merged in (record, event, instrument, instance) order. The result equals `transform`.
+    """
+    plan = build_query_plan(template)
+    shards = shard_records(source, template.record_id_column, shard_size)
+    columns = KEY_COLUMNS + [f.field_name for f in output_fields(template)]
+    if not shards:
+        return pd.DataFrame(columns=columns)
+    workers = workers or os.cpu_count() or 1
+    formats = timestamp_formats(source)
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(shards)), initializer=_init_worker, initargs=(template, plan, formats)
+    ) as pool:
+        parts = [decode_columns(payload) for payload in pool.map(_run_shard, shards)]
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return sort_wide(pd.concat(parts, ignore_index=True))[columns]
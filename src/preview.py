@@ -0,0 +1,170 @@
+import io
+import mmap
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Callable, Dict, List, Optional, Sequence
+
+from .streaming import csv_options
+from .transform import to_numeric
+
+CHOICE_COLUMNS = ["parameter", "category"]  # columns whose distinct values feed the builder's choices
+
+
+class ColumnStats(BaseModel):
+    name: str
+    non_empty: int = 0
+    distinct: Optional[int] = 0  # None once more than `max_distinct` values were seen
+    numeric: int = 0  # values parsing as numbers (German decimal commas accepted)
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+
+
+class PagedCsv:
+    """
+    Page-wise access to a CSV file without loading it: the byte offset of every
+    `page_size`-th line is indexed once over a memory map, a page is then one seek
+    and a small read_csv. Rows must not contain line breaks inside quoted values.
+    """
+
+    def __init__(self, path: str, page_size: int = 50, sep: Optional[str] = None, encoding: str = "utf-8"):
+        self.path = path
+        self.page_size = page_size
+        self.options = csv_options(path, sep, encoding)
+        self.columns: List[str] = []
+        self.rows = 0
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._end = 0
+
+    def build_index(self, progress: Optional[Callable[[float], None]] = None, block: int = 8 * 2**20) -> None:
+        """Find the line starts (one pass over the file in `block`-byte slices)"""
+        with open(self.path, "rb") as f:
+            header = f.readline()
+            self.columns = list(pd.read_csv(io.BytesIO(header), nrows=0, **self.options).columns)
+            size = f.seek(0, 2)
+            if size <= len(header):
+                self._end = size
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = np.frombuffer(mm, dtype=np.uint8)
+                starts = [np.array([len(header)], dtype=np.int64)]
+                for begin in range(len(header), size, block):
+                    newlines = np.flatnonzero(data[begin:begin + block] == 10) + begin + 1
+                    starts.append(newlines.astype(np.int64))
+                    if progress is not None:
+                        progress(min(1.0, (begin + block) / size))
+                del data
+        lines = np.concatenate(starts)
+        lines = lines[lines < size]  # no row after the final line break
+        self.rows = len(lines)
+        self._offsets = lines[::self.page_size].copy()
+        self._end = size
+
+    @property
+    def pages(self) -> int:
+        return len(self._offsets)
+
+    def page(self, number: int) -> pd.DataFrame:
+        """Rows of page `number` (0-based) as text columns"""
+        if not 0 <= number < self.pages:
+            return pd.DataFrame(columns=self.columns)
+        start = int(self._offsets[number])
+        end = int(self._offsets[number + 1]) if number + 1 < self.pages else self._end
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            chunk = f.read(end - start)
+        return pd.read_csv(io.BytesIO(chunk), header=None, names=self.columns, keep_default_na=False, **self.options)
+
+
+class DatasetPreview:
+    """
+    What the template builder keeps of an example data set: a uniform reservoir sample
+    of `sample_size` rows, the distinct values of `key_columns`, per-column statistics
+    and a paged view of the file (see PagedCsv). Built in one streaming pass by `scan`;
+    the file itself is never held in memory.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_size: int = 1000,
+        key_columns: Sequence[str] = CHOICE_COLUMNS,
+        max_distinct: int = 10_000,
+        page_size: int = 50,
+        seed: int = 0,
+    ):
+        self.path = path
+        self.sample_size = sample_size
+        self.key_columns = list(key_columns)
+        self.max_distinct = max_distinct
+        self.sample = pd.DataFrame()
+        self.distinct: Dict[str, List[str]] = {}
+        self.stats: Dict[str, ColumnStats] = {}
+        self.rows = 0
+        self.pages = PagedCsv(path, page_size)
+        self._rng = np.random.default_rng(seed)
+        self._values: Dict[str, Optional[set]] = {}
+        self._text_columns: set = set()
+
+    def scan(self, progress: Optional[Callable[[float], None]] = None, chunksize: int = 100_000) -> "DatasetPreview":
+        """Read the file once in chunks, then index its pages; `progress` gets the done fraction (0..1)"""
+        size = max(1, Path(self.path).stat().st_size)
+        with open(self.path, "rb") as f:
+            for chunk in pd.read_csv(f, chunksize=chunksize, keep_default_na=False, **self.pages.options):
+                self._add(chunk)
+                if progress is not None:
+                    progress(0.9 * min(1.0, f.tell() / size))
+        self.sample = self.sample.reset_index(drop=True)
+        self.distinct = {
+            column: sorted(values) for column, values in self._values.items()
+            if column in self.key_columns and values is not None
+        }
+        for column, values in self._values.items():
+            if column in self.key_columns and values is None:
+                print(f"Warning: Column '{column}' has more than {self.max_distinct} distinct values, none kept")
+        self.pages.build_index(None if progress is None else lambda done: progress(0.9 + 0.1 * done))
+        return self
+
+    def _add(self, chunk: pd.DataFrame) -> None:
+        seen = self.rows
+        self.rows += len(chunk)
+        self._add_sample(chunk, seen)
+        for column in chunk.columns:
+            values = chunk[column]
+            counts = values[values != ""].value_counts(sort=False)  # parse each distinct value once
+            stats = self.stats.setdefault(column, ColumnStats(name=column))
+            stats.non_empty += int(counts.sum())
+            if column not in self._text_columns and len(counts):
+                numbers = to_numeric(counts.index.to_series())
+                parsed = numbers.notna().to_numpy()
+                if parsed.any():
+                    stats.numeric += int(counts.to_numpy()[parsed].sum())
+                    low, high = float(numbers.min()), float(numbers.max())
+                    stats.minimum = low if stats.minimum is None else min(stats.minimum, low)
+                    stats.maximum = high if stats.maximum is None else max(stats.maximum, high)
+                elif not stats.numeric:
+                    self._text_columns.add(column)  # no number in its first values: skip parsing from now on
+            distinct = self._values.setdefault(column, set())
+            if distinct is not None:
+                distinct.update(counts.index)
+                if len(distinct) > self.max_distinct:
+                    self._values[column] = distinct = None
+            stats.distinct = None if distinct is None else len(distinct)
+
+    def _add_sample(self, chunk: pd.DataFrame, seen: int) -> None:
+        """Reservoir sampling (Algorithm R), vectorized per chunk"""
+        fill = max(0, min(self.sample_size - seen, len(chunk)))
+        if fill:
+            head = chunk.iloc[:fill]
+            self.sample = pd.concat([self.sample, head], ignore_index=True) if len(self.sample) else head.reset_index(drop=True)
+        if fill == len(chunk):
+            return
+        positions = np.arange(seen + fill, seen + len(chunk))
+        slots = self._rng.integers(0, positions + 1)
+        keep = slots < self.sample_size
+        if keep.any():
+            # later rows win a slot drawn twice, as in the sequential algorithm
+            slots, rows = slots[keep], positions[keep] - seen
+            last = len(slots) - 1 - np.unique(slots[::-1], return_index=True)[1]
+            self.sample.iloc[slots[last]] = chunk.iloc[rows[last]].to_numpy()
@@ -0,0 +1,249 @@
+import cProfile
+import html
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, Iterator, List, Optional
+
+STAGES = ["query", "calc", "aggregate"]
+
+
+class StageRecord(BaseModel):
+    """One stage of one scheduler task (a single field, or fused fields sharing a query)"""
+    fields: List[str]
+    stage: str
+    seconds: float = 0.0
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    peak_bytes: Optional[int] = None  # traced peak above the stage's start (trace_memory only)
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+class FieldProfile(BaseModel):
+    """All stages of one task, the unit the report ranks"""
+    fields: List[str]
+    seconds: float = 0.0
+    stages: Dict[str, float] = {}
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    peak_bytes: Optional[int] = None
+    cache_hits: int = 0
+    cache_misses: int = 0
+    profile_path: Optional[str] = None  # cProfile dump (see TransformProfiler.dump_profiles)
+
+    @property
+    def label(self) -> str:
+        return " + ".join(self.fields)
+
+
+class ProfileReport(BaseModel):
+    total_seconds: float = 0.0
+    stage_seconds: Dict[str, float] = {}
+    fields: List[FieldProfile] = []  # slowest first
+    records: List[StageRecord] = []
+
+    def summary_lines(self, top: int = 5) -> List[str]:
+        """Short text summary: total, time per stage and the slowest tasks"""
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stage_seconds.items())
+        lines = [f"Transform {self.total_seconds:.2f}s ({stages})"]
+        for profile in self.fields[:top]:
+            share = profile.seconds / self.total_seconds * 100 if self.total_seconds else 0.0
+            rows = f", {profile.rows_in:,} rows in" if profile.rows_in is not None else ""
+            lines.append(f"{profile.seconds:8.3f}s {share:5.1f}%  {profile.label}{rows}")
+        return lines
+
+    def to_json(self, path: str) -> None:
+        Path(path).write_text(self.model_dump_json(indent=2), encoding="utf-8")
+
+    def to_html(self, path: str) -> None:
+        """Ranked table with a time bar per task"""
+        slowest = self.fields[0].seconds if self.fields else 0.0
+        rows = []
+        for rank, profile in enumerate(self.fields, start=1):
+            width = profile.seconds / slowest * 100 if slowest else 0
+            stages = ", ".join(f"{s} {t:.3f}s" for s, t in profile.stages.items())
+            peak = f"{profile.peak_bytes / 2**20:.1f}" if profile.peak_bytes is not None else ""
+            rows.append(
+                f"<tr><td>{rank}</td><td>{html.escape(profile.label)}</td>"
+                f"<td><div class='bar' style='width:{width:.1f}%'></div>{profile.seconds:.3f}s</td>"
+                f"<td>{html.escape(stages)}</td><td>{profile.rows_in if profile.rows_in is not None else ''}</td>"
+                f"<td>{profile.rows_out if profile.rows_out is not None else ''}</td><td>{peak}</td>"
+                f"<td>{profile.cache_hits}/{profile.cache_hits + profile.cache_misses}</td>"
+                f"<td>{html.escape(profile.profile_path or '')}</td></tr>"
+            )
+        summary = "<br>".join(html.escape(line) for line in self.summary_lines(top=0))
+        Path(path).write_text(
+            "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Transform profile</title><style>"
+            "body{font-family:sans-serif}table{border-collapse:collapse}td,th{padding:2px 8px;text-align:left}"
+            "tr:nth-child(even){background:#f3f3f3}.bar{background:#4a90d9;height:8px;margin-bottom:2px}"
+            "</style></head><body>"
+            f"<h1>Transform profile</h1><p>{summary}</p><table><tr><th>#</th><th>Fields</th><th>Time</th>"
+            "<th>Stages</th><th>Rows in</th><th>Rows out</th><th>Peak MiB</th><th>Cache hits</th><th>cProfile</th></tr>"
+            + "".join(rows) + "</table></body></html>",
+            encoding="utf-8",
+        )
+
+
+class _NullRecord:
+    """Accepts the attributes instrumented code sets on a record and drops them"""
+    __slots__ = ()
+
+    def __setattr__(self, name, value) -> None:
+        pass
+
+
+class NullProfiler:
+    """Profiler that records nothing; the default, so instrumentation costs a no-op call"""
+    enabled = False
+    serial = False
+    _record = _NullRecord()
+
+    @contextmanager
+    def stage(self, fields: List[str], stage: str, rows_in: Optional[int] = None) -> Iterator[_NullRecord]:
+        yield self._record
+
+    def cache_lookup(self, hit: bool) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class TransformProfiler:
+    """
+    Per-task, per-stage instrumentation of a transform run (see transform.evaluate_fields):
+    wall time, rows in/out and cache hits of the query, calc and aggregate stages.
+
+    - `trace_memory`: peak traced memory per stage (tracemalloc; slows the run down).
+    - `cprofile`: run every task under cProfile; `dump_profiles` writes the slowest
+      ones as .prof files (pstats format: snakeviz, flameprof, gprof2dot).
+    Both switch the scheduler to serial evaluation, since neither can attribute
+    allocations or calls to one of several concurrently running tasks.
+    """
+    enabled = True
+
+    def __init__(self, trace_memory: bool = False, cprofile: bool = False):
+        self.trace_memory = trace_memory
+        self.cprofile = cprofile
+        self.records: List[StageRecord] = []
+        self.profiles: Dict[tuple, pstats.Stats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started = time.perf_counter()
+        self._finished: Optional[float] = None
+        self._tracing = False
+
+    @property
+    def serial(self) -> bool:
+        return self.trace_memory or self.cprofile
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._finished = None
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def stop(self) -> None:
+        self._finished = time.perf_counter()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    @contextmanager
+    def stage(self, fields: List[str], stage: str, rows_in: Optional[int] = None) -> Iterator[StageRecord]:
+        record = StageRecord(fields=list(fields), stage=stage, rows_in=rows_in)
+        previous = getattr(self._local, "record", None)
+        self._local.record = record
+        profile = cProfile.Profile() if self.cprofile else None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record.seconds = time.perf_counter() - started
+            if self.trace_memory:
+                record.peak_bytes = tracemalloc.get_traced_memory()[1] - base
+            self._local.record = previous
+            with self._lock:
+                self.records.append(record)
+                if profile is not None:
+                    key = tuple(record.fields)
+                    stats = pstats.Stats(profile)
+                    if key in self.profiles:
+                        self.profiles[key].add(stats)
+                    else:
+                        self.profiles[key] = stats
+
+    def cache_lookup(self, hit: bool) -> None:
+        """Count a memoized lookup (query positions, parsed columns) for the stage running in this thread"""
+        record = getattr(self._local, "record", None)
+        if record is None:
+            return
+        if hit:
+            record.cache_hits += 1
+        else:
+            record.cache_misses += 1
+
+    def report(self) -> ProfileReport:
+        with self._lock:
+            records = list(self.records)
+        by_task: Dict[tuple, FieldProfile] = {}
+        stage_seconds: Dict[str, float] = {}
+        for record in records:
+            stage_seconds[record.stage] = stage_seconds.get(record.stage, 0.0) + record.seconds
+            profile = by_task.setdefault(tuple(record.fields), FieldProfile(fields=record.fields))
+            profile.seconds += record.seconds
+            profile.stages[record.stage] = profile.stages.get(record.stage, 0.0) + record.seconds
+            if profile.rows_in is None:
+                profile.rows_in = record.rows_in  # rows entering the task's first stage
+            if record.rows_out is not None:
+                profile.rows_out = record.rows_out
+            if record.peak_bytes is not None:
+                profile.peak_bytes = max(profile.peak_bytes or 0, record.peak_bytes)
+            profile.cache_hits += record.cache_hits
+            profile.cache_misses += record.cache_misses
+        finished = self._finished if self._finished is not None else time.perf_counter()
+        return ProfileReport(
+            total_seconds=finished - self._started,
+            stage_seconds={s: stage_seconds[s] for s in STAGES if s in stage_seconds},
+            fields=sorted(by_task.values(), key=lambda p: p.seconds, reverse=True),
+            records=records,
+        )
+
+    def dump_profiles(self, directory: str, top: int = 5) -> ProfileReport:
+        """Write cProfile stats of the `top` slowest tasks to `directory`; returns the report with their paths"""
+        report = self.report()
+        if not self.cprofile:
+            print("Warning: cProfile was not enabled for this run, no profiles to dump")
+            return report
+        target = Path(directory)
+        target.mkdir(parents=True, exist_ok=True)
+        for rank, profile in enumerate(report.fields[:top], start=1):
+            stats = self.profiles.get(tuple(profile.fields))
+            if stats is None:
+                continue
+            name = "".join(c if c.isalnum() or c in "-_" else "_" for c in "+".join(profile.fields))[:80]
+            path = target / f"{rank:02d}_{name}.prof"
+            stats.dump_stats(str(path))
+            profile.profile_path = str(path)
+        return report
+
+
+def save_report(report: ProfileReport, json_path: Optional[str] = None, html_path: Optional[str] = None) -> None:
+    """Write the report as JSON and/or HTML"""
+    if json_path:
+        report.to_json(json_path)
+    if html_path:
+        report.to_html(html_path)
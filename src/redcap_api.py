@@ -0,0 +1,335 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import queue
+import random
+import time
+import http.client
+import pandas as pd
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from .redcap_project import RedcapProject
+from .transform import KEY_COLUMNS
+
+# Status codes worth retrying (server busy or temporarily failing)
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+# Status codes REDCap/web servers use for oversized requests
+_TOO_LARGE_STATUS = {413}
+
+
+class ImportReport(BaseModel):
+    records: int = 0  # records with rows accepted by the server
+    rows: int = 0
+    batches: int = 0
+    skipped_rows: int = 0  # rows with an event/instrument unknown to the project
+    resumed_records: int = 0  # record/event units (record|event) already imported by an earlier run
+    retries: int = 0
+    splits: int = 0  # batches split after a payload-too-large answer
+    bytes_sent: int = 0
+    seconds: float = 0.0
+    errors: List[str] = []
+
+
+class RedcapApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP(S) connections to one host, shared by the worker threads."""
+
+    def __init__(self, url: str, size: int, timeout: float):
+        parts = urlsplit(url)
+        self.path = parts.path or "/"
+        self._factory = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._host = parts.netloc
+        self._timeout = timeout
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=size)
+
+    def post(self, body: bytes) -> Tuple[int, bytes]:
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self._factory(self._host, timeout=self._timeout)
+        try:
+            connection.request("POST", self.path, body=body, headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "application/json",
+            })
+            response = connection.getresponse()
+            payload = response.read()
+        except Exception:
+            connection.close()
+            raise
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+        return response.status, payload
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+def _encode_rows(rows: pd.DataFrame) -> List[str]:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows.to_numpy().tolist())
+    return buffer.getvalue().splitlines(keepends=True)
+
+
+def order_rows(rows: pd.DataFrame, project: Optional[RedcapProject]) -> Tuple[pd.DataFrame, int]:
+    """
+    Sort export rows into a safe import order and drop rows REDCap would reject.
+    Non-repeating rows come before repeating instances; events follow the project's
+    arm/event order. With a project that defines events, rows of unknown events and
+    repeating rows of instruments not set up as repeating in that event are dropped
+    (with a warning). Returns the ordered rows and the number of dropped rows.
+    """
+    rows = rows.reset_index(drop=True)
+    dropped = pd.Series(False, index=rows.index)
+    event_order: Dict[str, int] = {}
+    if project is not None and project.events:
+        event_order = {e.unique_event_name: i for i, e in enumerate(project.events) if e.unique_event_name}
+        events = rows["redcap_event_name"].fillna("")
+        unknown = (events != "") & ~events.isin(list(event_order))
+        instruments = rows["redcap_repeat_instrument"].fillna("")
+        if project.repeating:
+            not_repeating = pd.Series(
+                [i != "" and not project.is_repeating(i, e) for i, e in zip(instruments, events)],
+                index=rows.index,
+            )
+        else:
+            not_repeating = pd.Series(False, index=rows.index)
+        dropped = unknown | not_repeating
+        for label, mask in (("unknown event", unknown), ("instrument not repeating in event", not_repeating & ~unknown)):
+            if mask.any():
+                print(f"Warning: Skipping {int(mask.sum())} rows with {label} (e.g. {rows.loc[mask, KEY_COLUMNS].iloc[0].tolist()})")
+    rows = rows[~dropped]
+    keys = pd.DataFrame({
+        "repeating": (rows["redcap_repeat_instrument"].fillna("") != "").astype(int),
+        "event": rows["redcap_event_name"].map(event_order).fillna(len(event_order)),
+        "record": rows["record_id"],
+        "instrument": rows["redcap_repeat_instrument"].fillna(""),
+        "instance": pd.to_numeric(rows["redcap_repeat_instance"], errors="coerce").fillna(0),
+    }, index=rows.index)
+    order = keys.sort_values(["repeating", "event", "record", "instrument", "instance"], kind="stable").index
+    return rows.loc[order].reset_index(drop=True), int(dropped.sum())
+
+
+class RedcapImporter:
+    """
+    Import wide REDCap rows (the export CSV, as text) through the REDCap API `record`
+    import, in batches sent concurrently over pooled keep-alive connections.
+
+    - Batches hold whole records of one phase (non-repeating rows first, then repeating
+      instances, see `order_rows`) and are cut at `batch_bytes` of CSV payload. A
+      payload-too-large answer halves the batch size and splits the batch; successful
+      batches grow it again up to `max_batch_bytes`.
+    - At most `concurrency` requests are in flight (asyncio; blocking HTTP runs in threads).
+    - 429/5xx answers and connection errors are retried up to `max_retries` times with
+      exponential backoff and jitter; other errors fail the batch and are reported.
+    - With `progress_path`, imported records are recorded per phase after every batch,
+      so an interrupted import resumes where it stopped (for the same data).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        project: Optional[RedcapProject] = None,
+        batch_bytes: int = 512 * 1024,
+        min_batch_bytes: int = 4 * 1024,
+        max_batch_bytes: int = 8 * 1024 * 1024,
+        concurrency: int = 4,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        timeout: float = 120.0,
+        progress_path: Optional[str] = None,
+        overwrite: bool = False,
+        date_format: str = "DMY",
+    ):
+        self.url = url
+        self.token = token
+        self.project = project
+        self.batch_bytes = batch_bytes
+        self.min_batch_bytes = min_batch_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.progress_path = Path(progress_path) if progress_path else None
+        self.overwrite = overwrite
+        self.date_format = date_format
+
+    # ------------------------------------------------------------------
+    # Progress
+    # ------------------------------------------------------------------
+
+    def _load_progress(self, fingerprint: str) -> Dict[str, List[str]]:
+        if not self.progress_path or not self.progress_path.exists():
+            return {}
+        progress = json.loads(self.progress_path.read_text(encoding="utf-8"))
+        if progress.get("fingerprint") != fingerprint:
+            print(f"Warning: Progress file '{self.progress_path}' belongs to other data, starting over")
+            return {}
+        return progress.get("done", {})
+
+    def _save_progress(self, fingerprint: str, done: Dict[str, set]) -> None:
+        if not self.progress_path:
+            return
+        self.progress_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.progress_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"fingerprint": fingerprint, "done": {k: sorted(v) for k, v in done.items()}}), encoding="utf-8")
+        tmp.replace(self.progress_path)
+
+    # ------------------------------------------------------------------
+    # Batching
+    # ------------------------------------------------------------------
+
+    def _record_chunks(self, rows: pd.DataFrame) -> List[Tuple[str, str, str, str]]:
+        """
+        (phase, record, key, encoded CSV lines) in import order: one chunk per record and
+        event for the non-repeating rows (key `record|event`), one per repeating instance
+        (key `record|event|instrument|instance`, so large records can be split).
+        """
+        lines = _encode_rows(rows)
+        repeating = (rows["redcap_repeat_instrument"] != "").to_numpy()
+        records = rows["record_id"].to_numpy()
+        events = rows["redcap_event_name"].to_numpy()
+        instances = (rows["redcap_event_name"] + "|" + rows["redcap_repeat_instrument"] + "|" + rows["redcap_repeat_instance"]).to_numpy()
+        chunks: List[Tuple[str, str, str, str]] = []
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if (
+                i == len(rows) or repeating[i] or repeating[start]
+                or records[i] != records[start] or events[i] != events[start]
+            ):
+                if repeating[start]:
+                    chunks.append(("repeating", records[start], f"{records[start]}|{instances[start]}", lines[start]))
+                else:
+                    chunks.append(("base", records[start], f"{records[start]}|{events[start]}", "".join(lines[start:i])))
+                start = i
+        return chunks
+
+    def _body(self, header: str, chunks: List[Tuple[str, str, str, str]]) -> bytes:
+        params = {
+            "token": self.token,
+            "content": "record",
+            "action": "import",
+            "format": "csv",
+            "type": "flat",
+            "overwriteBehavior": "overwrite" if self.overwrite else "normal",
+            "forceAutoNumber": "false",
+            "dateFormat": self.date_format,
+            "returnContent": "count",
+            "returnFormat": "json",
+            "data": header + "".join(c[3] for c in chunks),
+        }
+        return urlencode(params).encode("utf-8")
+
+    # ------------------------------------------------------------------
+    # Import
+    # ------------------------------------------------------------------
+
+    def run(self, rows: pd.DataFrame) -> ImportReport:
+        """Blocking wrapper around `import_rows`."""
+        return asyncio.run(self.import_rows(rows))
+
+    async def import_rows(self, rows: pd.DataFrame) -> ImportReport:
+        """Import export rows (all columns as text, e.g. read back from write_redcap_csv output)."""
+        started = time.monotonic()
+        report = ImportReport()
+        rows = rows.astype(object).where(rows.notna(), "").astype(str)
+        rows, report.skipped_rows = order_rows(rows, self.project)
+        header = "".join(_encode_rows(pd.DataFrame([list(rows.columns)])))
+        fingerprint = hashlib.sha256(header.encode("utf-8") + "".join(_encode_rows(rows)).encode("utf-8")).hexdigest()
+
+        done = {phase: set(records) for phase, records in self._load_progress(fingerprint).items()}
+        chunks, resumed, imported = [], set(), set()
+        for chunk in self._record_chunks(rows):
+            if chunk[2] in done.get(chunk[0], set()):
+                resumed.add(chunk[2] if chunk[0] == "base" else chunk[2].rsplit("|", 2)[0])  # record|event
+            else:
+                chunks.append(chunk)
+        report.resumed_records = len(resumed)
+
+        pool = _ConnectionPool(self.url, self.concurrency, self.timeout)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        progress_lock = asyncio.Lock()
+
+        async def send(batch: List[Tuple[str, str, str, str]]) -> None:
+            body = self._body(header, batch)
+            attempt = 0
+            while True:
+                try:
+                    async with semaphore:
+                        status, payload = await asyncio.to_thread(pool.post, body)
+                except (OSError, http.client.HTTPException) as e:
+                    status, payload = 0, str(e).encode("utf-8")
+                report.bytes_sent += len(body)
+                if 200 <= status < 300:
+                    break
+                too_large = status in _TOO_LARGE_STATUS or b"too large" in payload.lower()
+                if too_large and len(batch) > 1:
+                    self.batch_bytes = max(self.min_batch_bytes, self.batch_bytes // 2)
+                    report.splits += 1
+                    middle = len(batch) // 2
+                    await asyncio.gather(send(batch[:middle]), send(batch[middle:]))
+                    return
+                if (status in _RETRY_STATUS or status == 0) and attempt < self.max_retries:
+                    attempt += 1
+                    report.retries += 1
+                    await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+                    continue
+                message = payload.decode("utf-8", errors="replace")[:500]
+                report.errors.append(f"Batch of records {batch[0][1]}..{batch[-1][1]} ({batch[0][0]}): HTTP {status} {message}")
+                return
+            async with progress_lock:
+                report.batches += 1
+                report.rows += sum(c[3].count("\n") for c in batch)
+                for phase, record, key, _ in batch:
+                    imported.add(record)
+                    done.setdefault(phase, set()).add(key)
+                report.records = len(imported)
+                self._save_progress(fingerprint, done)
+                self.batch_bytes = min(self.max_batch_bytes, int(self.batch_bytes * 1.25))
+
+        def batches(phase_chunks: List[Tuple[str, str, str, str]]):
+            batch, size = [], len(header)
+            for chunk in phase_chunks:
+                if batch and size + len(chunk[3]) > self.batch_bytes:
+                    yield batch
+                    batch, size = [], len(header)
+                batch.append(chunk)
+                size += len(chunk[3])
+            if batch:
+                yield batch
+
+        try:
+            # repeating instances only after all base rows, so records and events exist first
+            for phase in ("base", "repeating"):
+                pending = set()
+                for batch in batches([c for c in chunks if c[0] == phase]):
+                    while len(pending) >= self.concurrency * 2:
+                        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    pending.add(asyncio.ensure_future(send(batch)))
+                if pending:
+                    await asyncio.gather(*pending)
+        finally:
+            pool.close()
+        report.seconds = time.monotonic() - started
+        return report
+
+
+def read_export(paths: List[str]) -> pd.DataFrame:
+    """Read export CSV files (see export.write_redcap_csv) with every cell as text."""
+    frames = [pd.read_csv(path, dtype=str, keep_default_na=False) for path in paths]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=KEY_COLUMNS)
@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from .transform import KEY_COLUMNS
+
+
+class MockRedcapServer:
+    """
+    Local stand-in for the REDCap API `record` import/export, for offline tests of
+    throughput and failure handling (see redcap_api.RedcapImporter).
+
+    Imported rows are kept in memory by REDCap key; empty cells do not overwrite values
+    (overwriteBehavior=normal). Requests larger than `max_payload_bytes` get 413,
+    a share of `failure_rate` requests gets 503, and every request waits `latency` seconds.
+
+        with MockRedcapServer(token="secret") as server:
+            RedcapImporter(server.url, "secret").run(rows)
+    """
+
+    def __init__(
+        self,
+        token: str = "mock-token",
+        max_payload_bytes: Optional[int] = None,
+        failure_rate: float = 0.0,
+        latency: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.token = token
+        self.max_payload_bytes = max_payload_bytes
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.records: Dict[Tuple[str, ...], Dict[str, str]] = {}
+        self.stats: Dict[str, int] = {"requests": 0, "imports": 0, "rejected": 0, "failed": 0, "bytes": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def start(self) -> "MockRedcapServer":
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like a real web server
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, payload) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                status, payload = mock.handle(body)
+                self._reply(status, payload)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "MockRedcapServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def handle(self, body: bytes) -> Tuple[int, object]:
+        """Answer one API request body (form-encoded); returns (HTTP status, JSON payload)."""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(body)
+            fail = self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if self.max_payload_bytes and len(body) > self.max_payload_bytes:
+            with self._lock:
+                self.stats["rejected"] += 1
+            return 413, {"error": "Request entity too large"}
+        params = {k: v[0] for k, v in parse_qs(body.decode("utf-8"), keep_blank_values=True).items()}
+        if params.get("token") != self.token:
+            return 403, {"error": "You do not have permissions to use the API"}
+        if params.get("content") != "record":
+            return 400, {"error": f"Content '{params.get('content')}' is not supported by the mock server"}
+        if fail:
+            with self._lock:
+                self.stats["failed"] += 1
+            return 503, {"error": "Service temporarily unavailable"}
+        if params.get("action", "export") == "export":
+            with self._lock:
+                return 200, [dict(row) for row in self.records.values()]
+        if params.get("format", "json") != "csv":
+            return 400, {"error": "The mock server only imports CSV"}
+        rows = list(csv.DictReader(io.StringIO(params.get("data", ""))))
+        missing = [c for c in KEY_COLUMNS[:1] if rows and c not in rows[0]]
+        if missing:
+            return 400, {"error": f"Missing column(s): {', '.join(missing)}"}
+        overwrite = params.get("overwriteBehavior") == "overwrite"
+        with self._lock:
+            for row in rows:
+                key = tuple(row.get(c, "") for c in KEY_COLUMNS)
+                stored = self.records.setdefault(key, {c: row.get(c, "") for c in KEY_COLUMNS})
+                stored.update({k: v for k, v in row.items() if v != "" or overwrite})
+            self.stats["imports"] += 1
+        return 200, {"count": len({row.get("record_id") for row in rows})}
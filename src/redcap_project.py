@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from typing import List, Optional, Dict
-from pydantic import BaseModel
+from typing import List, Optional, Dict, Set, Tuple
+from pydantic import BaseModel, PrivateAttr, model_validator
 import xml.etree.ElementTree as ET
 
 
@@ -23,10 +23,73 @@ class RedcapRepeating(BaseModel):
     event_unique_names: List[str] = []
 
 
+class RedcapFormEvent(BaseModel):
+    form: Optional[str]
+    unique_event_name: Optional[str]
+
+
 class RedcapProject(BaseModel):
     arms: List[RedcapArm] = []
     events: List[RedcapEvent] = []
     repeating: List[RedcapRepeating] = []
+    form_events: List[RedcapFormEvent] = []  # instrument designations; empty if the XML has none
+
+    _events_by_name: Dict[str, RedcapEvent] = PrivateAttr(default_factory=dict)
+    _events_by_arm: Dict[Optional[int], List[RedcapEvent]] = PrivateAttr(default_factory=dict)
+    _repeating_pairs: Set[Tuple[str, str]] = PrivateAttr(default_factory=set)
+    _form_event_pairs: Set[Tuple[str, str]] = PrivateAttr(default_factory=set)
+
+    @model_validator(mode="after")
+    def _build_indexes(self) -> "RedcapProject":
+        """Lookup indexes for events and repeating instruments (built once at load time)"""
+        self._events_by_name = {e.unique_event_name: e for e in self.events if e.unique_event_name}
+        self._events_by_arm = {}
+        for event in self.events:
+            self._events_by_arm.setdefault(event.arm_id, []).append(event)
+        # "" as event: the instrument repeats in every event (or the project has none)
+        self._repeating_pairs = {
+            (r.instrument, e) for r in self.repeating if r.instrument for e in (r.event_unique_names or [""])
+        }
+        self._form_event_pairs = {
+            (m.form, m.unique_event_name) for m in self.form_events if m.form and m.unique_event_name
+        }
+        return self
+
+    def event(self, unique_event_name: str) -> Optional[RedcapEvent]:
+        """Event by its unique name, or None"""
+        return self._events_by_name.get(unique_event_name)
+
+    def events_in_arm(self, arm_id: Optional[int]) -> List[RedcapEvent]:
+        """Events of one arm, in project order"""
+        return list(self._events_by_arm.get(arm_id, []))
+
+    def repeating_pairs(self) -> Set[Tuple[str, str]]:
+        """(instrument, unique event name) pairs set up as repeating; event "" means any event"""
+        return set(self._repeating_pairs)
+
+    def is_repeating(self, instrument: str, unique_event_name: str = "") -> bool:
+        """Whether the instrument repeats in the given event"""
+        return (instrument, unique_event_name) in self._repeating_pairs or (instrument, "") in self._repeating_pairs
+
+    def has_form_events(self) -> bool:
+        """Whether the project XML designates instruments to events"""
+        return bool(self._form_event_pairs)
+
+    def is_designated(self, form: str, unique_event_name: str) -> bool:
+        """Whether the form is designated to the event (always True without designations)"""
+        return not self._form_event_pairs or (form, unique_event_name) in self._form_event_pairs
+
+
+_ARM_CONTAINERS = {'arms'}
+_EVENT_CONTAINERS = {'events'}
+_REPEATING_CONTAINERS = {'repeatingformsevents', 'repeatinginstruments'}
+_FORM_EVENT_CONTAINERS = {'formeventmapping', 'formeventmappings', 'instrumenteventmappings'}
+_EVENT_NAME_TAGS = {'eventuniquename', 'unique_event_name'}
+
+
+def _local(tag: str) -> str:
+    """Tag name without namespace, lowercased"""
+    return tag.rsplit('}', 1)[-1].lower()
 
 
 def _text(elem: ET.Element | None) -> Optional[str]:
@@ -37,100 +100,158 @@ def _text(elem: ET.Element | None) -> Optional[str]:
 
 
 def _first_child_text(elem: ET.Element, names: List[str]) -> Optional[str]:
-    names_lower = {n.lower() for n in names}
-    for child in list(elem):
-        if child.tag.lower() in names_lower:
+    """Text of the first child with one of the (lowercase) names, else the attribute of that name"""
+    for child in elem:
+        if _local(child.tag) in names:
             return _text(child)
+    for key, value in elem.attrib.items():
+        if _local(key) in names and value.strip():
+            return value.strip()
     return None
 
 
-def parse_project_xml(xml_path: str) -> RedcapProject:
+def _int(text: Optional[str]) -> Optional[int]:
+    try:
+        return int(text) if text else None
+    except ValueError:
+        return None
+
+
+def _parse_arm(elem: ET.Element) -> RedcapArm:
+    return RedcapArm(
+        arm_id=_int(_first_child_text(elem, ['id', 'arm_id'])),
+        arm_name=_first_child_text(elem, ['name', 'arm_name']),
+    )
+
+
+def _parse_event(elem: ET.Element) -> RedcapEvent:
+    return RedcapEvent(
+        event_id=_int(_first_child_text(elem, ['id', 'event_id'])),
+        event_name=_first_child_text(elem, ['name', 'event_name']),
+        unique_event_name=_first_child_text(elem, ['unique_name', 'unique_event_name']),
+        arm_id=_int(_first_child_text(elem, ['arm_id'])),
+        arm_name=_first_child_text(elem, ['arm_name']),
+    )
+
+
+def _parse_repeating(item: ET.Element) -> RedcapRepeating:
+    instr = _first_child_text(item, ['instrument', 'form', 'form_name'])
+    # Event unique names as children (<eventUniqueName>) or in child lists (<events><eventUniqueName>)
+    event_unique_names: List[str] = []
+    for child in item:
+        if _local(child.tag) in _EVENT_NAME_TAGS:
+            txt = _text(child)
+            if txt:
+                event_unique_names.append(txt)
+            continue
+        for grandchild in child:
+            if _local(grandchild.tag) in _EVENT_NAME_TAGS and _text(grandchild):
+                event_unique_names.append(_text(grandchild))
+    # If no nested children, try attributes directly
+    if not event_unique_names:
+        txt = _first_child_text(item, list(_EVENT_NAME_TAGS))
+        if txt:
+            event_unique_names.append(txt)
+    return RedcapRepeating(instrument=instr, event_unique_names=event_unique_names)
+
+
+def _parse_form_event(item: ET.Element) -> RedcapFormEvent:
+    return RedcapFormEvent(
+        form=_first_child_text(item, ['form', 'instrument', 'form_name']),
+        unique_event_name=_first_child_text(item, list(_EVENT_NAME_TAGS)),
+    )
+
+
+def _attribute(elem: ET.Element, names: List[str]) -> Optional[str]:
+    """Attribute with one of the (lowercase) local names, namespace ignored"""
+    for key, value in elem.attrib.items():
+        if _local(key) in names and value.strip():
+            return value.strip()
+    return None
+
+
+def _form_ref(elem: ET.Element, unique_event_name: Optional[str]) -> RedcapFormEvent:
+    """ODM <FormRef FormOID="Form.x" redcap:FormName="x"/> inside a <StudyEventDef>"""
+    form = _attribute(elem, ['formname'])
+    if form is None:
+        oid = _attribute(elem, ['formoid'])
+        form = oid[len('Form.'):] if oid and oid.startswith('Form.') else oid
+    return RedcapFormEvent(form=form, unique_event_name=unique_event_name)
+
+
+def parse_project_xml(xml_path: str, skip_clinical_data: bool = True) -> RedcapProject:
     """
     Parse a REDCap Project XML (exported from Project Setup) to extract:
     - Arms (id, name)
     - Events (id, name, unique_event_name, arm association)
     - Repeating instruments configuration (instrument name and event unique names)
+    - Instrument designations per event: ODM <FormRef> elements of each <StudyEventDef>
+      (redcap:UniqueEventName), or form/event items of a form event mapping list
 
     The XML schema can vary across REDCap versions; this parser is defensive and
-    tries multiple common tag names. If a section is not found, it's returned empty.
-    """
-    try:
-        tree = ET.parse(xml_path)
-    except Exception:
-        # File missing or unreadable: return empty project structure
-        return RedcapProject()
-
-    root = tree.getroot()
+    tries multiple common tag names (case-insensitive, namespaces ignored). If a section
+    is not found, it's returned empty.
 
+    The file is read in a single streaming pass (iterparse): elements are dropped as
+    soon as they are handled, so full project exports with data stay cheap. With
+    `skip_clinical_data`, reading stops at <ClinicalData> (ODM puts it after the
+    Study metadata), so the record data of a full export is never parsed.
+    """
     arms: List[RedcapArm] = []
     events: List[RedcapEvent] = []
     repeating: List[RedcapRepeating] = []
+    form_events: List[RedcapFormEvent] = []
+    study_event: Optional[str] = None  # unique name of the open <StudyEventDef>
+
+    tags: List[str] = []  # local names of the open elements
+    elems: List[ET.Element] = []
+    in_item = 0  # open arms/events/repeating items whose children are still needed
+
+    try:
+        for action, elem in ET.iterparse(xml_path, events=('start', 'end')):
+            if action == 'start':
+                tag = _local(elem.tag)
+                if tag == 'clinicaldata' and skip_clinical_data:
+                    break
+                if tag == 'studyeventdef':
+                    oid = _attribute(elem, ['oid'])
+                    study_event = _attribute(elem, ['uniqueeventname']) or (
+                        oid[len('Event.'):] if oid and oid.startswith('Event.') else None
+                    )
+                if (
+                    (tag == 'arm' and _ARM_CONTAINERS.intersection(tags))
+                    or (tag == 'event' and _EVENT_CONTAINERS.intersection(tags))
+                    or (tags and tags[-1] in _REPEATING_CONTAINERS | _FORM_EVENT_CONTAINERS)
+                ):
+                    in_item += 1
+                tags.append(tag)
+                elems.append(elem)
+                continue
+
+            tag = tags.pop()
+            elems.pop()
+            if tag == 'arm' and _ARM_CONTAINERS.intersection(tags):
+                arms.append(_parse_arm(elem))
+                in_item -= 1
+            elif tag == 'event' and _EVENT_CONTAINERS.intersection(tags):
+                events.append(_parse_event(elem))
+                in_item -= 1
+            elif tags and tags[-1] in _REPEATING_CONTAINERS:
+                repeating.append(_parse_repeating(elem))
+                in_item -= 1
+            elif tags and tags[-1] in _FORM_EVENT_CONTAINERS:
+                form_events.append(_parse_form_event(elem))
+                in_item -= 1
+            elif tag == 'formref' and tags and tags[-1] == 'studyeventdef' and study_event:
+                form_events.append(_form_ref(elem, study_event))
+            # Handled or irrelevant: drop the subtree (keeps memory flat for large files)
+            if elems and not in_item:
+                del elems[-1][:]
+    except (OSError, ET.ParseError):
+        # File missing or unreadable: return empty project structure
+        return RedcapProject()
 
-    # Arms: try typical containers like <arms> with children <arm>
-    for arms_container in root.findall('.//arms') + root.findall('.//Arms'):
-        for arm_elem in arms_container.findall('.//arm') + arms_container.findall('.//Arm'):
-            arm_name = _first_child_text(arm_elem, ['name', 'arm_name'])
-            arm_id_text = _first_child_text(arm_elem, ['id', 'arm_id'])
-            try:
-                arm_id = int(arm_id_text) if arm_id_text else None
-            except ValueError:
-                arm_id = None
-            arms.append(RedcapArm(arm_id=arm_id, arm_name=arm_name))
-
-    # Events: try typical containers like <events> with children <event>
-    for events_container in root.findall('.//events') + root.findall('.//Events'):
-        for ev_elem in events_container.findall('.//event') + events_container.findall('.//Event'):
-            event_name = _first_child_text(ev_elem, ['name', 'event_name'])
-            unique_event_name = _first_child_text(ev_elem, ['unique_name', 'unique_event_name'])
-            arm_name = _first_child_text(ev_elem, ['arm_name'])
-            arm_id_text = _first_child_text(ev_elem, ['arm_id'])
-            event_id_text = _first_child_text(ev_elem, ['id', 'event_id'])
-            try:
-                arm_id = int(arm_id_text) if arm_id_text else None
-            except ValueError:
-                arm_id = None
-            try:
-                event_id = int(event_id_text) if event_id_text else None
-            except ValueError:
-                event_id = None
-            events.append(
-                RedcapEvent(
-                    event_id=event_id,
-                    event_name=event_name,
-                    unique_event_name=unique_event_name,
-                    arm_id=arm_id,
-                    arm_name=arm_name,
-                )
-            )
-
-    # Repeating instruments/events: look for common containers
-    # Some REDCap exports use <repeatingFormsEvents> with items containing form name and event names
-    for rep_container in (
-        root.findall('.//repeatingFormsEvents')
-        + root.findall('.//RepeatingFormsEvents')
-        + root.findall('.//repeatingInstruments')
-        + root.findall('.//RepeatingInstruments')
-    ):
-        for item in list(rep_container):
-            # Try to read instrument/form name
-            instr = _first_child_text(item, ['instrument', 'form', 'form_name'])
-            # Collect event unique names from child list elements
-            event_unique_names: List[str] = []
-            for child in list(item):
-                # tags like <eventUniqueName> or <unique_event_name>
-                txt = _first_child_text(child, ['eventUniqueName', 'unique_event_name'])
-                if not txt and child.tag.lower() in {'eventuniquename', 'unique_event_name'}:
-                    txt = _text(child)
-                if txt:
-                    event_unique_names.append(txt)
-            # If no nested children, try attributes/text directly
-            if not event_unique_names:
-                txt = _first_child_text(item, ['eventUniqueName', 'unique_event_name'])
-                if txt:
-                    event_unique_names.append(txt)
-            repeating.append(RedcapRepeating(instrument=instr, event_unique_names=event_unique_names))
-
-    return RedcapProject(arms=arms, events=events, repeating=repeating)
+    return RedcapProject(arms=arms, events=events, repeating=repeating, form_events=form_events)
 
 
 def summarize_project(project: RedcapProject) -> Dict[str, List[str]]:
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+from .datadict import DataDictionary
+from .redcap_project import RedcapProject
+from .template import Template, is_mapped
+
+
+class Route(BaseModel):
+    """Where a field's values go in the REDCap import: event and repeating instrument ("" if none)"""
+    field_name: str
+    form_name: Optional[str] = None
+    event_name: str = ""
+    repeat_instrument: str = ""
+
+
+class FormRoute(BaseModel):
+    """A form's allowed events (its designated project events, or the events the template uses) and where it repeats"""
+    form_name: str
+    events: List[str] = []
+    repeating_events: List[str] = []
+
+
+class RoutingTable:
+    """
+    Field -> (redcap_event_name, redcap_repeat_instrument) routes, compiled once per
+    template (see `compile_routing`). Key columns are stamped as whole categorical
+    columns sharing one dtype per key, so results of different fields concatenate
+    without converting back to strings.
+    """
+
+    def __init__(self, routes: Dict[str, Route], forms: Optional[Dict[str, FormRoute]] = None):
+        self.routes = routes
+        self.forms = forms or {}
+        self.event_dtype = pd.CategoricalDtype(sorted({r.event_name for r in routes.values()} | {""}))
+        self.instrument_dtype = pd.CategoricalDtype(sorted({r.repeat_instrument for r in routes.values()} | {""}))
+        self._codes = {
+            name: (
+                self.event_dtype.categories.get_loc(route.event_name),
+                self.instrument_dtype.categories.get_loc(route.repeat_instrument),
+            )
+            for name, route in routes.items()
+        }
+
+    def route(self, field_name: str) -> Route:
+        return self.routes[field_name]
+
+    def is_repeating(self, field_name: str) -> bool:
+        return bool(self.routes[field_name].repeat_instrument)
+
+    def key_columns(self, field_name: str, n: int) -> Dict[str, pd.Categorical]:
+        """redcap_event_name / redcap_repeat_instrument for `n` result rows of one field"""
+        event_code, instrument_code = self._codes[field_name]
+        return {
+            "redcap_event_name": pd.Categorical.from_codes(np.full(n, event_code, dtype=np.int32), dtype=self.event_dtype),
+            "redcap_repeat_instrument": pd.Categorical.from_codes(np.full(n, instrument_code, dtype=np.int32), dtype=self.instrument_dtype),
+        }
+
+
+def _arm_matches(event, arm: str) -> bool:
+    return arm in (event.arm_name, str(event.arm_id)) or (event.unique_event_name or "").endswith(f"_arm_{arm}")
+
+
+def compile_routing(
+    template: Template,
+    project: Optional[RedcapProject] = None,
+    datadict: Optional[DataDictionary] = None,
+) -> RoutingTable:
+    """
+    Compile the routing table for the mapped fields of a template (see
+    template.is_mapped; unmapped fields produce no values and are not routed). Form
+    names come from the template field or, if missing there, from the data dictionary.
+
+    Checked for every field (all problems are reported at once with a ValueError):
+    - repeat_instrument is the field's own form;
+    - all fields of a form in one event agree on whether it repeats there;
+    with a project:
+    - longitudinal projects: event_name is set, known, and in the template's arm (if fixed);
+    - the form is designated to that event, if the project XML has instrument designations
+      (without them every form counts as designated to every event);
+    - the form is set up as repeating in that event exactly when repeat_instrument is set.
+    """
+    dd_forms = {f.field_name: f.form_name for f in datadict.fields} if datadict is not None else {}
+    has_events = project is not None and bool(project.events)
+    check_repeating = project is not None and (bool(project.events) or bool(project.repeating))
+    routes: Dict[str, Route] = {}
+    forms: Dict[str, FormRoute] = {}
+    repeats_in: Dict[tuple, Dict[bool, str]] = {}
+    errors: List[str] = []
+
+    for field in template.fields:
+        if not is_mapped(field):
+            continue
+        route = Route(
+            field_name=field.field_name,
+            form_name=field.form_name or dd_forms.get(field.field_name),
+            event_name=field.event_name or "",
+            repeat_instrument=field.repeat_instrument or "",
+        )
+        routes[field.field_name] = route
+        where = f"Field '{field.field_name}'"
+        if route.repeat_instrument and route.form_name and route.repeat_instrument != route.form_name:
+            errors.append(f"{where}: repeat_instrument '{route.repeat_instrument}' is not its form '{route.form_name}'")
+        if route.form_name:
+            repeats_in.setdefault((route.form_name, route.event_name), {}).setdefault(bool(route.repeat_instrument), field.field_name)
+        if has_events:
+            event = project.event(route.event_name) if route.event_name else None
+            if not route.event_name:
+                errors.append(f"{where}: event_name is required in a longitudinal project")
+            elif event is None:
+                errors.append(f"{where}: unknown event '{route.event_name}'")
+            elif template.arm and not _arm_matches(event, template.arm):
+                errors.append(f"{where}: event '{route.event_name}' is not in arm '{template.arm}'")
+            elif route.form_name and not project.is_designated(route.form_name, route.event_name):
+                errors.append(f"{where}: form '{route.form_name}' is not designated to event '{route.event_name}'")
+        instrument = route.repeat_instrument or route.form_name
+        if check_repeating and instrument:
+            repeating = project.is_repeating(instrument, route.event_name)
+            if route.repeat_instrument and not repeating:
+                errors.append(f"{where}: form '{instrument}' does not repeat in event '{route.event_name or '(none)'}'")
+            elif not route.repeat_instrument and repeating:
+                errors.append(f"{where}: form '{instrument}' repeats in event '{route.event_name or '(none)'}', set repeat_instrument")
+
+    for (form_name, event_name), kinds in repeats_in.items():
+        if len(kinds) > 1:
+            errors.append(
+                f"Form '{form_name}' in event '{event_name or '(none)'}' is repeating for field '{kinds[True]}' "
+                f"but not for field '{kinds[False]}'"
+            )
+        form = forms.setdefault(form_name, FormRoute(form_name=form_name))
+        if event_name not in form.events:
+            form.events.append(event_name)
+        if True in kinds and event_name not in form.repeating_events:
+            form.repeating_events.append(event_name)
+    if has_events:
+        project_events = [e.unique_event_name for e in project.events if e.unique_event_name]
+        for form in forms.values():
+            form.events = [e for e in project_events if project.is_designated(form.form_name, e)]
+            form.repeating_events = [e for e in project_events if project.is_repeating(form.form_name, e)]
+
+    if errors:
+        raise ValueError("Invalid REDCap routing:\n" + "\n".join(f"- {e}" for e in errors))
+    return RoutingTable(routes, forms)
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .utils import datetime_parser, sniff_delimiter, to_numeric
+
+VALUE_COLUMNS = ["value", "rate"]
+TIMESTAMP_COLUMNS = ["timestamp"]
+
+
+class MemoryReport(BaseModel):
+    rows: int = 0
+    before_bytes: int = 0  # text frame as read (deep memory usage)
+    after_bytes: int = 0
+    columns: Dict[str, Tuple[int, int]] = {}  # column -> (before, after)
+
+    def summary_lines(self) -> List[str]:
+        ratio = self.before_bytes / self.after_bytes if self.after_bytes else 0.0
+        lines = [
+            f"{self.rows:,} rows: {self.before_bytes / 2**20:.1f} MiB -> {self.after_bytes / 2**20:.1f} MiB ({ratio:.1f}x smaller)"
+        ]
+        for column, (before, after) in self.columns.items():
+            lines.append(f"  {column:<20} {before / 2**20:9.1f} MiB -> {after / 2**20:9.1f} MiB")
+        return lines
+
+
+def _numbers(values: pd.Series) -> Tuple[np.ndarray, pd.Categorical]:
+    """float64 values (decimal commas converted) and the original text as a categorical"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    parsed = to_numeric(pd.Series(uniques, dtype=object)).to_numpy(dtype=float)  # each distinct value once
+    num = np.append(parsed, np.nan)[codes]  # code -1 (missing) hits the trailing NaN
+    return num, pd.Categorical.from_codes(codes, categories=pd.Index(uniques, dtype=object))
+
+
+def _memory_report(frame: pd.DataFrame, text: Dict[str, pd.Categorical], before: Dict[str, int]) -> MemoryReport:
+    memory = MemoryReport(rows=len(frame))
+    for name in frame.columns:
+        after = int(frame[name].memory_usage(index=False, deep=True))
+        if name in text:
+            after += int(pd.Series(text[name]).memory_usage(index=False, deep=True))
+        memory.columns[name] = (before[name], after)
+    memory.before_bytes = sum(b for b, _ in memory.columns.values())
+    memory.after_bytes = sum(a for _, a in memory.columns.values())
+    return memory
+
+
+class SourceTable:
+    """
+    Compact in-memory layout of a long-format source table, built once at load time:
+    - timestamp columns as datetime64[ns] (int64 nanoseconds),
+    - value columns (`value`, `rate`) as float64 with decimal commas converted, plus
+      their original text as a categorical side column ("112,2", "2", "negativ"),
+    - all other columns (record ID, parameter, category, ...) as categoricals.
+    `frame` holds the normalized columns; TransformContext reads it directly for
+    numeric work and asks `raw` for the original text of value columns, so results
+    equal those of the text frame.
+    """
+
+    def __init__(self, frame: pd.DataFrame, text: Dict[str, pd.Categorical], memory: MemoryReport):
+        self.frame = frame
+        self.text = text
+        self.memory = memory
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    @property
+    def value_columns(self) -> List[str]:
+        return list(self.text)
+
+    @classmethod
+    def from_frame(
+        cls,
+        frame: pd.DataFrame,
+        value_columns: Sequence[str] = VALUE_COLUMNS,
+        timestamp_columns: Sequence[str] = TIMESTAMP_COLUMNS,
+    ) -> "SourceTable":
+        """Normalize a text frame (e.g. read_csv with dtype=str); absent columns are skipped"""
+        frame = frame.reset_index(drop=True)
+        columns: Dict[str, pd.Series] = {}
+        text: Dict[str, pd.Categorical] = {}
+        for name in frame.columns:
+            values = frame[name]
+            if name in timestamp_columns:
+                columns[name] = datetime_parser.parse(values, name).astype("datetime64[ns]")
+            elif name in value_columns:
+                num, text[name] = _numbers(values)
+                columns[name] = pd.Series(num)
+            else:
+                columns[name] = values.astype("category")
+        before = {name: int(frame[name].memory_usage(index=False, deep=True)) for name in frame.columns}
+        compact = pd.DataFrame(columns)
+        return cls(compact, text, _memory_report(compact, text, before))
+
+    @classmethod
+    def read_csv(
+        cls,
+        source_path: str,
+        sep: Optional[str] = None,
+        encoding: str = "utf-8",
+        chunksize: int = 1_000_000,
+        value_columns: Sequence[str] = VALUE_COLUMNS,
+        timestamp_columns: Sequence[str] = TIMESTAMP_COLUMNS,
+    ) -> "SourceTable":
+        """Read a source CSV in chunks, normalizing each chunk before the next is read"""
+        if sep is None:
+            with open(source_path, "r", encoding=encoding) as f:
+                sep = sniff_delimiter(f.readline())
+        chunks = [
+            cls.from_frame(chunk, value_columns, timestamp_columns)
+            for chunk in pd.read_csv(source_path, sep=sep, encoding=encoding, dtype=str, chunksize=chunksize)
+        ]
+        return cls.concat(chunks)
+
+    @classmethod
+    def concat(cls, tables: List["SourceTable"]) -> "SourceTable":
+        """Stack tables with the same columns (categories are unioned)"""
+        if not tables:
+            return cls(pd.DataFrame(), {}, MemoryReport())
+        if len(tables) == 1:
+            return tables[0]
+        first = tables[0].frame
+        columns: Dict[str, pd.Series] = {}
+        for name in first.columns:
+            parts = [t.frame[name] for t in tables]
+            if isinstance(first[name].dtype, pd.CategoricalDtype):
+                columns[name] = pd.Series(pd.api.types.union_categoricals(parts))
+            else:
+                columns[name] = pd.Series(np.concatenate([p.to_numpy() for p in parts]))
+        text = {name: pd.api.types.union_categoricals([t.text[name] for t in tables]) for name in tables[0].text}
+        frame = pd.DataFrame(columns)
+        before = {name: sum(t.memory.columns[name][0] for t in tables) for name in frame.columns}
+        return cls(frame, text, _memory_report(frame, text, before))
+
+    def raw(self, column: str, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """Values of a column at `positions` (default: all rows) as objects; value columns as their original text"""
+        values = self.text[column] if column in self.text else self.frame[column]
+        if positions is None:
+            return np.asarray(values, dtype=object)
+        return np.asarray(values.take(positions), dtype=object)
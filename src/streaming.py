@@ -0,0 +1,135 @@
+import math
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from .template import Template
+from .transform import KEY_COLUMNS, output_fields, transform
+from .utils import sniff_delimiter
+
+
+def csv_options(source_path: str, sep: Optional[str] = None, encoding: str = "utf-8") -> Dict[str, object]:
+    """read_csv options for long-format source files: every column read as text."""
+    if sep is None:
+        with open(source_path, "r", encoding=encoding) as f:
+            sep = sniff_delimiter(f.readline())
+    return {"sep": sep, "encoding": encoding, "dtype": str}
+
+
+def is_grouped_by_record(source_path: str, record_column: str, chunksize: int, **options) -> bool:
+    """True if all rows of each record are contiguous in the file (reads only the record column)."""
+    seen = set()
+    last = None
+    for chunk in pd.read_csv(source_path, usecols=[record_column], chunksize=chunksize, **options):
+        ids = chunk[record_column].dropna()
+        runs = ids[ids.ne(ids.shift())].tolist()
+        if runs and runs[0] == last:
+            runs = runs[1:]  # run continues from the previous chunk
+        for record in runs:
+            if record in seen:
+                return False
+            seen.add(record)
+        if len(ids):
+            last = ids.iloc[-1]
+    return True
+
+
+def iter_record_batches(source_path: str, record_column: str, chunksize: int, **options) -> Iterator[pd.DataFrame]:
+    """
+    Read a file grouped by record in chunks and yield batches of complete records.
+    The last record of each chunk may continue in the next one, so it is carried over.
+    """
+    carry: Optional[pd.DataFrame] = None
+    for chunk in pd.read_csv(source_path, chunksize=chunksize, **options):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        ids = chunk[record_column]
+        runs = ids.ne(ids.shift()).cumsum().to_numpy()
+        start = int(np.searchsorted(runs, runs[-1]))
+        carry = chunk.iloc[start:]
+        if start > 0:
+            yield chunk.iloc[:start]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def partition_by_record(
+    source_path: str, record_column: str, directory: Path, partitions: int, chunksize: int, **options
+) -> List[Path]:
+    """
+    Hash-partition an unsorted file into `partitions` CSV files in `directory`;
+    all rows of a record end up in the same partition.
+    """
+    files = [directory / f"part_{i:04d}.csv" for i in range(partitions)]
+    for chunk in pd.read_csv(source_path, chunksize=chunksize, **options):
+        keys = pd.util.hash_pandas_object(chunk[record_column], index=False).to_numpy() % partitions
+        for part, rows in chunk.groupby(keys, sort=False):
+            target = files[int(part)]
+            rows.to_csv(target, mode="a", header=not target.exists(), index=False)
+    return [f for f in files if f.exists()]
+
+
+def stream_transform(
+    source_path: str,
+    template: Template,
+    output_path: str,
+    chunksize: int = 200_000,
+    sep: Optional[str] = None,
+    encoding: str = "utf-8",
+    grouped: Optional[bool] = None,
+    partition_bytes: int = 64 * 1024 * 1024,
+    temp_dir: Optional[str] = None,
+    max_workers: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Bounded-memory transform of a long-format CSV that does not fit in memory.
+
+    The file is read in chunks of `chunksize` rows. If it is grouped by
+    `template.record_id_column` (checked with one pass over that column unless `grouped`
+    is given), batches of complete records go through query -> calc -> aggregate ->
+    pivot directly. Otherwise rows are first hash-partitioned by record into temporary
+    files of about `partition_bytes` each, which are then transformed one at a time.
+    Finished wide rows are appended to `output_path` immediately, so memory is bounded
+    by a chunk (or partition) plus the largest single record, not by the cohort.
+
+    Rows are written per batch (sorted by REDCap key within a batch); the values are the
+    same as `transform` on the whole file. Returns simple run statistics.
+    """
+    options = csv_options(source_path, sep, encoding)
+    record_column = template.record_id_column
+    if grouped is None:
+        grouped = is_grouped_by_record(source_path, record_column, chunksize, **options)
+    columns = KEY_COLUMNS + [f.field_name for f in output_fields(template)]
+    stats = {"batches": 0, "records": 0, "rows_in": 0, "rows_out": 0, "partitions": 0}
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8", newline="") as out:
+        pd.DataFrame(columns=columns).to_csv(out, index=False)
+
+        def emit(batch: pd.DataFrame) -> None:
+            wide = transform(batch, template, max_workers=max_workers)
+            wide.to_csv(out, header=False, index=False)
+            stats["batches"] += 1
+            stats["records"] += int(batch[record_column].nunique())
+            stats["rows_in"] += len(batch)
+            stats["rows_out"] += len(wide)
+
+        if grouped:
+            for batch in iter_record_batches(source_path, record_column, chunksize, **options):
+                emit(batch)
+            return stats
+
+        work_dir = Path(tempfile.mkdtemp(prefix="csv_redcap_", dir=temp_dir))
+        try:
+            partitions = max(1, math.ceil(os.path.getsize(source_path) / partition_bytes))
+            parts = partition_by_record(source_path, record_column, work_dir, partitions, chunksize, **options)
+            stats["partitions"] = len(parts)
+            for part in parts:
+                emit(pd.read_csv(part, encoding="utf-8", dtype=str))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return stats
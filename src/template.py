@@ -1,12 +1,16 @@
 import yaml
 import json
-from pydantic import BaseModel
+import re
+from pydantic import BaseModel, PrivateAttr, model_validator
 from typing import List, Optional, Dict, Any
 from enum import Enum
 from pathlib import Path
 
 from .datadict import DataDictionaryField, DataDictionary, ValidationType, FieldType
 
+# libyaml-based loader if PyYAML was built with it, else the pure-Python one
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 # Simplified mapping: store semantic selectors and key columns directly
 
 class AggregationMethod(str, Enum):
@@ -38,6 +42,18 @@ class SourceMapping(BaseModel):
     constant: Optional[str] = None         # fixed value OR reference to another variable like "{weight}" (takes precedence over query)
 
 
+# Field settings that templates may also write inside the `source` block
+_FIELD_LEVEL_SOURCE_KEYS = (
+    "calculation_expr",
+    "calc_vars",
+    "aggregation",
+    "time_interval",
+    "reference",
+    "reference_column",
+    "outlier_filter",
+)
+
+
 class TemplateField(DataDictionaryField):
     """
     Extends DataDictionaryField with mapping logic for data processing.
@@ -81,6 +97,93 @@ class TemplateField(DataDictionaryField):
     reference_column: Optional[str] = None # Column name for reference timepoint
     outlier_filter: Optional[float] = None  # Percentile for outlier removal
 
+    @model_validator(mode="before")
+    @classmethod
+    def _lift_source_settings(cls, data: Any) -> Any:
+        """
+        Accept calculation/aggregation settings nested under `source`
+        (as written in templates/example_template.yaml) and move them to the field.
+        Settings given on the field itself take precedence.
+        """
+        if not isinstance(data, dict) or not isinstance(data.get("source"), dict):
+            return data
+        data = dict(data)
+        source = dict(data["source"])
+        for key in _FIELD_LEVEL_SOURCE_KEYS:
+            if key in source:
+                value = source.pop(key)
+                if data.get(key) is None:
+                    data[key] = value
+        if data.get("calculation_expr") and "use_calculation" not in data:
+            data["use_calculation"] = True
+        data["source"] = source
+        return data
+
+# calc_vars constant referring to another template field, e.g. "{weight}"
+_FIELD_REFERENCE = re.compile(r"^\{(\w+)\}$")
+_EXPR_VARIABLE = re.compile(r"\{(\w+)\}")
+
+
+def is_mapped(field: TemplateField) -> bool:
+    """Whether the field produces values: a calculation or a source query"""
+    return bool(field.calculation_expr) or (field.source is not None and bool(field.source.query_string))
+
+
+def field_references(field: TemplateField, field_names: set) -> List[str]:
+    """
+    Names of template fields this field needs before it can be evaluated:
+    `{field}` constants in calc_vars, expression variables not defined in calc_vars
+    and a from_timepoint `reference_column` that names a template field.
+    """
+    refs = []
+    calc_vars = field.calc_vars or {}
+    for mapping in calc_vars.values():
+        match = _FIELD_REFERENCE.match((mapping.constant or "").strip())
+        if match:
+            refs.append(match.group(1))
+    if field.calculation_expr:
+        refs.extend(name for name in _EXPR_VARIABLE.findall(field.calculation_expr) if name not in calc_vars)
+    if field.reference == ReferenceMode.FROM_TIMEPOINT and field.reference_column in field_names:
+        refs.append(field.reference_column)
+    return list(dict.fromkeys(refs))
+
+
+def dependency_levels(fields: List[TemplateField]) -> List[List[str]]:
+    """
+    Topological levels of the field reference graph: every field only depends on
+    fields in earlier levels. Raises ValueError for dangling references and cycles.
+    """
+    names = {f.field_name for f in fields}
+    graph = {f.field_name: field_references(f, names) for f in fields}
+    for name, refs in graph.items():
+        for ref in refs:
+            if ref not in names:
+                raise ValueError(f"Field '{name}' references unknown field '{ref}'")
+
+    levels: List[List[str]] = []
+    done: set = set()
+    pending = [f.field_name for f in fields]
+    while pending:
+        level = [n for n in pending if all(ref in done for ref in graph[n])]
+        if not level:
+            raise ValueError(f"Circular field references: {' -> '.join(_find_cycle(graph, pending))}")
+        levels.append(level)
+        done.update(level)
+        pending = [n for n in pending if n not in done]
+    return levels
+
+
+def _find_cycle(graph: Dict[str, List[str]], pending: List[str]) -> List[str]:
+    # Every pending node lies on or behind a cycle; walk references until one repeats
+    path: List[str] = []
+    node = pending[0]
+    remaining = set(pending)
+    while node not in path:
+        path.append(node)
+        node = next(ref for ref in graph[node] if ref in remaining)
+    return path[path.index(node):] + [node]
+
+
 class Template(BaseModel):
     """
     Complete template for mapping source data to REDCap format.
@@ -92,14 +195,110 @@ class Template(BaseModel):
     # Global settings
     record_id_column: str = "record_id"  # Column name for patient/record ID
     arm: Optional[str] = None  # Fixed arm or null for runtime selection
+    datadict_hash: Optional[str] = None  # DataDictionary.content_hash() the fields were synced with
     
     fields: List[TemplateField]
+
+    _levels: List[List[str]] = PrivateAttr(default_factory=list)
+
+    @model_validator(mode="after")
+    def _check_field_references(self) -> "Template":
+        """Build the field dependency graph at load time (fails on cycles and dangling references)"""
+        self._levels = dependency_levels(self.fields)
+        return self
+
+    def evaluation_levels(self) -> List[List[str]]:
+        """Field names grouped into levels that can be evaluated in order (each level in parallel)"""
+        return [list(level) for level in self._levels]
+
+    def dependents(self) -> Dict[str, List[str]]:
+        """Reverse dependency graph: field name -> fields referencing it"""
+        names = {f.field_name for f in self.fields}
+        result: Dict[str, List[str]] = {f.field_name: [] for f in self.fields}
+        for field in self.fields:
+            for ref in field_references(field, names):
+                result[ref].append(field.field_name)
+        return result
     
+    def sync_with_datadict(self, datadict: DataDictionary, verbose: bool = False) -> List[str]:
+        """
+        Check the template against a data dictionary via `datadict_hash`. On a mismatch,
+        REDCap metadata is taken over from the dictionary and only the fields whose
+        metadata changed are re-validated. Returns the names of the updated fields.
+        Dictionary fields missing in the template are summarized in one warning
+        (`verbose`: one warning per field).
+        """
+        content_hash = datadict.content_hash()
+        if self.datadict_hash == content_hash:
+            return []
+        metadata_keys = list(DataDictionaryField.model_fields)
+        by_name = {f.field_name: f for f in datadict.fields}
+        changed = []
+        for i, field in enumerate(self.fields):
+            dd_field = by_name.pop(field.field_name, None)
+            if dd_field is None:
+                print(f"Warning: Template field '{field.field_name}' is not in the data dictionary")
+                continue
+            metadata = dd_field.model_dump()
+            if {k: getattr(field, k) for k in metadata_keys} == metadata:
+                continue
+            self.fields[i] = TemplateField.model_validate({**field.model_dump(exclude_unset=True), **metadata})
+            changed.append(field.field_name)
+        if verbose:
+            for name in by_name:
+                print(f"Warning: Data dictionary field '{name}' is missing in the template")
+        elif by_name:
+            examples = ", ".join(list(by_name)[:5])
+            more = ", ..." if len(by_name) > 5 else ""
+            print(f"Warning: {len(by_name)} data dictionary fields are missing in the template ({examples}{more})")
+        if changed:
+            self._levels = dependency_levels(self.fields)
+        self.datadict_hash = content_hash
+        return changed
+
+    @classmethod
+    def merge(cls, templates: List["Template"], name: Optional[str] = None) -> "Template":
+        """
+        One template with the fields of all `templates` (in order), e.g. to evaluate the
+        templates of several form groups in one pass. Fields defined identically in more
+        than one template are kept once; record ID column and arm must agree.
+        """
+        if not templates:
+            raise ValueError("No templates to merge")
+        errors = []
+        for attribute in ("record_id_column", "arm"):
+            values = {getattr(t, attribute) for t in templates} - {None}
+            if len(values) > 1:
+                errors.append(f"Templates disagree on {attribute}: {', '.join(sorted(values))}")
+        fields: Dict[str, TemplateField] = {}
+        origin: Dict[str, str] = {}
+        for template in templates:
+            for field in template.fields:
+                known = fields.get(field.field_name)
+                if known is None:
+                    fields[field.field_name] = field
+                    origin[field.field_name] = template.name
+                elif known.model_dump() != field.model_dump():
+                    errors.append(
+                        f"Field '{field.field_name}' is defined differently in templates "
+                        f"'{origin[field.field_name]}' and '{template.name}'"
+                    )
+        if errors:
+            raise ValueError("Cannot merge templates:\n" + "\n".join(f"- {e}" for e in errors))
+        first = templates[0]
+        return cls(
+            name=name or " + ".join(t.name for t in templates),
+            record_id_column=first.record_id_column,
+            arm=next((t.arm for t in templates if t.arm), None),
+            datadict_hash=first.datadict_hash if len({t.datadict_hash for t in templates}) == 1 else None,
+            fields=list(fields.values()),
+        )
+
     @classmethod
     def from_yaml(cls, file_path: str) -> "Template":
         """Load template from YAML file"""
         with open(file_path, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f)
+            data = yaml.load(f, Loader=YamlLoader)
         # Pydantic handles enum reconstruction from string values automatically
         return cls(**data)
     
@@ -132,6 +331,7 @@ class Template(BaseModel):
         return cls(
             name=name,
             record_id_column="record_id",
+            datadict_hash=datadict.content_hash(),
             fields=fields
         )
 
@@ -1,5 +1,19 @@
+import ast
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from .template import Template, TemplateField, SourceMapping, AggregationMethod, ReferenceMode, field_references, is_mapped
+from .calculation import VARIABLE_PATTERN, expression_variables, compile_expression
+from .profiling import NULL_PROFILER, NullProfiler, TransformProfiler
+from .redcap_project import RedcapProject
+from .routing import RoutingTable, compile_routing
+from .source_table import SourceTable
+from .utils import datetime_parser, to_numeric
+
 
 class DataEntry(BaseModel):
     timestamp: str
@@ -11,4 +25,955 @@ class DataRow(BaseModel):
     redcap_event_name: str
     redcap_repeat_instrument: str
     redcap_repeat_instance: int
-    entries: List[DataEntry]
\ No newline at end of file
+    entries: List[DataEntry]
+
+
+# ============================================================================
+# Query stage
+# ============================================================================
+
+class QueryPredicate(BaseModel):
+    """
+    A query string that can be answered from a partition index.
+    kind: "eq" (column == 'a'), "isin" (column in ['a', 'b']) or
+    "contains" (column.str.contains('pat', case=..., na=..., regex=...)).
+    """
+    column: str
+    kind: str
+    values: List[str] = []
+    pattern: Optional[str] = None
+    case: bool = True
+    regex: bool = True
+    na: bool = False
+
+
+def _str_constant(node: ast.AST) -> Optional[str]:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def _str_list(node: ast.AST) -> Optional[List[str]]:
+    if not isinstance(node, (ast.List, ast.Tuple)):
+        return None
+    values = [_str_constant(elt) for elt in node.elts]
+    if any(v is None for v in values):
+        return None
+    return values
+
+
+def parse_query(query_string: str) -> Optional[QueryPredicate]:
+    """
+    Recognise the query shapes templates use almost exclusively.
+    Returns None for anything else; those queries fall back to DataFrame.query.
+    """
+    try:
+        node = ast.parse(query_string.strip(), mode="eval").body
+    except SyntaxError:
+        return None
+
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        left, op, right = node.left, node.ops[0], node.comparators[0]
+        if isinstance(op, ast.Eq) and isinstance(right, ast.Name):
+            left, right = right, left  # 'value' == column
+        if not isinstance(left, ast.Name):
+            return None
+        if isinstance(op, ast.Eq) and _str_constant(right) is not None:
+            return QueryPredicate(column=left.id, kind="eq", values=[_str_constant(right)])
+        # pandas treats `column == [...]` like `column in [...]`
+        if isinstance(op, (ast.Eq, ast.In)) and _str_list(right) is not None:
+            return QueryPredicate(column=left.id, kind="isin", values=_str_list(right))
+        return None
+
+    if isinstance(node, ast.Call):
+        func = node.func
+        if not (
+            isinstance(func, ast.Attribute) and func.attr == "contains"
+            and isinstance(func.value, ast.Attribute) and func.value.attr == "str"
+            and isinstance(func.value.value, ast.Name)
+        ):
+            return None
+        if len(node.args) > 1:
+            return None
+        options: Dict[str, Any] = {}
+        if node.args:
+            options["pat"] = _str_constant(node.args[0])
+        for kw in node.keywords:
+            if kw.arg not in ("pat", "case", "na", "regex"):
+                return None  # e.g. flags=... is left to pandas
+            if not isinstance(kw.value, ast.Constant):
+                return None
+            options[kw.arg] = kw.value.value
+        if not isinstance(options.get("pat"), str):
+            return None
+        na = options.get("na", False)
+        if not isinstance(na, bool):
+            return None
+        return QueryPredicate(
+            column=func.value.value.id,
+            kind="contains",
+            pattern=options["pat"],
+            case=bool(options.get("case", True)),
+            regex=bool(options.get("regex", True)),
+            na=na,
+        )
+
+    return None
+
+
+class PartitionIndex:
+    """
+    One-time partition of a source column: distinct value -> row positions.
+    Predicates are evaluated on the distinct values only and mapped back to rows.
+    """
+    # Above this many matching values a vectorized row mask beats concatenating blocks
+    _MAX_BLOCKS = 64
+
+    def __init__(self, column: pd.Series):
+        codes, uniques = pd.factorize(column, use_na_sentinel=True)
+        if len(uniques) < np.iinfo(np.int32).max:
+            codes = codes.astype(np.int32, copy=False)
+        self.codes = codes
+        self.uniques = pd.Series(uniques, dtype=object)
+        order = np.argsort(codes, kind="stable")
+        n_na = int(np.count_nonzero(codes < 0))
+        self._na_positions = order[:n_na]
+        self._order = order[n_na:]
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def match(self, predicate: QueryPredicate) -> np.ndarray:
+        """Boolean mask over `uniques` for the given predicate."""
+        if predicate.kind == "eq" or predicate.kind == "isin":
+            return self.uniques.isin(predicate.values).to_numpy()
+        return self.uniques.str.contains(
+            predicate.pattern, case=predicate.case, regex=predicate.regex, na=False
+        ).to_numpy(dtype=bool)
+
+    def positions(self, value_mask: np.ndarray, include_na: bool = False) -> np.ndarray:
+        """Sorted row positions whose value matches `value_mask`."""
+        matched = np.flatnonzero(value_mask)
+        if len(matched) > self._MAX_BLOCKS:
+            row_mask = value_mask[np.maximum(self.codes, 0)]
+            if include_na:
+                row_mask |= self.codes < 0
+            else:
+                row_mask &= self.codes >= 0
+            return np.flatnonzero(row_mask)
+        parts = [self._order[self._offsets[c]:self._offsets[c + 1]] for c in matched]
+        if include_na:
+            parts.append(self._na_positions)
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        positions = np.concatenate(parts)
+        if len(parts) > 1:
+            positions.sort()
+        return positions
+
+
+class QueryPlanner:
+    """
+    Answers template query strings against one source frame.
+
+    Equality, membership and `str.contains` predicates are resolved through a
+    partition index built once per column; any other pandas expression falls back
+    to DataFrame.query. Results are memoized per query string, so a query used by
+    several fields (or in both `source` and `calc_vars`) is filtered only once.
+    A precomputed `plan` (query string -> parsed predicate, see `build_query_plan`)
+    skips parsing when the same template runs over many frames.
+    """
+
+    def __init__(self, source: pd.DataFrame, plan: Optional[Dict[str, Optional[QueryPredicate]]] = None):
+        if not source.index.equals(pd.RangeIndex(len(source))):
+            source = source.reset_index(drop=True)
+        self.source = source
+        self.plan: Dict[str, Optional[QueryPredicate]] = dict(plan or {})
+        self._indexes: Dict[str, PartitionIndex] = {}
+        self._positions: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"indexed": 0, "fallback": 0, "hits": 0}
+        self.profiler: TransformProfiler | NullProfiler = NULL_PROFILER
+
+    def index(self, column: str) -> PartitionIndex:
+        if column not in self._indexes:
+            self._indexes[column] = PartitionIndex(self.source[column])
+        return self._indexes[column]
+
+    def positions(self, query_string: Optional[str]) -> np.ndarray:
+        """Row positions in `source` matching the query (all rows for an empty query)."""
+        if not query_string or not query_string.strip():
+            return np.arange(len(self.source))
+        positions = self._positions.get(query_string)
+        if positions is not None:
+            self.stats["hits"] += 1
+            if self.profiler.enabled:
+                self.profiler.cache_lookup(True)
+            return positions
+        with self._lock:
+            positions = self._positions.get(query_string)
+            if positions is None:
+                positions = self._positions[query_string] = self._evaluate(query_string)
+        if self.profiler.enabled:
+            self.profiler.cache_lookup(False)
+        return positions
+
+    def _evaluate(self, query_string: str) -> np.ndarray:
+        if query_string not in self.plan:
+            self.plan[query_string] = parse_query(query_string)
+        predicate = self.plan[query_string]
+        positions = None
+        if predicate is not None and predicate.column in self.source.columns:
+            try:
+                index = self.index(predicate.column)
+                include_na = predicate.kind == "contains" and predicate.na
+                positions = index.positions(index.match(predicate), include_na=include_na)
+                self.stats["indexed"] += 1
+            except (AttributeError, TypeError):
+                positions = None  # non-string column: let pandas decide
+        if positions is None:
+            matched = self.source.query(query_string, engine="python")
+            positions = matched.index.to_numpy()
+            self.stats["fallback"] += 1
+        return positions
+
+    def select(self, query_string: Optional[str], columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Rows matching the query, optionally restricted to `columns`."""
+        frame = self.source if columns is None else self.source[columns]
+        return frame.take(self.positions(query_string))
+
+    def release(self, query_string: str) -> None:
+        """Drop a memoized result once no remaining field needs it."""
+        self._positions.pop(query_string, None)
+
+
+def field_queries(field: TemplateField) -> List[str]:
+    """Query strings a field reads, from `source` and `calc_vars`."""
+    mappings = []
+    if field.source is not None:
+        mappings.append(field.source)
+    if field.calc_vars:
+        mappings.extend(field.calc_vars.values())
+    return [m.query_string for m in mappings if m.constant is None and m.query_string]
+
+
+def collect_queries(template: Template) -> Dict[str, int]:
+    """Count how often each query string is used across `source` and `calc_vars`."""
+    counts: Dict[str, int] = {}
+    for field in template.fields:
+        for query_string in field_queries(field):
+            counts[query_string] = counts.get(query_string, 0) + 1
+    return counts
+
+
+def template_columns(template: Template) -> Optional[List[str]]:
+    """
+    Source columns a template reads: record ID, query_value/timestamp columns,
+    reference columns and columns named in query strings.
+    Returns None if a query cannot be analysed (then every column may be needed).
+    """
+    columns = [template.record_id_column]
+    for field in template.fields:
+        mappings = ([field.source] if field.source else []) + list((field.calc_vars or {}).values())
+        for mapping in mappings:
+            if mapping.constant is not None:
+                continue
+            if mapping.query_string or field.source is mapping:
+                columns.append(mapping.query_value or "value")
+                columns.append(mapping.timestamp or (field.source.timestamp if field.source else None) or "timestamp")
+            if mapping.query_string:
+                try:
+                    tree = ast.parse(mapping.query_string.strip(), mode="eval")
+                except SyntaxError:
+                    return None
+                columns.extend(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+        if field.reference == ReferenceMode.FROM_TIMEPOINT and field.reference_column:
+            columns.append(field.reference_column)
+    return list(dict.fromkeys(columns))
+
+
+def build_query_plan(template: Template) -> Dict[str, Optional[QueryPredicate]]:
+    """Parsed predicate (None = DataFrame.query fallback) for every distinct template query."""
+    return {query_string: parse_query(query_string) for query_string in collect_queries(template)}
+
+
+def plan_queries(source: pd.DataFrame, template: Template) -> QueryPlanner:
+    """Build a planner for `source` and evaluate every distinct template query once."""
+    planner = QueryPlanner(source)
+    for query_string in collect_queries(template):
+        planner.positions(query_string)
+    return planner
+
+
+# ============================================================================
+# Aggregation stage
+# ============================================================================
+
+# Columns of the REDCap import key, in output order
+KEY_COLUMNS = ["record_id", "redcap_event_name", "redcap_repeat_instrument", "redcap_repeat_instance"]
+
+# Suffix of precomputed numeric companion columns (e.g. "value__num", see cache.SourceCache)
+NUMERIC_SUFFIX = "__num"
+
+# Long, columnar equivalent of DataRow/DataEntry: one row per field value
+RESULT_COLUMNS = ["field_name"] + KEY_COLUMNS + ["timestamp", "value"]
+
+_HOUR_NS = 3_600_000_000_000
+_DAY_NS = 24 * _HOUR_NS
+
+# Aggregations that map directly onto a pandas groupby reduction: method -> (input column, reduction)
+_GROUPBY_AGGREGATIONS = {
+    AggregationMethod.FIRST: ("value", "first"),
+    AggregationMethod.LAST: ("value", "last"),
+    AggregationMethod.MEAN: ("num", "mean"),
+    AggregationMethod.MEDIAN: ("num", "median"),
+    AggregationMethod.MIN: ("num", "min"),
+    AggregationMethod.MAX: ("num", "max"),
+    AggregationMethod.SUM: ("num", "sum"),
+    AggregationMethod.COUNT: ("value", "count"),
+    AggregationMethod.ANY: ("truthy", "max"),
+}
+
+
+def to_datetime(values: pd.Series, column: Optional[str] = None) -> pd.Series:
+    """
+    Parse a timestamp column with the formats known to utils.datetime_homogenizer
+    (see utils.DatetimeColumnParser; `column` names the column whose format is cached).
+    """
+    return datetime_parser.parse(values, column)
+
+
+class TransformContext:
+    """
+    Shared, lazily computed state of one transform run: query planner, routing table,
+    record codes, parsed timestamp/value columns and per-record time origins.
+    Cache misses are filled under a lock, so fields may be evaluated from worker threads.
+    `profiler` (see profiling.TransformProfiler) records stages and cache lookups.
+    A compact `SourceTable` source is queried and aggregated as is (categorical codes,
+    parsed timestamps, float values); the original text of value columns is only
+    assembled for selected rows.
+    """
+
+    def __init__(
+        self,
+        source: pd.DataFrame | SourceTable,
+        template: Template,
+        plan: Optional[Dict[str, Optional[QueryPredicate]]] = None,
+        routing: Optional[RoutingTable] = None,
+        profiler: Optional[TransformProfiler] = None,
+        project: Optional[RedcapProject] = None,
+    ):
+        self.template = template
+        self.profiler = profiler or NULL_PROFILER
+        self.table = source if isinstance(source, SourceTable) else None
+        if self.table is not None:
+            source = self.table.frame
+        self.fields: Dict[str, TemplateField] = {f.field_name: f for f in template.fields}
+        self.routing = routing or compile_routing(template, project)
+        self.planner = QueryPlanner(source, plan)
+        self.planner.profiler = self.profiler
+        self.source = self.planner.source
+        record_column = template.record_id_column
+        if record_column not in self.source.columns:
+            raise ValueError(f"Record ID column '{record_column}' not found in source data")
+        codes, labels = pd.factorize(self.source[record_column], use_na_sentinel=True)
+        self.record_codes = codes
+        self.record_labels = pd.Index(np.asarray(labels))
+        self.results: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.RLock()
+        self._raw: Dict[str, np.ndarray] = {}
+        self._timestamps: Dict[str, np.ndarray] = {}
+        self._numeric: Dict[str, np.ndarray] = {}
+        self._origins: Dict[str, np.ndarray] = {}
+        self._references: Dict[str, np.ndarray] = {}
+
+    def _cached(self, store: Dict[str, Any], key: str, compute) -> Any:
+        hit = key in store
+        if not hit:
+            with self._lock:
+                if key not in store:
+                    store[key] = compute()
+        if self.profiler.enabled:
+            self.profiler.cache_lookup(hit)
+        return store[key]
+
+    def raw(self, column: str) -> np.ndarray:
+        if self.table is not None and column in self.table.text:
+            return self._cached(self._raw, column, lambda: self.table.raw(column))
+        return self._cached(self._raw, column, lambda: self.source[column].to_numpy(dtype=object))
+
+    def raw_at(self, column: str, positions: np.ndarray) -> np.ndarray:
+        """Raw values of `column` at row positions (value columns of a SourceTable are read from their text codes)"""
+        if self.table is not None and column in self.table.text:
+            return self.table.raw(column, positions)
+        return self.raw(column)[positions]
+
+    def timestamps(self, column: str) -> np.ndarray:
+        return self._cached(self._timestamps, column, lambda: to_datetime(self.source[column], column).to_numpy())
+
+    def numeric(self, column: str) -> np.ndarray:
+        def compute():
+            if column + NUMERIC_SUFFIX in self.source.columns:
+                return self.source[column + NUMERIC_SUFFIX].to_numpy(dtype=float)
+            return to_numeric(self.source[column]).to_numpy(dtype=float)
+        return self._cached(self._numeric, column, compute)
+
+    def origins(self, column: str) -> np.ndarray:
+        """Midnight of each record's first timestamp (calendar_day reference), by record code."""
+        def compute():
+            first = pd.Series(self.timestamps(column)).groupby(self.record_codes).min()
+            origins = np.full(len(self.record_labels), np.datetime64("NaT"), dtype="datetime64[ns]")
+            valid = first.index >= 0
+            origins[first.index[valid]] = first.to_numpy()[valid].astype("datetime64[D]")
+            return origins
+        return self._cached(self._origins, column, compute)
+
+    def reference_times(self, field: TemplateField) -> np.ndarray:
+        """
+        Reference timepoint per record code for `from_timepoint` fields. `reference_column`
+        names either a source column (earliest parsed value per record) or an already
+        processed template field (its first value per record).
+        """
+        column = field.reference_column
+        if not column:
+            raise ValueError(f"Field '{field.field_name}': reference 'from_timepoint' requires a reference_column")
+        def compute():
+            if column in self.source.columns:
+                times = pd.Series(self.timestamps(column)).groupby(self.record_codes).min()
+            elif column in self.results:
+                result = self.results[column]
+                times = to_datetime(result["value"]).groupby(self.record_labels.get_indexer(result["record_id"])).min()
+            else:
+                raise ValueError(
+                    f"Field '{field.field_name}': reference column '{column}' not found in source data or processed fields"
+                )
+            references = np.full(len(self.record_labels), np.datetime64("NaT"), dtype="datetime64[ns]")
+            valid = times.index >= 0
+            references[times.index[valid]] = times.to_numpy()[valid]
+            return references
+        return self._cached(self._references, column, compute)
+
+    def measurements(
+        self, mapping: SourceMapping, default_timestamp: Optional[str] = None, rows: Optional[np.ndarray] = None
+    ) -> pd.DataFrame:
+        """
+        Columnar measurements (record code, ts, raw value, numeric value) for one query,
+        optionally restricted to the source rows where the boolean mask `rows` is set.
+        """
+        positions = self.planner.positions(mapping.query_string)
+        if rows is not None:
+            positions = positions[rows[positions]]
+        value_column = mapping.query_value or "value"
+        timestamp_column = mapping.timestamp or default_timestamp or "timestamp"
+        frame = pd.DataFrame({
+            "record": self.record_codes[positions],
+            "ts": self.timestamps(timestamp_column)[positions] if timestamp_column in self.source.columns
+            else np.full(len(positions), np.datetime64("NaT"), dtype="datetime64[ns]"),
+            "value": self.raw_at(value_column, positions),
+            "num": self.numeric(value_column)[positions],
+        })
+        return frame[frame["record"] >= 0]
+
+
+def _bucket_origins(frame: pd.DataFrame, field: TemplateField, ctx: TransformContext, timestamp_column: str) -> np.ndarray:
+    if field.reference == ReferenceMode.FROM_TIMEPOINT:
+        return ctx.reference_times(field)[frame["record"].to_numpy()]
+    return ctx.origins(timestamp_column)[frame["record"].to_numpy()]
+
+
+def bucket_numbers(frame: pd.DataFrame, field: TemplateField, ctx: TransformContext, timestamp_column: str):
+    """
+    0-based window number of each row relative to its record's origin (-1 = no window)
+    and the window start. Without `time_interval` every record has a single window.
+    """
+    origins = _bucket_origins(frame, field, ctx, timestamp_column)
+    if not field.time_interval:
+        missing = np.isnat(origins) & (field.reference == ReferenceMode.FROM_TIMEPOINT)
+        return np.where(missing, -1, 0), origins
+    interval_ns = int(field.time_interval) * _HOUR_NS
+    valid = ~np.isnat(frame["ts"].to_numpy()) & ~np.isnat(origins)
+    delta = (frame["ts"].to_numpy() - origins).astype("timedelta64[ns]").astype(np.int64)
+    buckets = np.where(valid, delta // interval_ns, -1)
+    return buckets, origins + (buckets * interval_ns).astype("timedelta64[ns]")
+
+
+def assign_buckets(frame: pd.DataFrame, field: TemplateField, ctx: TransformContext, timestamp_column: str) -> pd.DataFrame:
+    """
+    Add `bucket` and `bucket_start` columns (see `bucket_numbers`) and drop rows outside
+    any window. Non-repeating fields keep only the first window. Frames that already
+    carry buckets (calculated from bucketed fields) keep them unless the field sets its
+    own `time_interval`.
+    """
+    frame = frame.copy()
+    if "bucket" in frame.columns and not field.time_interval:
+        return frame
+    buckets, starts = bucket_numbers(frame, field, ctx, timestamp_column)
+    frame["bucket"] = buckets
+    frame["bucket_start"] = starts
+    frame = frame[buckets >= 0]
+    if field.time_interval and not field.repeat_instrument:
+        frame = frame[frame["bucket"] == 0]
+    return frame
+
+
+def filter_outliers(frame: pd.DataFrame, percentile: float) -> pd.DataFrame:
+    """Drop numeric values below/above the per-record `percentile` / `100 - percentile` quantiles."""
+    if not percentile or frame.empty:
+        return frame
+    grouped = frame.groupby("record")["num"]
+    lower = grouped.quantile(percentile / 100.0)
+    upper = grouped.quantile(1.0 - percentile / 100.0)
+    records = frame["record"]
+    num = frame["num"]
+    keep = num.isna() | ((num >= records.map(lower)) & (num <= records.map(upper)))
+    return frame[keep.to_numpy()]
+
+
+def _aggregate_mode(frame: pd.DataFrame) -> pd.Series:
+    """Most frequent raw value per (record, bucket); ties go to the value seen first."""
+    values = frame[frame["value"].notna()]
+    counts = values.groupby(["record", "bucket", "value"], sort=False).size().rename("n").reset_index()
+    counts = counts.sort_values(["record", "bucket", "n"], ascending=[True, True, False], kind="stable")
+    counts = counts.drop_duplicates(["record", "bucket"])
+    return counts.set_index(["record", "bucket"])["value"]
+
+
+def _aggregate_nearest(frame: pd.DataFrame) -> pd.Series:
+    """Value closest in time to the bucket start (the reference timepoint for bucket 0)."""
+    measured = frame[~np.isnat(frame["ts"].to_numpy())].sort_values("ts", kind="stable")
+    targets = (
+        measured[["record", "bucket", "bucket_start"]]
+        .drop_duplicates(["record", "bucket"])
+        .dropna(subset=["bucket_start"])
+        .sort_values("bucket_start", kind="stable")
+    )
+    matched = pd.merge_asof(
+        targets, measured[["record", "bucket", "ts", "value"]],
+        left_on="bucket_start", right_on="ts", by=["record", "bucket"], direction="nearest",
+    )
+    return matched.set_index(["record", "bucket"])["value"].sort_index()
+
+
+def _prepare_groupby_columns(frame: pd.DataFrame) -> pd.DataFrame:
+    # first/last follow time order; `truthy` marks rows that count for `any`
+    frame = frame.sort_values(["record", "bucket", "ts"], kind="stable")
+    frame["truthy"] = (frame["num"].notna() & (frame["num"] != 0)).astype(np.int8)
+    return frame
+
+
+def aggregate_frame(frame: pd.DataFrame, methods: List[AggregationMethod]) -> pd.DataFrame:
+    """
+    Reduce bucketed measurements to one row per (record, bucket) with one column per
+    method (named by the method value). All groupby-able methods share a single
+    `groupby(...).agg(...)` call; `mode` and `nearest` run as their own vectorized pass.
+    """
+    methods = list(dict.fromkeys(methods))
+    frame = _prepare_groupby_columns(frame)
+    spec = {"bucket_start": ("bucket_start", "first")}
+    for method in methods:
+        if method in _GROUPBY_AGGREGATIONS:
+            spec[method.value] = _GROUPBY_AGGREGATIONS[method]
+    if AggregationMethod.SUM in methods:
+        spec["_num_count"] = ("num", "count")
+    table = frame.groupby(["record", "bucket"], sort=True).agg(**spec)
+    if "_num_count" in table:
+        # sum over buckets without any numeric value stays empty instead of 0
+        table[AggregationMethod.SUM.value] = table[AggregationMethod.SUM.value].where(table.pop("_num_count") > 0)
+    if AggregationMethod.MODE in methods:
+        table[AggregationMethod.MODE.value] = _aggregate_mode(frame)
+    if AggregationMethod.NEAREST in methods:
+        table[AggregationMethod.NEAREST.value] = _aggregate_nearest(frame)
+    return table
+
+
+def field_result(field: TemplateField, values: pd.Series, bucket_starts: pd.Series, ctx: TransformContext) -> pd.DataFrame:
+    """
+    Stamp REDCap key columns onto aggregated values indexed by (record code, bucket).
+    Event and instrument come from the routing table as categorical columns;
+    instances are numbered from the bucket (bucket 0 -> instance 1).
+    """
+    values = values.dropna() if field.aggregation in (AggregationMethod.MODE, AggregationMethod.NEAREST) else values
+    records = values.index.get_level_values("record").to_numpy()
+    buckets = values.index.get_level_values("bucket").to_numpy()
+    if ctx.routing.is_repeating(field.field_name):
+        instances = pd.array(buckets + 1, dtype="Int64")
+    else:
+        instances = pd.arrays.IntegerArray(np.zeros(len(values), dtype=np.int64), np.ones(len(values), dtype=bool))
+    return pd.DataFrame({
+        "field_name": field.field_name,
+        "record_id": ctx.record_labels.take(records),
+        **ctx.routing.key_columns(field.field_name, len(values)),
+        "redcap_repeat_instance": instances,
+        "timestamp": bucket_starts.reindex(values.index).to_numpy(),
+        "value": values.to_numpy(dtype=object),
+    }, columns=RESULT_COLUMNS)
+
+
+def fusion_key(field: TemplateField) -> tuple:
+    """
+    Fields with equal keys read the same measurements into the same buckets and
+    differ only in their aggregation, so they can share one groupby pass.
+    """
+    source = field.source
+    return (
+        source.query_string,
+        source.query_value or "value",
+        source.timestamp or "timestamp",
+        field.time_interval or None,
+        field.reference or ReferenceMode.CALENDAR_DAY,
+        field.reference_column if field.reference == ReferenceMode.FROM_TIMEPOINT else None,
+        field.outlier_filter or None,
+        bool(field.repeat_instrument),
+    )
+
+
+def fuse_fields(fields: List[TemplateField]) -> List[List[TemplateField]]:
+    """Group query-based fields by `fusion_key`, keeping template order."""
+    groups: Dict[tuple, List[TemplateField]] = {}
+    for field in fields:
+        groups.setdefault(fusion_key(field), []).append(field)
+    return list(groups.values())
+
+
+def aggregate_group(fields: List[TemplateField], frame: pd.DataFrame, ctx: TransformContext) -> List[pd.DataFrame]:
+    """
+    Aggregation stage for fields sharing a `fusion_key`, in a single vectorized pass:
+    bucket assignment, outlier mask, one groupby over (record, bucket) computing every
+    requested aggregation, then scatter to per-field results (RESULT_COLUMNS layout).
+    """
+    lead = fields[0]
+    timestamp_column = (lead.source.timestamp if lead.source else None) or "timestamp"
+    frame = assign_buckets(frame, lead, ctx, timestamp_column)
+    frame = filter_outliers(frame, lead.outlier_filter)
+    if frame.empty:
+        return [pd.DataFrame(columns=RESULT_COLUMNS) for _ in fields]
+    for field in fields:
+        if field.aggregation == AggregationMethod.NEAREST and field.reference != ReferenceMode.FROM_TIMEPOINT:
+            print(f"Warning: Field '{field.field_name}': 'nearest' is meant for from_timepoint; using bucket start as target")
+    methods = [field.aggregation or AggregationMethod.FIRST for field in fields]
+    table = aggregate_frame(frame, methods)
+    return [
+        field_result(field, table[method.value], table["bucket_start"], ctx)
+        for field, method in zip(fields, methods)
+    ]
+
+
+def aggregate_field(field: TemplateField, frame: pd.DataFrame, ctx: TransformContext) -> pd.DataFrame:
+    """Aggregation stage for a single field; see `aggregate_group`."""
+    return aggregate_group([field], frame, ctx)[0]
+
+
+def to_data_rows(results: pd.DataFrame) -> List[DataRow]:
+    """Materialize long results as DataRow objects (one entry per row); for inspection only."""
+    rows = []
+    for rec in results.to_dict("records"):
+        instance = rec["redcap_repeat_instance"]
+        timestamp = rec["timestamp"]
+        rows.append(DataRow(
+            field_name=rec["field_name"],
+            record_id=str(rec["record_id"]),
+            redcap_event_name=rec["redcap_event_name"],
+            redcap_repeat_instrument=rec["redcap_repeat_instrument"],
+            redcap_repeat_instance=0 if pd.isna(instance) else int(instance),
+            entries=[DataEntry(timestamp="" if pd.isna(timestamp) else str(timestamp), value=rec["value"])],
+        ))
+    return rows
+
+
+# ============================================================================
+# Pivot
+# ============================================================================
+
+def output_fields(template: Template) -> List[TemplateField]:
+    """Fields that become columns of the wide output: mapped and visible, in template order."""
+    return [f for f in template.fields if f.visible is not False and is_mapped(f)]
+
+
+def pivot_wide(results: List[pd.DataFrame], template: Template) -> pd.DataFrame:
+    """
+    Long field results -> one row per REDCap key, one column per output field
+    (columns are always the same for a template, even if a field produced no values).
+    `count`/`any` fields read 0 on rows of their own event/instrument without data.
+    """
+    visible = output_fields(template)
+    names = [f.field_name for f in visible]
+    frames = [r for r in results if not r.empty]
+    long = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=RESULT_COLUMNS)
+    long = long[long["field_name"].isin(names)]
+    if long.empty:
+        return pd.DataFrame(columns=KEY_COLUMNS + names)
+    long["redcap_repeat_instance"] = long["redcap_repeat_instance"].fillna(0)
+    wide = long.set_index(KEY_COLUMNS + ["field_name"])["value"].unstack("field_name")
+    wide = wide.reindex(columns=names).sort_index().reset_index()
+    for column in ("redcap_event_name", "redcap_repeat_instrument"):
+        wide[column] = wide[column].astype(str)
+    for field in visible:
+        if field.aggregation in (AggregationMethod.COUNT, AggregationMethod.ANY):
+            own_rows = (
+                (wide["redcap_event_name"] == (field.event_name or ""))
+                & (wide["redcap_repeat_instrument"] == (field.repeat_instrument or ""))
+            )
+            wide.loc[own_rows, field.field_name] = wide.loc[own_rows, field.field_name].fillna(0)
+    instances = wide["redcap_repeat_instance"].astype("Int64")
+    wide["redcap_repeat_instance"] = instances.where(instances != 0, pd.NA)
+    wide.columns.name = None
+    return wide[KEY_COLUMNS + names]
+
+
+# ============================================================================
+# Calculation stage
+# ============================================================================
+
+def _literal(constant: str) -> Any:
+    try:
+        return float(constant.strip().replace(",", "."))
+    except ValueError:
+        return constant
+
+
+def _calc_values(num: np.ndarray, raw: np.ndarray) -> np.ndarray:
+    """Variable values for calculations: numeric where parseable, raw value otherwise."""
+    return np.where(np.isnan(num), raw, num.astype(object))
+
+
+def _reference_frame(name: str, ctx: TransformContext) -> pd.DataFrame:
+    """A processed field's result as (record code, bucket, bucket_start, var)."""
+    result = ctx.results.get(name)
+    if result is None or result.empty:
+        return pd.DataFrame({"record": pd.Series(dtype=np.int64), "bucket": pd.Series(dtype=np.int64),
+                             "bucket_start": pd.Series(dtype="datetime64[ns]"), "var": pd.Series(dtype=object)})
+    values = result["value"].reset_index(drop=True)
+    return pd.DataFrame({
+        "record": ctx.record_labels.get_indexer(result["record_id"]),
+        "bucket": result["redcap_repeat_instance"].fillna(1).astype(np.int64).to_numpy() - 1,
+        "bucket_start": pd.to_datetime(result["timestamp"]).astype("datetime64[ns]").to_numpy(),
+        "var": _calc_values(to_numeric(values).to_numpy(dtype=float), values.to_numpy(dtype=object)),
+    })
+
+
+def _is_bucketed(name: str, ctx: TransformContext) -> bool:
+    return bool(ctx.fields[name].repeat_instrument)
+
+
+def _join_reference(base: pd.DataFrame, name: str, ctx: TransformContext) -> np.ndarray:
+    """Value of referenced field `name` for every measurement row of `base`."""
+    ref = _reference_frame(name, ctx)
+    ref_field = ctx.fields[name]
+    if _is_bucketed(name, ctx) and ref_field.time_interval:
+        timestamp_column = (ref_field.source.timestamp if ref_field.source else None) or "timestamp"
+        keys = base[["record"]].copy()
+        keys["bucket"] = bucket_numbers(base, ref_field, ctx, timestamp_column)[0]
+        on = ["record", "bucket"]
+    else:
+        keys = base[["record"]]
+        ref = ref.sort_values(["record", "bucket"], kind="stable").drop_duplicates("record")
+        on = ["record"]
+    return keys.merge(ref[on + ["var"]], on=on, how="left")["var"].to_numpy(dtype=object)
+
+
+def _reference_rows(refs: Dict[str, str], ctx: TransformContext):
+    """
+    Rows for calculations over field references only: the union of the referenced
+    fields' (record, bucket) keys; non-repeating references are broadcast per record.
+    """
+    frames = {var: _reference_frame(name, ctx) for var, name in refs.items()}
+    bucketed = [var for var, name in refs.items() if _is_bucketed(name, ctx)]
+    if bucketed:
+        base = pd.concat([frames[var][["record", "bucket", "bucket_start"]] for var in bucketed])
+        base = base.drop_duplicates(["record", "bucket"])
+    else:
+        base = pd.concat([frames[var][["record", "bucket_start"]] for var in refs]).drop_duplicates("record")
+        base["bucket"] = 0
+    base = base.sort_values(["record", "bucket"], kind="stable").reset_index(drop=True)
+    base["ts"] = base["bucket_start"]
+    columns = {}
+    for var, frame in frames.items():
+        on = ["record", "bucket"] if var in bucketed else ["record"]
+        if var not in bucketed:
+            frame = frame.drop_duplicates("record")
+        columns[var] = base[on].merge(frame[on + ["var"]], on=on, how="left")["var"].to_numpy(dtype=object)
+    return base, columns
+
+
+def calculate_field(field: TemplateField, ctx: TransformContext) -> pd.DataFrame:
+    """
+    Calculation stage for one field: resolve calc_vars and evaluate calculation_expr per row.
+    - query variables are aligned to the field's own query rows on (record, timestamp)
+      (the first query variable provides the rows if the field has no query);
+    - `{field}` references are looked up per record, or per window for bucketed fields;
+    - other constants are literals.
+    The expression is compiled once and evaluated column-wise (see calculation.compile_expression).
+    Returns measurements ready for aggregation (record, ts, value, num[, bucket, bucket_start]).
+    """
+    source = field.source or SourceMapping()
+    calc_vars = dict(field.calc_vars or {})
+    for name in expression_variables(field.calculation_expr):
+        calc_vars.setdefault(name, SourceMapping(constant=f"{{{name}}}"))  # direct field reference
+    query_vars = {n: m for n, m in calc_vars.items() if m.constant is None and m.query_string}
+    refs = {n: VARIABLE_PATTERN.fullmatch(m.constant.strip()).group(1) for n, m in calc_vars.items()
+            if m.constant is not None and VARIABLE_PATTERN.fullmatch(m.constant.strip())}
+    constants = {n: _literal(m.constant or "") for n, m in calc_vars.items() if n not in query_vars and n not in refs}
+
+    keys = ["record", "ts"]
+    columns: Dict[str, np.ndarray] = {}
+    row_source = source if source.query_string else next(iter(query_vars.values()), None)
+    if row_source is not None:
+        base = ctx.measurements(row_source, default_timestamp=source.timestamp).reset_index(drop=True)
+        for name, mapping in query_vars.items():
+            if mapping.query_string == row_source.query_string and (mapping.query_value or "value") == (row_source.query_value or "value"):
+                columns[name] = _calc_values(base["num"].to_numpy(), base["value"].to_numpy(dtype=object))
+                continue
+            other = ctx.measurements(mapping, default_timestamp=source.timestamp).drop_duplicates(keys)
+            other["var"] = _calc_values(other["num"].to_numpy(), other["value"].to_numpy(dtype=object))
+            columns[name] = base[keys].merge(other[keys + ["var"]], on=keys, how="left")["var"].to_numpy(dtype=object)
+        for name, ref in refs.items():
+            columns[name] = _join_reference(base, ref, ctx)
+        base = base[keys]
+    elif refs:
+        base, columns = _reference_rows(refs, ctx)
+    else:
+        print(f"Warning: Field '{field.field_name}': calculation has no query or field reference, skipping")
+        return pd.DataFrame(columns=["record", "ts", "value", "num"])
+    for name, value in constants.items():
+        columns[name] = np.full(len(base), value, dtype=object)
+
+    result = compile_expression(field.calculation_expr).columns(columns, len(base))
+    frame = base.copy()
+    frame["value"] = result.to_objects(bool_as_int=True)
+    numeric = result.to_float()
+    frame["num"] = numeric if numeric is not None else to_numeric(frame["value"]).to_numpy(dtype=float)
+    return frame
+
+
+# ============================================================================
+# Scheduler
+# ============================================================================
+
+def _level_tasks(fields: List[TemplateField]) -> List[List[TemplateField]]:
+    """One task per fused group of query fields and per calculated field."""
+    query_fields = [f for f in fields if not f.calculation_expr]
+    return fuse_fields(query_fields) + [[f] for f in fields if f.calculation_expr]
+
+
+def evaluate_task(fields: List[TemplateField], ctx: TransformContext) -> None:
+    """Evaluate one scheduler task and store the field results in `ctx.results`."""
+    profiler = ctx.profiler
+    names = [f.field_name for f in fields]
+    if fields[0].calculation_expr:
+        field = fields[0]
+        with profiler.stage(names, "calc") as record:
+            frame = calculate_field(field, ctx)
+            record.rows_out = len(frame)
+        with profiler.stage(names, "aggregate", len(frame)) as record:
+            result = ctx.results[field.field_name] = aggregate_field(field, frame, ctx)
+            record.rows_out = len(result)
+        return
+    with profiler.stage(names, "query", len(ctx.source)) as record:
+        frame = ctx.measurements(fields[0].source)
+        record.rows_out = len(frame)
+    with profiler.stage(names, "aggregate", len(frame)) as record:
+        results = aggregate_group(fields, frame, ctx)
+        for field, result in zip(fields, results):
+            ctx.results[field.field_name] = result
+        record.rows_out = sum(len(r) for r in results)
+
+
+def evaluate_fields(
+    source: pd.DataFrame | SourceTable,
+    template: Template,
+    max_workers: Optional[int] = None,
+    plan: Optional[Dict[str, Optional[QueryPredicate]]] = None,
+    routing: Optional[RoutingTable] = None,
+    profiler: Optional[TransformProfiler] = None,
+    project: Optional[RedcapProject] = None,
+) -> List[pd.DataFrame]:
+    """
+    Query, calculation and aggregation stages for all mapped fields; returns the long
+    field results (RESULT_COLUMNS layout) in template order.
+
+    Fields are evaluated along the template's dependency graph, one topological level
+    at a time; the tasks of a level run on a thread pool (`max_workers=1` runs serially).
+    Memoized queries and results of hidden fields are dropped as soon as the last
+    field needing them has finished. `plan` is an optional precomputed query plan,
+    `routing` a precompiled routing table; without one it is compiled against
+    `project` if given (event, designation and repeating checks), else from the
+    template alone.
+    A `profiler` records every task's stages; one that traces memory or runs cProfile
+    forces serial evaluation.
+    """
+    ctx = TransformContext(source, template, plan, routing, profiler, project)
+    if ctx.profiler.serial:
+        max_workers = 1
+    mapped = {f.field_name for f in template.fields if is_mapped(f)}
+    names = set(ctx.fields)
+    dependents = template.dependents()
+    pending_dependents = {name: sum(d in mapped for d in dependents[name]) for name in names}
+    pending_queries = collect_queries(template)
+
+    def release(name: str) -> None:
+        if pending_dependents[name] == 0 and ctx.fields[name].visible is False:
+            ctx.results.pop(name, None)
+
+    def finished(field: TemplateField) -> None:
+        for query_string in field_queries(field):
+            pending_queries[query_string] -= 1
+            if pending_queries[query_string] == 0:
+                ctx.planner.release(query_string)
+        release(field.field_name)
+        for ref in field_references(field, names):
+            pending_dependents[ref] -= 1
+            release(ref)
+
+    if ctx.profiler.enabled:
+        ctx.profiler.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for level in template.evaluation_levels():
+                fields = [ctx.fields[name] for name in level if name in mapped]
+                futures = {pool.submit(evaluate_task, task, ctx): task for task in _level_tasks(fields)}
+                for future in as_completed(futures):
+                    future.result()
+                    for field in futures[future]:
+                        finished(field)
+    finally:
+        if ctx.profiler.enabled:
+            ctx.profiler.stop()
+    return [ctx.results[f.field_name] for f in template.fields if f.field_name in ctx.results]
+
+
+def evaluate_templates(
+    source: pd.DataFrame | SourceTable,
+    templates: List[Template],
+    max_workers: Optional[int] = None,
+    profiler: Optional[TransformProfiler] = None,
+) -> Dict[str, List[pd.DataFrame]]:
+    """
+    Evaluate several templates over one source in a single pass: the templates are
+    merged (see Template.merge), so the source is indexed and its columns parsed once,
+    a query shared by templates is filtered once and fields with the same query are
+    aggregated together. Returns the field results per template name (template order).
+    """
+    names = [t.name for t in templates]
+    if len(set(names)) < len(names):
+        raise ValueError(f"Template names must be unique: {', '.join(names)}")
+    merged = Template.merge(templates)
+    results = {r["field_name"].iloc[0]: r for r in evaluate_fields(source, merged, max_workers, profiler=profiler) if len(r)}
+    return {
+        template.name: [results[f.field_name] for f in template.fields if f.field_name in results]
+        for template in templates
+    }
+
+
+def transform(
+    source: pd.DataFrame | SourceTable,
+    template: Template,
+    max_workers: Optional[int] = None,
+    plan: Optional[Dict[str, Optional[QueryPredicate]]] = None,
+    routing: Optional[RoutingTable] = None,
+    profiler: Optional[TransformProfiler] = None,
+    project: Optional[RedcapProject] = None,
+) -> pd.DataFrame:
+    """
+    Run the transform pipeline: query -> calc -> aggregate -> pivot
+    (see `evaluate_fields` for the evaluation order and parameters).
+    """
+    return pivot_wide(evaluate_fields(source, template, max_workers, plan, routing, profiler, project), template)
@@ -1,10 +1,56 @@
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any, Tuple
 from enum import Enum
 import re
+import threading
 from datetime import datetime
 
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%m/%d/%Y",
+    "%Y/%m/%d",
+    "%d-%m-%Y",
+    "%m-%d-%Y",
+    "%Y.%m.%d",
+    "%d.%m.%Y",
+    "%m.%d.%Y",
+]
+
+DATETIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%d/%m/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S",
+    "%Y/%m/%d %H:%M:%S",
+    "%d-%m-%Y %H:%M:%S",
+    "%m-%d-%Y %H:%M:%S",
+    "%Y.%m.%d %H:%M:%S",
+    "%d.%m.%Y %H:%M:%S",
+    "%m.%d.%Y %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%d/%m/%Y %H:%M",
+    "%m/%d/%Y %H:%M",
+    "%Y/%m/%d %H:%M",
+    "%d-%m-%Y %H:%M",
+    "%m-%d-%Y %H:%M",
+    "%Y.%m.%d %H:%M",
+    "%d.%m.%Y %H:%M",
+    "%m.%d.%Y %H:%M",
+]
+
+
+def _probe_formats(value: str, formats: List[str]) -> Optional[datetime]:
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
 def date_homogenizer(date_str: str) -> Optional[datetime]:
     """
     Converts various date string formats into a standardized datetime object.
@@ -12,26 +58,7 @@ def date_homogenizer(date_str: str) -> Optional[datetime]:
     """
     if not date_str or not isinstance(date_str, str):
         return None
-
-    date_formats = [
-        "%Y-%m-%d",
-        "%d/%m/%Y",
-        "%m/%d/%Y",
-        "%Y/%m/%d",
-        "%d-%m-%Y",
-        "%m-%d-%Y",
-        "%Y.%m.%d",
-        "%d.%m.%Y",
-        "%m.%d.%Y",
-    ]
-
-    for fmt in date_formats:
-        try:
-            return datetime.strptime(date_str, fmt)
-        except ValueError:
-            continue
-
-    return None
+    return _probe_formats(date_str, DATE_FORMATS)
 
 def datetime_homogenizer(datetime_str: str) -> Optional[datetime]:
     """
@@ -40,33 +67,171 @@ def datetime_homogenizer(datetime_str: str) -> Optional[datetime]:
     """
     if not datetime_str or not isinstance(datetime_str, str):
         return None
+    return _probe_formats(datetime_str, DATETIME_FORMATS)
 
-    datetime_formats = [
-        "%Y-%m-%d %H:%M:%S",
-        "%d/%m/%Y %H:%M:%S",
-        "%m/%d/%Y %H:%M:%S",
-        "%Y/%m/%d %H:%M:%S",
-        "%d-%m-%Y %H:%M:%S",
-        "%m-%d-%Y %H:%M:%S",
-        "%Y.%m.%d %H:%M:%S",
-        "%d.%m.%Y %H:%M:%S",
-        "%m.%d.%Y %H:%M:%S",
-        "%Y-%m-%dT%H:%M:%S",
-        "%Y-%m-%d %H:%M",
-        "%d/%m/%Y %H:%M",
-        "%m/%d/%Y %H:%M",
-        "%Y/%m/%d %H:%M",
-        "%d-%m-%Y %H:%M",
-        "%m-%d-%Y %H:%M",
-        "%Y.%m.%d %H:%M",
-        "%d.%m.%Y %H:%M",
-        "%m.%d.%Y %H:%M",
-    ]
-
-    for fmt in datetime_formats:
-        try:
-            return datetime.strptime(datetime_str, fmt)
-        except ValueError:
-            continue
 
-    return None
+class DatetimeParseReport(BaseModel):
+    column: Optional[str] = None
+    format: Optional[str] = None  # inferred column format, None if no format fits the sample
+    values: int = 0  # non-empty values
+    parsed: int = 0  # parsed with the inferred format
+    other_formats: List[str] = []  # formats inferred for the values the column format misses
+    other: int = 0  # parsed with other_formats
+    fallback: int = 0  # parsed by probing all formats one by one
+    failed: int = 0
+    ambiguous: int = 0  # day and month both <= 12 and different, e.g. "03.04.2025"
+    resolution: Optional[str] = None  # "day_first" / "month_first" for ambiguous values
+
+
+def _swap_day_month(fmt: str) -> str:
+    return fmt.replace("%d", "\0").replace("%m", "%d").replace("\0", "%m")
+
+
+def _day_month_order(fmt: Optional[str]) -> Optional[str]:
+    if not fmt or "%d" not in fmt or "%m" not in fmt:
+        return None
+    return "day_first" if fmt.index("%d") < fmt.index("%m") else "month_first"
+
+
+class DatetimeColumnParser:
+    """
+    Column-level parser for the DATETIME_FORMATS and DATE_FORMATS of the homogenizers.
+
+    The format of a column is inferred from a sample of its distinct values (the format
+    parsing most of them, ties resolved in the homogenizers' order) and cached by column
+    name. The whole column is then parsed at once with `pd.to_datetime(format=...)`.
+    Values that do not match (columns mixing formats) get a format inferred from the
+    remaining values in the same way, repeated while one matches; only values that
+    match no format fall back to probing every format one by one.
+    Ambiguous day/month values ("03.04.2025") are read in the order of the column
+    format, so one column is never parsed half day-first, half month-first.
+    `reports` holds the outcome of the last parse per column.
+    """
+
+    def __init__(self, sample_size: int = 1000):
+        self.sample_size = sample_size
+        self.formats: Dict[str, Optional[str]] = {}
+        self.reports: Dict[str, DatetimeParseReport] = {}
+        self._lock = threading.Lock()
+
+    def infer_format(self, values: pd.Series) -> Optional[str]:
+        """Format parsing most of the sampled distinct values, or None if none parses any."""
+        sample = pd.Series(values.dropna().unique()[: self.sample_size], dtype=object)
+        sample = sample[sample.map(lambda v: isinstance(v, str))]
+        best, best_count = None, 0
+        for fmt in DATETIME_FORMATS + DATE_FORMATS:
+            count = int(pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum())
+            if count > best_count:
+                best, best_count = fmt, count
+            if best_count == len(sample):
+                break
+        return best
+
+    def parse(self, values: pd.Series, column: Optional[str] = None) -> pd.Series:
+        """
+        Parse a text column into datetime64[ns] (NaT where nothing fits).
+        The inferred format is cached under `column`; without a name it is inferred anew.
+        A cached format that no longer fits most values (another file) is inferred again.
+        """
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values.astype("datetime64[ns]")
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        text = pd.Series(uniques, dtype=object)
+        text = text.where(text.map(lambda v: isinstance(v, str) and v != ""), None)
+        # rows per distinct value, to report counts per row rather than per value
+        weights = np.bincount(codes[codes >= 0], minlength=len(text))
+        present = text.notna().to_numpy()
+
+        with self._lock:
+            cached = column is not None and column in self.formats
+            fmt = self.formats.get(column) if cached else None
+        parsed = self._parse_format(text, fmt)
+        if cached and weights[parsed.notna().to_numpy()].sum() * 2 < weights[present].sum():
+            cached = False
+        if not cached:
+            fmt = self.infer_format(text)
+            parsed = self._parse_format(text, fmt)
+            if column is not None:
+                with self._lock:
+                    self.formats[column] = fmt
+        direct = parsed.notna().to_numpy()
+
+        # mixed columns: infer a format for the rest, as long as one still matches
+        by_format = [(fmt, direct)]
+        missing = present & ~direct
+        while missing.any():
+            rest = text[missing]
+            other_fmt = self.infer_format(rest)
+            if other_fmt is None:
+                break
+            matched = self._parse_format(rest, other_fmt)
+            hit = matched.notna().to_numpy()
+            positions = np.flatnonzero(missing)[hit]
+            parsed.iloc[positions] = matched[hit].to_numpy()
+            used = np.zeros(len(text), dtype=bool)
+            used[positions] = True
+            by_format.append((other_fmt, used))
+            missing[positions] = False
+
+        if missing.any():
+            probed = [datetime_homogenizer(u) or date_homogenizer(u) for u in text[missing]]
+            parsed[missing] = pd.to_datetime(pd.Series(probed, dtype=object)).astype("datetime64[ns]").to_numpy()
+
+        ambiguous, order = 0, None
+        for used_fmt, used in by_format:
+            if _day_month_order(used_fmt):
+                swapped = pd.to_datetime(text[used], format=_swap_day_month(used_fmt), errors="coerce")
+                swapped_differs = (swapped.notna() & swapped.ne(parsed[used])).to_numpy()
+                count = int(weights[used][swapped_differs].sum())
+                if count and order is None:
+                    order = _day_month_order(used_fmt)
+                ambiguous += count
+
+        failed = present & parsed.isna().to_numpy()
+        report = DatetimeParseReport(
+            column=column,
+            format=fmt,
+            values=int(weights[present].sum()),
+            parsed=int(weights[direct].sum()),
+            other_formats=[f for f, _ in by_format[1:]],
+            other=int(sum(weights[used].sum() for _, used in by_format[1:])),
+            fallback=int(weights[missing & ~failed].sum()),
+            failed=int(weights[failed].sum()),
+            ambiguous=ambiguous,
+            resolution=order if ambiguous else None,
+        )
+        if column is not None:
+            with self._lock:
+                self.reports[column] = report
+        lookup = np.append(parsed.to_numpy(dtype="datetime64[ns]"), np.datetime64("NaT", "ns"))
+        return pd.Series(lookup[codes], index=values.index)  # code -1 hits the trailing NaT
+
+    @staticmethod
+    def _parse_format(text: pd.Series, fmt: Optional[str]) -> pd.Series:
+        if not fmt:
+            return pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]")
+        return pd.to_datetime(text, format=fmt, errors="coerce").astype("datetime64[ns]")
+
+
+# Shared parser, so column formats are inferred once per process
+datetime_parser = DatetimeColumnParser()
+
+
+def to_numeric(values: pd.Series) -> pd.Series:
+    """Convert a value column to float, accepting German decimal commas ("3,2")."""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.astype(float)
+    text = values.astype(object).where(values.notna(), None).astype(str)
+    text = text.str.strip().str.replace(",", ".", regex=False)
+    return pd.to_numeric(text, errors="coerce").where(values.notna())
+
+
+def sniff_delimiter(header_line: str, candidates: str = ",;\t|") -> str:
+    """
+    Guess the delimiter of a CSV file from its header line: the candidate that occurs
+    most often outside of quoted sections (defaults to ",").
+    """
+    unquoted = re.sub(r'"[^"]*"', "", header_line)
+    counts = {c: unquoted.count(c) for c in candidates}
+    best = max(counts, key=counts.get)
+    return best if counts[best] > 0 else ","
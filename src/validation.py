@@ -0,0 +1,195 @@
+import time
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from typing import Dict, List, Optional, Tuple
+
+from .datadict import DataDictionary, DataDictionaryField, FieldType, ValidationType
+from .template import Template, TemplateField
+from .transform import to_datetime, to_numeric
+
+VIOLATION_COLUMNS = ["record_id", "redcap_event_name", "redcap_repeat_instance", "field_name", "rule", "value"]
+
+# Rules reported in the violation table
+RULE_REQUIRED = "required"  # required field empty on a row of its own event/instrument
+RULE_TYPE = "type"  # value does not fit the validation type
+RULE_MINIMUM = "minimum"
+RULE_MAXIMUM = "maximum"
+RULE_CHOICE = "choice"  # not one of the field's choice codes
+
+_NUMBER_TYPES = {ValidationType.INTEGER, ValidationType.NUMBER, ValidationType.NUMBER_1DP, ValidationType.NUMBER_2DP}
+_DATE_TYPES = {ValidationType.DATE_DMY, ValidationType.DATETIME_DMY}
+_CHOICE_TYPES = {FieldType.RADIO, FieldType.DROPDOWN, FieldType.YESNO}
+_TIME_PATTERN = r"(\d{1,2}):(\d{2})(?::\d{2})?"
+
+
+class ValidationSummary(BaseModel):
+    rows: int = 0
+    cells: int = 0  # non-empty cells checked
+    violations: int = 0
+    by_field: Dict[str, Dict[str, int]] = {}  # field -> rule -> violations
+    seconds: float = 0.0
+
+
+class _FieldRules:
+    """Checks of one output column, prepared once from the field metadata."""
+
+    def __init__(self, field: TemplateField, meta: DataDictionaryField | TemplateField):
+        self.field_name = field.field_name
+        self.event_name = field.event_name or ""
+        self.repeat_instrument = field.repeat_instrument or ""
+        self.required = bool(meta.required_field)
+        self.validation = meta.validation_type
+        self.choices: Optional[np.ndarray] = None
+        if meta.field_type == FieldType.YESNO:
+            self.choices = np.array([0.0, 1.0])
+        elif meta.field_type in _CHOICE_TYPES and meta.choices:
+            self.choices = np.array(sorted(set(meta.choices.values())), dtype=float)
+        self.minimum = self._limit(meta.validation_minimum)
+        self.maximum = self._limit(meta.validation_maximum)
+
+    def _limit(self, limit):
+        """Validation limit as float, Timestamp or minutes of day (time), matching the validation type"""
+        if limit is None or str(limit).strip() == "":
+            return None
+        try:
+            if self.validation in _DATE_TYPES:
+                return pd.Timestamp(str(limit))
+            if self.validation == ValidationType.TIME:
+                hours, minutes = str(limit).split(":")[:2]
+                return int(hours) * 60 + int(minutes)
+            return float(str(limit).replace(",", "."))
+        except ValueError:
+            print(f"Warning: Field '{self.field_name}': ignoring validation limit '{limit}'")
+            return None
+
+    def check(self, values: pd.Series, present: np.ndarray) -> Dict[str, np.ndarray]:
+        """Violation masks per rule for the present (non-empty) values of the column."""
+        masks: Dict[str, np.ndarray] = {}
+        compared = None
+        if self.validation in _NUMBER_TYPES:
+            compared = to_numeric(values).to_numpy(dtype=float)
+            if self.validation == ValidationType.INTEGER:
+                compared = np.round(compared)  # written rounded, see export.format_column
+            masks[RULE_TYPE] = present & np.isnan(compared)
+        elif self.validation in _DATE_TYPES:
+            kind = pd.api.types.infer_dtype(values, skipna=True)
+            if kind.startswith("datetime") or kind == "date":
+                times = pd.to_datetime(values, errors="coerce")
+            else:
+                times = to_datetime(values.astype(object).where(present, None))
+            compared = times.to_numpy(dtype="datetime64[ns]")
+            masks[RULE_TYPE] = present & np.isnat(compared)
+        elif self.validation == ValidationType.TIME:
+            parts = values.astype(object).where(present, None).astype(str).str.extract(f"^{_TIME_PATTERN}$")
+            hours = pd.to_numeric(parts[0], errors="coerce").to_numpy(dtype=float)
+            minutes = pd.to_numeric(parts[1], errors="coerce").to_numpy(dtype=float)
+            with np.errstate(invalid="ignore"):
+                valid = (hours < 24) & (minutes < 60)
+            compared = np.where(valid, hours * 60 + minutes, np.nan)
+            masks[RULE_TYPE] = present & ~valid
+        elif self.validation == ValidationType.ALPHA_ONLY:
+            text = values.astype(object).where(present, None).astype(str)
+            masks[RULE_TYPE] = present & ~text.str.fullmatch(r"[^\W\d_]+").fillna(False).to_numpy(dtype=bool)
+
+        if compared is not None:
+            checked = present & ~masks[RULE_TYPE]
+            if self.minimum is not None:
+                masks[RULE_MINIMUM] = checked & self._compare(compared, self.minimum, np.less)
+            if self.maximum is not None:
+                masks[RULE_MAXIMUM] = checked & self._compare(compared, self.maximum, np.greater)
+        if self.choices is not None:
+            codes = to_numeric(values).to_numpy(dtype=float)
+            masks[RULE_CHOICE] = present & ~np.isin(codes, self.choices)
+        return masks
+
+    @staticmethod
+    def _compare(values: np.ndarray, limit, op) -> np.ndarray:
+        if isinstance(limit, pd.Timestamp):
+            limit = np.datetime64(limit.to_datetime64(), "ns")
+            return op(values, limit) & ~np.isnat(values)
+        with np.errstate(invalid="ignore"):
+            return op(values, limit)
+
+
+class Validator:
+    """
+    Validate wide output (see transform.pivot_wide) against the Data Dictionary:
+    range checks, choice codes, integer/number/date/time formats and required fields,
+    one column at a time with NumPy masks. Metadata comes from `datadict` where it has
+    the field, otherwise from the template field itself.
+
+    `check` can be called repeatedly (e.g. per export block); violations accumulate
+    and are returned by `violations()` (VIOLATION_COLUMNS), counts by `summary()`.
+    """
+
+    def __init__(self, template: Template, datadict: Optional[DataDictionary] = None):
+        metadata = {f.field_name: f for f in datadict.fields} if datadict is not None else {}
+        self.rules = {f.field_name: _FieldRules(f, metadata.get(f.field_name, f)) for f in template.fields}
+        self._parts: List[pd.DataFrame] = []
+        self._summary = ValidationSummary()
+
+    def check(self, wide: pd.DataFrame, fields: Optional[List[str]] = None) -> int:
+        """Check the given (default: all) field columns of `wide`; returns the number of new violations."""
+        started = time.perf_counter()
+        names = [n for n in (fields or list(wide.columns)) if n in self.rules and n in wide.columns]
+        events = wide["redcap_event_name"].fillna("").to_numpy(dtype=object)
+        instruments = wide["redcap_repeat_instrument"].fillna("").to_numpy(dtype=object)
+        own_rows: Dict[Tuple[str, str], np.ndarray] = {}
+        found = 0
+        for name in names:
+            rules = self.rules[name]
+            values = wide[name].reset_index(drop=True)
+            raw = values.to_numpy(dtype=object)
+            present = values.notna().to_numpy().copy()
+            present[present] = raw[present] != ""
+            masks = rules.check(values, present)
+            if rules.required:
+                key = (rules.event_name, rules.repeat_instrument)
+                if key not in own_rows:
+                    own_rows[key] = (events == key[0]) & (instruments == key[1])
+                masks[RULE_REQUIRED] = own_rows[key] & ~present
+            self._summary.cells += int(present.sum())
+            for rule, mask in masks.items():
+                positions = np.flatnonzero(mask)
+                if not len(positions):
+                    continue
+                found += len(positions)
+                counts = self._summary.by_field.setdefault(name, {})
+                counts[rule] = counts.get(rule, 0) + len(positions)
+                self._parts.append(self._table(wide, positions, name, rule, raw))
+        self._summary.rows += len(wide)
+        self._summary.violations += found
+        self._summary.seconds += time.perf_counter() - started
+        return found
+
+    @staticmethod
+    def _table(wide: pd.DataFrame, positions: np.ndarray, name: str, rule: str, raw: np.ndarray) -> pd.DataFrame:
+        instances = wide["redcap_repeat_instance"].iloc[positions].astype("Int64")
+        return pd.DataFrame({
+            "record_id": wide["record_id"].iloc[positions].astype(str).to_numpy(),
+            "redcap_event_name": wide["redcap_event_name"].iloc[positions].astype(str).to_numpy(),
+            "redcap_repeat_instance": instances.where(instances != 0, pd.NA).array,
+            "field_name": name,
+            "rule": rule,
+            "value": pd.Series(raw[positions], dtype=object).where(pd.notna(raw[positions]), "").astype(str).to_numpy(),
+        }, columns=VIOLATION_COLUMNS)
+
+    def violations(self) -> pd.DataFrame:
+        if not self._parts:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS)
+        return pd.concat(self._parts, ignore_index=True)
+
+    def summary(self) -> ValidationSummary:
+        return self._summary.model_copy(deep=True)
+
+
+def validate_wide(
+    wide: pd.DataFrame,
+    template: Template,
+    datadict: Optional[DataDictionary] = None,
+) -> Tuple[pd.DataFrame, ValidationSummary]:
+    """Validate a wide output table; returns the violation table and its summary (see Validator)."""
+    validator = Validator(template, datadict)
+    validator.check(wide)
+    return validator.violations(), validator.summary()
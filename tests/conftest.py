@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.template import Template
+
+ROOT = Path(__file__).resolve().parent.parent
+START = pd.Timestamp("2025-12-26 07:30")
+COLUMNS = ["Patienten-ID", "parameter", "category", "timestamp", "value", "rate"]
+
+
+def make_source(patients: int = 3, hours: int = 48, seed: int = 0, prefix: str = "P") -> pd.DataFrame:
+    """Small PDMS-like long source for the example template (decimal commas, two timestamp formats)"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for p in range(patients):
+        pid = f"{prefix}{p}"
+        stamp = START.strftime("%d.%m.%Y %H:%M")
+        rows.append((pid, "Gewicht", "Stamm", stamp, "80,5", None))
+        rows.append((pid, "Größe", "Stamm", stamp, "180", None))
+        rows.append((pid, "SARS-CoV-2 PCR", "Labor", stamp, "negativ", None))
+        for h in range(hours):
+            t = START + pd.Timedelta(hours=h, minutes=int(rng.integers(0, 50)))
+            ts = t.strftime("%Y-%m-%d %H:%M:%S") if h % 2 else t.strftime("%d.%m.%Y %H:%M")
+            rows.append((pid, "HF [min⁻¹]", "Vital", ts, str(int(rng.integers(60, 120))), None))
+            rows.append((pid, "RR sys [mmHg]", "Vital", ts, str(int(rng.integers(90, 140))), None))
+            rows.append((pid, "RR dia [mmHg]", "Vital", ts, str(int(rng.integers(50, 80))), None))
+            rows.append((pid, "Zentrale Temp", "Vital", ts, f"{rng.uniform(36, 39):.1f}".replace(".", ","), None))
+            rows.append((pid, "Norepinephrin 5mg/50ml", "Medikation", ts, None, f"{rng.uniform(1, 5):.1f}".replace(".", ",")))
+            rows.append((pid, "Kristalloid", "Einfuhr", ts, "100", None))
+            rows.append((pid, "Urin", "Ausfuhr", ts, "80", None))
+            if h % 6 == 0:
+                rows.append((pid, "HB (HGB) [g·dL⁻¹]", "Labor", ts, f"{rng.uniform(7, 12):.1f}".replace(".", ","), None))
+                rows.append((pid, "Augen öffnen", "Neuro", ts, str(int(rng.integers(1, 4))), None))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+@pytest.fixture(scope="session")
+def template() -> Template:
+    return Template.from_yaml(str(ROOT / "templates" / "example_template.yaml"))
+
+
+@pytest.fixture
+def source() -> pd.DataFrame:
+    return make_source()
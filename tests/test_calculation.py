@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+import pytest
+
+from src.calculation import compile_expression, evaluate
+
+ROWS = {
+    "a": [1, 2.5, 0, -8, None, float("nan"), 3, 1e308],
+    "b": [2, 0, 0, 0.5, 1, 0, float("nan"), 10],
+    "s": ["x", "y", None, "x", "z", "", "x", "y"],
+}
+
+EXPRESSIONS = [
+    "{a} + {b}",
+    "{a} - {b} * 2",
+    "{a} / {b}",
+    "{a} // {b}",
+    "{a} % {b}",
+    "{a} ** {b}",
+    "{a} ** 0",
+    "1 ** {b}",
+    "-{a}",
+    "{a} > {b}",
+    "{a} == {b} or {b} > 1",
+    "not {a}",
+    "{a} if {b} else -1",
+    "{'x': 1, 'y': 2}.get({s}, 0)",
+    "{s} == 'x' and {a} > 0",
+    "({a} + 1) * ({b} - 1) / 2",
+]
+
+
+def _same(expected, actual) -> bool:
+    if expected is None or actual is None:
+        return expected is None and actual is None
+    if isinstance(expected, float) and math.isnan(expected):
+        return isinstance(actual, float) and math.isnan(actual)
+    return type(expected) is type(actual) and expected == actual
+
+
+@pytest.mark.parametrize("numeric_dtype", [object, float])
+@pytest.mark.parametrize("expr", EXPRESSIONS)
+def test_compiled_equals_scalar_evaluator(expr, numeric_dtype):
+    length = len(ROWS["a"])
+    columns = {name: np.array(values, dtype=object if name == "s" else numeric_dtype) for name, values in ROWS.items()}
+    compiled = compile_expression(expr)(columns, length)
+    for i in range(length):
+        # a float column carries None as NaN
+        row = {name: columns[name][i].item() if numeric_dtype is float and name != "s" else values[i] for name, values in ROWS.items()}
+        expected = evaluate(expr, row)
+        assert _same(expected, compiled[i]), f"row {i}: {expected!r} != {compiled[i]!r}"
+
+
+def test_missing_operand_propagates():
+    compiled = compile_expression("{a} ** {b}")
+    values = compiled({"a": np.array([np.nan, 1.0]), "b": np.array([0.0, np.nan])})
+    assert list(values) == [None, None]
+    assert evaluate("{a} ** {b}", {"a": -8.0, "b": 0.5}) is None
@@ -0,0 +1,69 @@
+import csv
+
+import numpy as np
+
+from src.delta import DeltaFilter, DeltaIndex, write_delta_csv
+from src.template import Template, TemplateField
+
+HEADER = ["record_id", "redcap_event_name", "redcap_repeat_instrument", "redcap_repeat_instance", "weight", "hr"]
+TEMPLATE = Template(name="t", fields=[
+    TemplateField(field_name="weight", form_name="baseline"),
+    TemplateField(field_name="hr", form_name="vitals"),
+])
+
+
+def _rows(*rows):
+    return np.array(rows, dtype=object)
+
+
+def _write(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return list(csv.reader(f))[1:]
+
+
+PREVIOUS = _rows(
+    ["1", "e1", "", "", "80", "70"],
+    ["2", "e1", "", "", "90", "72"],
+    ["3", "e1", "", "", "70", "75"],
+)
+
+
+def test_keeps_only_new_and_changed_rows():
+    current = _rows(
+        ["1", "e1", "", "", "80", "70"],  # unchanged
+        ["2", "e1", "", "", "90", "99"],  # changed
+        ["4", "e1", "", "", "60", "65"],  # new
+    )
+    delta = DeltaFilter(TEMPLATE, DeltaIndex.from_rows(PREVIOUS, HEADER, TEMPLATE))
+    out = delta.filter(current, HEADER)
+    assert out.tolist() == current[1:].tolist()
+    report = delta.report()
+    assert (report.new, report.changed, report.unchanged, report.removed) == (1, 1, 1, 1)
+
+
+def test_changed_columns_blank_unchanged_forms():
+    current = _rows(["2", "e1", "", "", "90", "99"])
+    delta = DeltaFilter(TEMPLATE, DeltaIndex.from_rows(PREVIOUS, HEADER, TEMPLATE), changed_columns=True)
+    assert delta.filter(current, HEADER).tolist() == [["2", "e1", "", "", "", "99"]]
+    assert delta.report().blanked_cells == 1
+
+
+def test_write_delta_csv_against_saved_index(tmp_path):
+    index = str(tmp_path / "export.idx")
+    first, second, out = tmp_path / "first.csv", tmp_path / "second.csv", tmp_path / "delta.csv"
+    _write(first, PREVIOUS.tolist())
+    assert write_delta_csv(str(first), str(out), index, TEMPLATE).new == 3  # no index yet: every row
+    assert len(_read(out)) == 3
+
+    _write(second, PREVIOUS.tolist()[:2] + [["3", "e1", "", "", "71", "75"]])
+    report = write_delta_csv(str(second), str(out), index, TEMPLATE)
+    assert _read(out) == [["3", "e1", "", "", "71", "75"]]
+    assert (report.changed, report.unchanged) == (1, 2)
+    assert write_delta_csv(str(second), str(out), index, TEMPLATE).written == 0
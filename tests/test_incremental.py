@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from src.incremental import IncrementalTransform
+from src.transform import to_datetime, transform
+
+from conftest import START, make_source
+
+
+def _normalized(wide: pd.DataFrame) -> pd.DataFrame:
+    """Text form of a wide output; floats rounded (merged sums may differ in the last bits)"""
+    def cell(v):
+        if isinstance(v, (float, np.floating, int, np.integer)) and not isinstance(v, bool):
+            return round(float(v), 9)
+        return v
+    return wide.apply(lambda column: column.map(cell)).astype(object).astype(str).reset_index(drop=True)
+
+
+def _deltas(source: pd.DataFrame):
+    """Initial rows and three deltas: in-order rows, new record + untimed rows, late rows"""
+    ts = to_datetime(source["timestamp"])
+    hour = lambda h: START + pd.Timedelta(hours=h)
+    late = (source["Patienten-ID"] == "P0") & (ts >= hour(10)) & (ts < hour(12))
+    initial = source[(ts < hour(36)) & ~late]
+    in_order = source[(ts >= hour(36)) & (ts < hour(48))]
+    untimed = source[(source["Patienten-ID"] == "P1") & (source["parameter"] == "HF [min⁻¹]")].head(2).assign(timestamp=None)
+    new_record = make_source(patients=1, hours=12, seed=2, prefix="N")
+    return initial, [in_order, pd.concat([source[ts >= hour(48)], new_record, untimed]), source[late]]
+
+
+def test_updates_equal_full_transform(template, tmp_path):
+    source = make_source(patients=3, hours=60, seed=1)
+    initial, deltas = _deltas(source)
+    incremental = IncrementalTransform(template)
+    seen = initial
+    assert _normalized(incremental.initialize(initial)).equals(_normalized(transform(seen, template)))
+    for delta in deltas:
+        incremental.update(delta)
+        seen = pd.concat([seen, delta], ignore_index=True)
+        pd.testing.assert_frame_equal(_normalized(incremental.wide()), _normalized(transform(seen, template)))
+
+    incremental.save(str(tmp_path / "checkpoint.pkl"))
+    loaded = IncrementalTransform.load(str(tmp_path / "checkpoint.pkl"), template)
+    pd.testing.assert_frame_equal(_normalized(loaded.wide()), _normalized(incremental.wide()))
+
+
+def test_update_returns_rows_of_delta_records(template):
+    source = make_source(patients=3, hours=24)
+    ts = to_datetime(source["timestamp"])
+    incremental = IncrementalTransform(template)
+    incremental.initialize(source[ts < START + pd.Timedelta(hours=12)])
+    delta = source[(ts >= START + pd.Timedelta(hours=12)) & (source["Patienten-ID"] == "P2")]
+    updated = incremental.update(delta)
+    assert set(updated["record_id"]) == {"P2"}
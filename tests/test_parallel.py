@@ -0,0 +1,17 @@
+import pandas as pd
+
+from src.parallel import decode_columns, encode_columns, parallel_transform
+from src.transform import transform
+from src.utils import datetime_parser
+
+
+def test_parallel_transform_equals_transform(source, template):
+    expected = transform(source, template)
+    datetime_parser.formats.clear()  # workers must not depend on formats cached by the run above
+    result = parallel_transform(source, template, workers=2, shard_size=1)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_columnar_payload_round_trip(source, template):
+    wide = transform(source, template)
+    pd.testing.assert_frame_equal(decode_columns(encode_columns(wide)), wide)
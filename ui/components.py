@@ -1,7 +1,10 @@
 
+import asyncio
 import csv
 import flet as ft
 
+from src.preview import DatasetPreview
+
 
 class TemplateBuilderView:
 	def __init__(self, page: ft.Page, msg_map: dict[str, str]):
@@ -17,10 +20,30 @@ class TemplateBuilderView:
 			on_click=self.handle_file_picked,
 		)
 		self.buttons_column = ft.Column(controls=[self.upload_button])
+		self.progress_bar = ft.ProgressBar(value=0, visible=False)
+		self.preview_page = 0
+		self.preview_table = ft.DataTable(columns=[ft.DataColumn(ft.Text(""))])
+		self.page_label = ft.Text()
+		self.preview_column = ft.Column(
+			controls=[
+				self.preview_table,
+				ft.Row([
+					ft.IconButton(icon=ft.Icons.CHEVRON_LEFT, on_click=lambda e: self.show_page(self.preview_page - 1)),
+					self.page_label,
+					ft.IconButton(icon=ft.Icons.CHEVRON_RIGHT, on_click=lambda e: self.show_page(self.preview_page + 1)),
+				]),
+			],
+			visible=False,
+		)
 
 		page.add(ft.Text("Welcome to the Template Builder!"))
 		page.add(ft.Container(
-			content=ft.Column([self.buttons_column, self.status_msg]),
+			content=ft.Column([
+				self.buttons_column,
+				self.progress_bar,
+				self.status_msg,
+				self.preview_column,
+			]),
 			padding=20,
 		))
 
@@ -31,19 +54,54 @@ class TemplateBuilderView:
 			return
 
 		data = e.control.data
-		with open(file_path, "r", encoding="utf-8") as f:
-			if data == "data_dict" or data == "data_set":
-				reader = csv.DictReader(f)
-				rows = [row for row in reader]
-				self.files[data] = rows
-			elif data == "project_xml":
-				content = f.read()
-				self.files[data] = content
+		self.upload_button.disabled = True
+		self.progress_bar.value = None if data != "data_set" else 0
+		self.progress_bar.visible = True
+		self.page.update()
+		try:
+			# Files are read on a worker thread, so the UI stays responsive
+			self.files[data] = await asyncio.to_thread(self.load_file, data, file_path, asyncio.get_running_loop())
+		finally:
+			self.upload_button.disabled = False
+			self.progress_bar.visible = False
+		if data == "data_set":
+			self.show_page(0)
 
 		self.status_msg.value = self.msg_map.get(data, "Error: Unknown file type.")
 		self.update_button()
 		self.page.update()
 
+	def load_file(self, data: str, file_path: str, loop: asyncio.AbstractEventLoop):
+		"""Runs on a worker thread; the example data set is only sampled and indexed (see DatasetPreview)"""
+		if data == "data_set":
+			def progress(done: float):
+				loop.call_soon_threadsafe(self.set_progress, done)
+			return DatasetPreview(file_path).scan(progress)
+		with open(file_path, "r", encoding="utf-8") as f:
+			if data == "data_dict":
+				return [row for row in csv.DictReader(f)]
+			return f.read()
+
+	def set_progress(self, done: float):
+		self.progress_bar.value = done
+		self.page.update()
+
+	def show_page(self, number: int):
+		"""Show one page of the example data set, read from the file on demand"""
+		preview: DatasetPreview = self.files.get("data_set")
+		if preview is None or not 0 <= number < preview.pages.pages:
+			return
+		self.preview_page = number
+		rows = preview.pages.page(number)
+		self.preview_table.columns = [ft.DataColumn(ft.Text(column)) for column in rows.columns]
+		self.preview_table.rows = [
+			ft.DataRow(cells=[ft.DataCell(ft.Text(str(value))) for value in row])
+			for row in rows.itertuples(index=False)
+		]
+		self.page_label.value = f"Page {number + 1} / {preview.pages.pages} ({preview.rows:,} rows)"
+		self.preview_column.visible = True
+		self.page.update()
+
 	def update_button(self):
 		if not self.files.get("data_dict"):
 			self.upload_button.content = "Upload DataDictionary"